@@ -8,29 +8,51 @@ domika-ha-framework.
 Author(s): Artem Bezborodko
 """
 
-from domika_ha_framework import config
+from domika_ha_framework import admission, config, push_server_client
 from domika_ha_framework.database import core as database_core
+from domika_ha_framework.database import interning
 from domika_ha_framework.database import manage as database_manage
 
 from . import push_data
+from .device import heartbeat, reaper
+from .push_data import flow as push_data_flow
+from .push_data import scheduler as push_data_scheduler
 
 
 async def init(cfg: config.Config):
     """
     Initialize library with config.
 
-    Perform migration if needed.
+    Perform migration if needed, and load interned strings. Create push server client if managed
+    client is enabled. Start push data processor, heartbeat flusher, and push scheduler and device
+    reaper if enabled.
 
     Raise:
         DatabaseError, if can't be initialized.
     """
     config.CONFIG = cfg
+    admission.reset()
     await database_core.init_db()
     await database_manage.migrate()
+    async with database_core.get_session() as db_session:
+        await interning.load(db_session)
+    await push_server_client.init_client()
     push_data.start_push_data_processor()
+    heartbeat.start_heartbeat_flusher()
+    reaper.start_device_reaper()
+    push_data_scheduler.start_push_scheduler()
 
 
 async def dispose():
-    """Clean opened resources and close database connections."""
+    """
+    Clean opened resources, close push server client and database connections.
+
+    Pending device heartbeats are flushed.
+    """
+    await reaper.stop_device_reaper()
+    await push_data_scheduler.stop_push_scheduler()
     await push_data.stop_push_data_processor()
+    await push_data_flow.stop_critical_pushes()
+    await push_server_client.close_client()
+    await heartbeat.stop_heartbeat_flusher()
     await database_core.close_db()
@@ -0,0 +1,183 @@
+# vim: set fileencoding=utf-8
+"""
+Admission control.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+import functools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncGenerator, Awaitable, Callable, Hashable, ParamSpec, TypeVar
+
+from . import config, logger
+
+T = TypeVar("T")
+Param = ParamSpec("Param")
+
+# Admission wait in seconds, after which wait is logged.
+SLOW_ADMISSION = 1
+
+
+@dataclass
+class AdmissionMetrics:
+    """Admission controller metrics."""
+
+    # Number of calls admitted to run.
+    admitted: int = 0
+    # Number of calls that joined identical call already in flight.
+    coalesced: int = 0
+    # Number of calls waiting for admission now.
+    waiting: int = 0
+    # Total and maximum seconds spent waiting for admission.
+    total_wait: float = 0
+    max_wait: float = 0
+
+    @property
+    def mean_wait(self) -> float:
+        """Mean seconds spent waiting for admission."""
+        return self.total_wait / self.admitted if self.admitted else 0
+
+
+class AdmissionController:
+    """
+    Bounded concurrency gate with coalescing of identical in-flight calls.
+
+    Calls with the same key, made while the first one is still in flight, get the result of the
+    first call instead of running again.
+    """
+
+    def __init__(self, concurrency: int):
+        self._concurrency = concurrency
+        self._lane: asyncio.Semaphore | None = None
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self.metrics = AdmissionMetrics()
+
+    async def run(self, key: Hashable | None, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn when admitted, or join identical call in flight.
+
+        If the call in flight is cancelled, joined calls are not cancelled, one of them runs fn
+        instead, and the others join it.
+
+        Args:
+            key: coalescing key. If None - call is never coalesced.
+            fn: function to run.
+
+        Returns:
+            fn result.
+        """
+        if key is not None and (in_flight := self._in_flight.get(key)):
+            self.metrics.coalesced += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if not in_flight.cancelled() or (task and task.cancelling()):
+                    raise
+            # Call in flight was cancelled, but this one was not.
+            return await self.run(key, fn)
+
+        future: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        # Retrieve exception, so it is not reported when there are no coalesced calls.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if key is not None:
+            self._in_flight[key] = future
+
+        try:
+            async with self._admit():
+                result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if key is not None:
+                self._in_flight.pop(key, None)
+
+        future.set_result(result)
+        return result
+
+    @asynccontextmanager
+    async def _admit(self) -> AsyncGenerator[None, None]:
+        if self._lane is None:
+            self._lane = asyncio.Semaphore(self._concurrency)
+
+        self.metrics.waiting += 1
+        started = time.monotonic()
+        try:
+            await self._lane.acquire()
+        finally:
+            self.metrics.waiting -= 1
+
+        wait = time.monotonic() - started
+        self.metrics.admitted += 1
+        self.metrics.total_wait += wait
+        self.metrics.max_wait = max(self.metrics.max_wait, wait)
+        if wait > SLOW_ADMISSION:
+            logger.logger.debug(
+                "Admitted after %.2f seconds, %s calls waiting.",
+                wait,
+                self.metrics.waiting,
+            )
+
+        try:
+            yield
+        finally:
+            self._lane.release()
+
+
+_controller: AdmissionController | None = None
+
+
+def get_controller() -> AdmissionController:
+    """Return admission controller, create it with the actual config if needed."""
+    global _controller  # noqa: PLW0603
+    if _controller is None:
+        _controller = AdmissionController(config.CONFIG.admission_concurrency)
+    return _controller
+
+
+def reset():
+    """Drop admission controller, so it is recreated with the actual config."""
+    global _controller  # noqa: PLW0603
+    _controller = None
+
+
+def get_metrics() -> AdmissionMetrics:
+    """Return admission controller metrics."""
+    return get_controller().metrics
+
+
+def admitted(
+    key_fn: Callable[Param, Hashable | None],
+) -> Callable[[Callable[Param, Awaitable[T]]], Callable[Param, Awaitable[T]]]:
+    """
+    Decorator that runs function through the admission controller.
+
+    Args:
+        key_fn: function that returns coalescing key for the call arguments, or None if the call
+            must not be coalesced.
+
+    Returns:
+        decorating function.
+    """
+
+    def decorating_function(fn: Callable[Param, Awaitable[T]]) -> Callable[Param, Awaitable[T]]:
+        @functools.wraps(fn)
+        async def wrapper(*args: Param.args, **kwargs: Param.kwargs) -> T:
+            return await get_controller().run(
+                key_fn(*args, **kwargs),
+                lambda: fn(*args, **kwargs),
+            )
+
+        return wrapper
+
+    return decorating_function
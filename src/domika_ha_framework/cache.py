@@ -10,11 +10,14 @@ Author(s): Artem Bezborodko
 
 import asyncio
 import functools
+from collections import OrderedDict
 from typing import (
     Any,
     Awaitable,
     Callable,
     Generic,
+    Hashable,
+    NamedTuple,
     ParamSpec,
     TypeVar,
     final,
@@ -22,6 +25,7 @@ from typing import (
 )
 
 T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
 Param = ParamSpec("Param")
 
 
@@ -158,3 +162,70 @@ def cached(
         return functools.update_wrapper(wrapper, wrapped)  # type: ignore
 
     return decorating_function  # type: ignore
+
+
+class CacheInfo(NamedTuple):
+    """Cache statistics."""
+
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class LRUCache(Generic[K, T]):
+    """
+    Bounded cache which evicts least recently used values.
+
+    Counts hits and misses of get calls.
+    """
+
+    def __init__(self, maxsize: int):
+        self._data: OrderedDict[K, T] = OrderedDict()
+        self._maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> T | None:
+        """
+        Get cached value, and mark it as recently used.
+
+        Returns:
+            cached value, or None if there is no value for the key.
+        """
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._data[key]
+
+    def put(self, key: K, value: T):
+        """Cache value, evict least recently used value if cache is full."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K):
+        """Remove cached value if exists."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all cached values, reset statistics."""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> CacheInfo:
+        """
+        Get cache statistics.
+
+        Returns:
+            hits, misses, maximum and current size of the cache.
+        """
+        return CacheInfo(self.hits, self.misses, self._maxsize, len(self._data))
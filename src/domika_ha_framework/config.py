@@ -8,10 +8,29 @@ domika-ha-framework.
 Author(s): Artem Bezborodko
 """
 
-from dataclasses import dataclass
+import ssl
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable
 
 from aiohttp import ClientTimeout
 
+# Device class used when no device class resolver is set, or when resolved class has no own limit.
+DEFAULT_DEVICE_CLASS = "default"
+
+
+@dataclass
+class PushRateLimit:
+    """
+    Token bucket push rate limit.
+
+    Every push for a push session consumes one token. Bucket holds at most capacity tokens and is
+    refilled with refill_rate tokens per second.
+    """
+
+    capacity: float
+    refill_rate: float
+
 
 @dataclass
 class Config:
@@ -20,6 +39,70 @@ class Config:
     database_url: str = ""
     push_server_url: str = ""
     push_server_timeout: ClientTimeout = ClientTimeout(total=10)
+    # Create framework owned push server client on init. Used when no http session passed to the
+    # push server calls.
+    push_server_managed_client: bool = False
+    # Managed push server client connection pool settings.
+    push_server_connection_limit: int = 100
+    push_server_connection_limit_per_host: int = 20
+    push_server_keepalive_timeout: float = 60
+    push_server_dns_cache_ttl: int = 300
+    # TLS context shared by all managed client connections. Default context is created if not set.
+    push_server_ssl_context: ssl.SSLContext | None = None
+    # Derive push server timeouts from observed latency instead of push_server_timeout.
+    push_server_adaptive_timeout: bool = False
+    # Timeout is push_server_timeout_multiplier times latency percentile, limited by floor and
+    # ceiling in seconds.
+    push_server_timeout_percentile: float = 0.99
+    push_server_timeout_multiplier: float = 1.5
+    push_server_timeout_floor: float = 1
+    push_server_timeout_ceiling: float = 10
+    # Number of latest requests per endpoint used for latency percentiles.
+    push_server_latency_window: int = 200
+    # Minimal number of observed requests to use latency percentiles.
+    push_server_latency_min_samples: int = 20
+    # Reissue critical push if it is not finished after hedging percentile latency.
+    push_server_hedging: bool = False
+    push_server_hedging_percentile: float = 0.95
+    # Pack pushes of many push sessions into one bulk push request.
+    push_server_bulk_push: bool = False
+    # Bulk push request limits.
+    push_server_bulk_max_sessions: int = 100
+    push_server_bulk_max_bytes: int = 256 * 1024
+    # Maximum number of push outbox records delivered at once.
+    push_outbox_batch_size: int = 500
+    # Push outbox record is dropped after this number of failed delivery attempts.
+    push_outbox_max_attempts: int = 5
+    # Run push cycles by the framework push scheduler, instead of push_registered_events calls.
+    # Push scheduler uses framework owned push server client, it is created even if
+    # push_server_managed_client is disabled.
+    push_scheduler: bool = False
+    # Seconds between push cycles while there is push data to push.
+    push_scheduler_min_interval: float = 1
+    # Maximum seconds between push cycles while there is no push data.
+    push_scheduler_max_interval: float = 60
+    # Seconds between push data delay decreases by push scheduler. Push data delay counts these
+    # intervals, independently of push cycles.
+    push_scheduler_delay_interval: float = 1
+    # Maximum number of simultaneous critical push requests.
+    critical_push_concurrency: int = 20
+    # Seconds between batched device last_update writes.
+    heartbeat_flush_interval: float = 30
+    # Skip device last_update writes if it was written within this number of seconds. 0 means
+    # every application connection is written.
+    heartbeat_granularity: float = 0
+    # Delete devices which were not connected for this number of seconds. 0 means devices are never
+    # deleted by age.
+    device_max_age: float = 0
+    # Seconds between stale device checks, and number of devices deleted in one transaction.
+    device_reaper_interval: float = 3600
+    device_reaper_batch_size: int = 100
+    # Maximum number of simultaneous app session updates and resubscriptions.
+    admission_concurrency: int = 10
+    # Push rate limits by device class. Empty dict means no rate limiting.
+    push_rate_limits: dict[str, PushRateLimit] = field(default_factory=dict)
+    # Function that returns device class for the given app session id.
+    push_device_class: Callable[[uuid.UUID], str] | None = None
 
 
 CONFIG = Config()
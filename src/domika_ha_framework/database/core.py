@@ -9,8 +9,9 @@ Author(s): Artem Bezborodko
 """
 
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, Callable, Optional
 
+from sqlalchemy import event
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -19,6 +20,7 @@ from sqlalchemy.ext.asyncio import (
     close_all_sessions,
     create_async_engine,
 )
+from sqlalchemy.orm import Session
 
 from .. import config, logger
 from ..errors import DatabaseError
@@ -47,6 +49,10 @@ ENGINE: Optional[AsyncEngine] = None
 AsyncSessionFactory = NullSessionMaker
 
 
+# Session info key of the callbacks to run after commit.
+_AFTER_COMMIT_KEY = "after_commit_callbacks"
+
+
 @asynccontextmanager
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """Return async database session."""
@@ -54,6 +60,33 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+def after_commit(db_session: AsyncSession, callback: Callable[[], None]):
+    """Run callback when session transaction is committed, drop it on rollback."""
+    sync_session = db_session.sync_session
+    callbacks = sync_session.info.get(_AFTER_COMMIT_KEY)
+    if callbacks is None:
+        callbacks = sync_session.info[_AFTER_COMMIT_KEY] = []
+        event.listen(sync_session, "after_commit", _run_after_commit)
+        event.listen(sync_session, "after_rollback", _drop_after_commit)
+    callbacks.append(callback)
+
+
+def has_after_commit(db_session: AsyncSession) -> bool:
+    """Return True if session transaction has callbacks waiting for commit."""
+    return bool(db_session.sync_session.info.get(_AFTER_COMMIT_KEY))
+
+
+def _run_after_commit(sync_session: Session):
+    callbacks = sync_session.info.get(_AFTER_COMMIT_KEY, [])
+    for callback in callbacks:
+        callback()
+    callbacks.clear()
+
+
+def _drop_after_commit(sync_session: Session):
+    sync_session.info.get(_AFTER_COMMIT_KEY, []).clear()
+
+
 async def init_db():
     """
     Initialize database.
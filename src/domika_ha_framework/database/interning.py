@@ -0,0 +1,156 @@
+# vim: set fileencoding=utf-8
+"""
+Interned strings.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+from typing import Any, Iterable
+
+import sqlalchemy
+from sqlalchemy import Dialect, Integer, TypeDecorator
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ..errors import DatabaseError
+from ..models import AsyncBase
+from . import core as database_core
+
+# Id bound for strings which are not interned. Never allocated, so it matches no rows.
+UNKNOWN_ID = -1
+
+# Interned string ids by value, and values by id.
+_ids: dict[str, int] = {}
+_values: dict[int, str] = {}
+# Interned strings which are known to be committed to the database.
+_committed: set[str] = set()
+_next_id = 1
+
+
+class InternedString(AsyncBase):
+    """Strings stored in other tables by integer id."""
+
+    __tablename__ = "interned_strings"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    value: Mapped[str] = mapped_column(unique=True)
+
+
+class Interned(TypeDecorator):
+    """
+    String column stored as interned string id.
+
+    Values are translated by the in-memory mapping, so every written string must be interned with
+    intern first. Strings which are not interned are bound as UNKNOWN_ID.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value: str | None, dialect: Dialect) -> int | None:  # noqa: ARG002
+        """Return interned string id of the value."""
+        if value is None:
+            return None
+        return _ids.get(value, UNKNOWN_ID)
+
+    def process_result_value(self, value: int | None, dialect: Dialect) -> str | None:  # noqa: ARG002
+        """
+        Return interned string by id.
+
+        Raise:
+            errors.DatabaseError: if id is not loaded to the in-memory mapping.
+        """
+        if value is None:
+            return None
+        try:
+            return _values[value]
+        except KeyError:
+            msg = (
+                f"Interned string id {value} is not loaded. Interned strings must be loaded on "
+                "init, and written by this process only."
+            )
+            raise DatabaseError(msg) from None
+
+    @property
+    def python_type(self) -> type[Any]:
+        """Return python type of the column values."""
+        return str
+
+
+def is_interned(value: str) -> bool:
+    """Return True if value has interned string id."""
+    return value in _ids
+
+
+async def load(db_session: AsyncSession):
+    """
+    Load all interned strings from the database.
+
+    Must be called before any interned column is used.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    global _next_id  # noqa: PLW0603
+
+    stmt = sqlalchemy.select(InternedString.id, InternedString.value)
+    try:
+        result = await db_session.execute(stmt)
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    clear()
+    for id_, value in result:
+        _ids[value] = id_
+        _values[id_] = value
+    _committed.update(_ids)
+    _next_id = max(_values, default=0) + 1
+
+
+async def intern(db_session: AsyncSession, values: Iterable[str]):
+    """
+    Allocate interned string ids for values, and write them within session transaction.
+
+    Ids are allocated in memory, and never reused, even if transaction is rolled back. Strings are
+    written until some transaction that writes them is committed.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    global _next_id  # noqa: PLW0603
+
+    uncommitted = {value for value in values if value not in _committed}
+    if not uncommitted:
+        return
+
+    for value in uncommitted:
+        if value not in _ids:
+            _ids[value] = _next_id
+            _values[_next_id] = value
+            _next_id += 1
+
+    stmt = sqlite_dialect.insert(InternedString).on_conflict_do_nothing()
+    try:
+        await db_session.execute(
+            stmt,
+            [{"id": _ids[value], "value": value} for value in uncommitted],
+        )
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    database_core.after_commit(db_session, lambda: _committed.update(uncommitted))
+
+
+def clear():
+    """Drop all interned strings from memory."""
+    global _next_id  # noqa: PLW0603
+
+    _ids.clear()
+    _values.clear()
+    _committed.clear()
+    _next_id = 1
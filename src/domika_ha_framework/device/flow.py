@@ -8,20 +8,33 @@ Application device.
 Author(s): Artem Bezborodko
 """
 
+import asyncio
 import json
 import uuid
 
 import aiohttp
-import sqlalchemy
-from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import config, errors, logger, push_server_errors, statuses
+from .. import errors, logger, push_server_client, push_server_errors, statuses
+from ..admission import admitted
+from . import heartbeat
 from . import service as device_service
-from .models import Device, DomikaDeviceCreate, DomikaDeviceUpdate
+from .models import DomikaDeviceCreate, DomikaDeviceUpdate
 
 
+def _update_app_session_id_key(
+    db_session: AsyncSession,  # noqa: ARG001
+    app_session_id: uuid.UUID | None,
+    user_id: str,
+    push_token_hash: str,
+) -> tuple | None:
+    if not app_session_id:
+        return None
+    return ("update_app_session_id", app_session_id, user_id, push_token_hash)
+
+
+@admitted(_update_app_session_id_key)
 async def update_app_session_id(
     db_session: AsyncSession,
     app_session_id: uuid.UUID | None,
@@ -33,6 +46,7 @@ async def update_app_session_id(
 
     If the session exists - updates its last_update and returns its id. Otherwise, it creates a new
     session and returns its id.
+    Runs through the admission controller, identical updates in flight are coalesced.
 
     Args:
         db_session: sqlalchemy session.
@@ -46,24 +60,18 @@ async def update_app_session_id(
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
+    # Everything is done in a single transaction, so reconnect costs one commit.
     new_app_session_id: uuid.UUID | None = None
 
     if app_session_id:
         # Try to find the proper record.
-        device = await device_service.get(db_session, app_session_id=app_session_id)
+        device = await device_service.get_record(db_session, app_session_id=app_session_id)
 
         if device:
             if device.user_id == user_id:
-                # If found and user_id matches - update last_update.
+                # If found and user_id matches - update last_update with the next heartbeat flush.
                 new_app_session_id = device.app_session_id
-                stmt = sqlalchemy.update(Device)
-                stmt = stmt.where(Device.app_session_id == new_app_session_id)
-                stmt = stmt.values(last_update=func.datetime("now"))
-                try:
-                    await db_session.execute(stmt)
-                    await db_session.commit()
-                except SQLAlchemyError as e:
-                    raise errors.DatabaseError(str(e)) from e
+                heartbeat.touch(new_app_session_id)
             else:
                 # If found but user_id mismatch - remove app_session.
                 logger.logger.debug(
@@ -71,11 +79,11 @@ async def update_app_session_id(
                     user_id,
                     device.user_id,
                 )
-                await device_service.delete(db_session, app_session_id)
+                await device_service.delete(db_session, app_session_id, commit=False)
 
     if not new_app_session_id:
         # If not found - create new one.
-        device = await device_service.create(
+        new_device = await device_service.create(
             db_session,
             DomikaDeviceCreate(
                 app_session_id=uuid.uuid4(),
@@ -83,8 +91,9 @@ async def update_app_session_id(
                 push_session_id=None,
                 push_token_hash=push_token_hash,
             ),
+            commit=False,
         )
-        new_app_session_id = device.app_session_id
+        new_app_session_id = new_device.app_session_id
         logger.logger.debug(
             "Update_app_session_id new app_session_id created: %s.",
             new_app_session_id,
@@ -101,6 +110,12 @@ async def update_app_session_id(
             for device in old_devices
             if device.app_session_id != new_app_session_id
         ]
+
+    try:
+        await db_session.commit()
+    except SQLAlchemyError as e:
+        raise errors.DatabaseError(str(e)) from e
+
     if result_old_app_sessions:
         logger.logger.debug(
             "Update_app_session_id result_old_app_sessions: %s.",
@@ -112,7 +127,7 @@ async def update_app_session_id(
 
 async def remove_push_session(
     db_session: AsyncSession,
-    http_session: aiohttp.ClientSession,
+    http_session: aiohttp.ClientSession | None,
     app_session_id: uuid.UUID,
 ) -> uuid.UUID:
     """
@@ -120,7 +135,7 @@ async def remove_push_session(
 
     Args:
         db_session: sqlalchemy session.
-        http_session: aiohttp session.
+        http_session: aiohttp session. If None - framework owned push server client is used.
         app_session_id: application session id.
 
     Raises:
@@ -133,24 +148,30 @@ async def remove_push_session(
         push_server_errors.UnexpectedServerResponseError: if push server response with unexpected
         status.
     """
-    device = await device_service.get(db_session, app_session_id)
+    device = await device_service.get_record(db_session, app_session_id)
     if not device:
         raise errors.AppSessionIdNotFoundError(app_session_id)
 
     if not device.push_session_id:
         raise errors.PushSessionIdNotFoundError(app_session_id)
     push_session_id = device.push_session_id
+    http_session = push_server_client.get_http_session(http_session)
 
     try:
-        await device_service.update(db_session, device, DomikaDeviceUpdate(push_session_id=None))
+        await device_service.update_in_place(
+            db_session,
+            app_session_id,
+            DomikaDeviceUpdate(push_session_id=None),
+        )
         async with (
-            http_session.delete(
-                f"{config.CONFIG.push_server_url}/push_session",
+            push_server_client.request(
+                http_session,
+                "DELETE",
+                "push_session",
                 headers={
                     # TODO: rename to x-push-session-id
                     "x-session-id": str(push_session_id),
                 },
-                timeout=config.CONFIG.push_server_timeout,
             ) as resp,
         ):
             if resp.status == statuses.HTTP_204_NO_CONTENT:
@@ -167,12 +188,12 @@ async def remove_push_session(
                 raise push_server_errors.PushSessionIdNotFoundError(push_session_id)
 
             raise push_server_errors.UnexpectedServerResponseError(resp.status)
-    except aiohttp.ClientError as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise push_server_errors.DomikaPushServerError(str(e)) from None
 
 
 async def create_push_session(
-    http_session: aiohttp.ClientSession,
+    http_session: aiohttp.ClientSession | None,
     original_transaction_id: str,
     platform: str,
     environment: str,
@@ -183,7 +204,7 @@ async def create_push_session(
     Initialize push session creation flow on the push server.
 
     Args:
-        http_session: aiohttp session.
+        http_session: aiohttp session. If None - framework owned push server client is used.
         original_transaction_id: original transaction id from the application.
         platform: application platform.
         environment: application environment.
@@ -201,10 +222,13 @@ async def create_push_session(
         msg = "One of the parameters is missing"
         raise ValueError(msg)
 
+    http_session = push_server_client.get_http_session(http_session)
     try:
         async with (
-            http_session.post(
-                f"{config.CONFIG.push_server_url}/push_session/create",
+            push_server_client.request(
+                http_session,
+                "POST",
+                "push_session/create",
                 json={
                     "original_transaction_id": original_transaction_id,
                     "platform": platform,
@@ -212,7 +236,6 @@ async def create_push_session(
                     "push_token": push_token,
                     "app_session_id": app_session_id,
                 },
-                timeout=config.CONFIG.push_server_timeout,
             ) as resp,
         ):
             if resp.status == statuses.HTTP_202_ACCEPTED:
@@ -222,13 +245,13 @@ async def create_push_session(
                 raise push_server_errors.BadRequestError(await resp.json())
 
             raise push_server_errors.UnexpectedServerResponseError(resp.status)
-    except aiohttp.ClientError as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise push_server_errors.DomikaPushServerError(str(e)) from None
 
 
 async def verify_push_session(
     db_session: AsyncSession,
-    http_session: aiohttp.ClientSession,
+    http_session: aiohttp.ClientSession | None,
     app_session_id: uuid.UUID,
     verification_key: str,
     push_token_hash: str,
@@ -240,7 +263,7 @@ async def verify_push_session(
 
     Args:
         db_session: sqlalchemy session.
-        http_session: aiohttp session.
+        http_session: aiohttp session. If None - framework owned push server client is used.
         app_session_id: application session id.
         verification_key: verification key.
         push_token_hash: hash of the triplet (push_token, platform, environment)
@@ -258,18 +281,20 @@ async def verify_push_session(
         msg = "One of the parameters is missing"
         raise ValueError(msg)
 
-    device = await device_service.get(db_session, app_session_id)
+    device = await device_service.get_record(db_session, app_session_id)
     if not device:
         raise errors.AppSessionIdNotFoundError(app_session_id)
 
+    http_session = push_server_client.get_http_session(http_session)
     try:
         async with (
-            http_session.post(
-                f"{config.CONFIG.push_server_url}/push_session/verify",
+            push_server_client.request(
+                http_session,
+                "POST",
+                "push_session/verify",
                 json={
                     "verification_key": verification_key,
                 },
-                timeout=config.CONFIG.push_server_timeout,
             ) as resp,
         ):
             if resp.status == statuses.HTTP_201_CREATED:
@@ -290,9 +315,9 @@ async def verify_push_session(
                         device,
                     )
                 # Update push_session_id and push_token_hash.
-                await device_service.update(
+                await device_service.update_in_place(
                     db_session,
-                    device,
+                    app_session_id,
                     DomikaDeviceUpdate(
                         push_session_id=push_session_id,
                         push_token_hash=push_token_hash,
@@ -307,5 +332,5 @@ async def verify_push_session(
                 raise push_server_errors.InvalidVerificationKeyError()
 
             raise push_server_errors.UnexpectedServerResponseError(resp.status)
-    except aiohttp.ClientError as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise push_server_errors.DomikaPushServerError(str(e)) from None
@@ -0,0 +1,151 @@
+# vim: set fileencoding=utf-8
+"""
+Application device.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+import time
+import uuid
+
+from .. import config, logger
+from ..database import core as database_core
+from ..errors import DatabaseError
+from . import service as device_service
+
+# App session ids waiting for last_update flush.
+_touches: set[uuid.UUID] = set()
+# Time of the last flushed touch by app session id, used for touch granularity.
+_flushed: dict[uuid.UUID, float] = {}
+
+_heartbeat_flusher: set[asyncio.Task] = set()
+_heartbeat_flusher_finished = asyncio.Event()
+
+
+def touch(app_session_id: uuid.UUID, now: float | None = None):
+    """
+    Schedule device last_update update with the next flush.
+
+    Touch is skipped if device last_update was flushed within heartbeat_granularity seconds.
+
+    Args:
+        app_session_id: application session id.
+        now: current monotonic time. Defaults to time.monotonic().
+    """
+    granularity = config.CONFIG.heartbeat_granularity
+    if granularity:
+        if now is None:
+            now = time.monotonic()
+        flushed = _flushed.get(app_session_id)
+        if flushed is not None and now - flushed < granularity:
+            return
+
+    _touches.add(app_session_id)
+
+
+def pending() -> set[uuid.UUID]:
+    """Return app session ids waiting for last_update flush."""
+    return set(_touches)
+
+
+async def flush(now: float | None = None) -> int:
+    """
+    Update last_update for all touched devices with a single statement.
+
+    Touches are kept for the next flush if database operation fails.
+
+    Args:
+        now: current monotonic time. Defaults to time.monotonic().
+
+    Returns:
+        number of updated devices.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not _touches:
+        return 0
+
+    if now is None:
+        now = time.monotonic()
+
+    app_session_ids = list(_touches)
+    _touches.difference_update(app_session_ids)
+    try:
+        async with database_core.get_session() as db_session:
+            updated = await device_service.touch_many(db_session, app_session_ids)
+    except DatabaseError:
+        _touches.update(app_session_ids)
+        raise
+
+    granularity = config.CONFIG.heartbeat_granularity
+    if granularity:
+        # Forget devices which are out of granularity window.
+        for app_session_id in [k for k, v in _flushed.items() if now - v >= granularity]:
+            del _flushed[app_session_id]
+        _flushed.update(dict.fromkeys(app_session_ids, now))
+
+    return updated
+
+
+def clear():
+    """Drop all pending touches."""
+    _touches.clear()
+    _flushed.clear()
+
+
+async def _flush_heartbeats(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        task = asyncio.create_task(flush())
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            await task
+            raise
+        except DatabaseError as e:
+            logger.logger.error("Heartbeat flush failed: %s", e)
+
+
+def _done_cb(task: asyncio.Task):
+    _heartbeat_flusher.discard(task)
+    _heartbeat_flusher_finished.set()
+
+
+def start_heartbeat_flusher():
+    """
+    Start new heartbeat flusher task, which flushes touches every heartbeat_flush_interval.
+
+    Do nothing if already started.
+    """
+    if _heartbeat_flusher:
+        return
+
+    _heartbeat_flusher_finished.clear()
+
+    task = asyncio.create_task(_flush_heartbeats(config.CONFIG.heartbeat_flush_interval))
+    _heartbeat_flusher.add(task)
+    task.add_done_callback(_done_cb)
+
+
+async def stop_heartbeat_flusher():
+    """
+    Cancel heartbeat flusher task, and flush remaining touches.
+
+    Do nothing if there is no running heartbeat flusher task.
+    """
+    heartbeat_flusher = next(iter(_heartbeat_flusher), None)
+    if not heartbeat_flusher:
+        return
+
+    heartbeat_flusher.cancel()
+    await _heartbeat_flusher_finished.wait()
+
+    try:
+        await flush()
+    except DatabaseError as e:
+        logger.logger.error("Heartbeat flush failed: %s", e)
@@ -10,11 +10,12 @@ Author(s): Artem Bezborodko
 
 import uuid
 from dataclasses import dataclass, field
+from typing import NamedTuple
 
 from mashumaro import pass_through
 from mashumaro.config import BaseConfig
 from mashumaro.mixins.json import DataClassJSONMixin
-from sqlalchemy import func
+from sqlalchemy import Index, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from ..models import NOT_SET, AsyncBase
@@ -26,14 +27,46 @@ class Device(AsyncBase):
     __tablename__ = 'devices'
 
     app_session_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
-    user_id: Mapped[str]
+    user_id: Mapped[str] = mapped_column(index=True)
     push_session_id: Mapped[uuid.UUID | None] = mapped_column(default=None, nullable=True)
-    push_token_hash: Mapped[str]
+    push_token_hash: Mapped[str] = mapped_column(index=True)
     last_update: Mapped[int] = mapped_column(
         server_default=func.datetime('now'),
         onupdate=func.datetime('now'),
     )
 
+    __table_args__ = (
+        # Only devices with push session are looked up by push_session_id.
+        Index(
+            'ix_devices_push_session_id',
+            push_session_id,
+            sqlite_where=push_session_id.is_not(None),
+        ),
+    )
+
+
+class DeviceRecord(NamedTuple):
+    """
+    Immutable device snapshot.
+
+    last_update is not included, as it changes on every application connection.
+    """
+
+    app_session_id: uuid.UUID
+    user_id: str
+    push_session_id: uuid.UUID | None
+    push_token_hash: str
+
+    @classmethod
+    def from_device(cls, device: Device) -> 'DeviceRecord':
+        """Create snapshot of the device."""
+        return cls(
+            device.app_session_id,
+            device.user_id,
+            device.push_session_id,
+            device.push_token_hash,
+        )
+
 
 @dataclass
 class DomikaDeviceBase(DataClassJSONMixin):
@@ -0,0 +1,159 @@
+# vim: set fileencoding=utf-8
+"""
+Application device.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+from dataclasses import dataclass
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from .. import config, logger
+from ..database import core as database_core
+from ..errors import DatabaseError
+from ..push_data import service as push_data_service
+from ..subscription import service as subscription_service
+from . import heartbeat
+from . import service as device_service
+
+_device_reaper: set[asyncio.Task] = set()
+_device_reaper_finished = asyncio.Event()
+
+
+@dataclass
+class DomikaReapResult:
+    """Number of records deleted by the device reaper."""
+
+    devices: int = 0
+    subscriptions: int = 0
+    push_data: int = 0
+    push_outbox: int = 0
+
+
+async def reap(max_age: float, batch_size: int) -> DomikaReapResult:
+    """
+    Delete devices which last_update is older than max_age seconds.
+
+    Devices are deleted in batches of batch_size, each batch in its own transaction, yielding to
+    the event loop between batches. Subscriptions, pattern subscriptions, subscription versions,
+    push data and push outbox records of deleted devices are deleted in the same transaction.
+    Pending heartbeats are flushed first, so recently connected devices are never deleted.
+
+    Args:
+        max_age: device age in seconds.
+        batch_size: number of devices deleted in one transaction.
+
+    Returns:
+        number of deleted records.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    result = DomikaReapResult()
+
+    await heartbeat.flush()
+
+    while True:
+        async with database_core.get_session() as db_session:
+            app_session_ids = list(
+                await device_service.get_stale(db_session, max_age, limit=batch_size),
+            )
+            if not app_session_ids:
+                break
+
+            result.subscriptions += await subscription_service.delete(
+                db_session,
+                app_session_ids,
+                commit=False,
+            )
+            await subscription_service.delete_patterns(db_session, app_session_ids, commit=False)
+            await subscription_service.delete_versions(db_session, app_session_ids, commit=False)
+            result.push_data += await push_data_service.delete_by_app_session_id(
+                db_session,
+                app_session_ids,
+                commit=False,
+            )
+            result.push_outbox += await push_data_service.delete_outbox_by_app_session_id(
+                db_session,
+                app_session_ids,
+                commit=False,
+            )
+            result.devices += await device_service.delete(
+                db_session,
+                app_session_ids,
+                commit=False,
+            )
+            try:
+                await db_session.commit()
+            except SQLAlchemyError as e:
+                raise DatabaseError(str(e)) from e
+
+        if len(app_session_ids) < batch_size:
+            break
+
+        # Let other tasks use the database between batches.
+        await asyncio.sleep(0)
+
+    if result.devices:
+        logger.logger.debug("Device reaper deleted %s.", result)
+
+    return result
+
+
+async def _reap_devices(interval: float, max_age: float, batch_size: int):
+    while True:
+        task = asyncio.create_task(reap(max_age, batch_size))
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            await task
+            raise
+        except DatabaseError as e:
+            logger.logger.error("Device reaper failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def _done_cb(task: asyncio.Task):
+    _device_reaper.discard(task)
+    _device_reaper_finished.set()
+
+
+def start_device_reaper():
+    """
+    Start new device reaper task, which runs reap every device_reaper_interval.
+
+    Do nothing if device_max_age is not set in config, or already started.
+    """
+    if not config.CONFIG.device_max_age or _device_reaper:
+        return
+
+    _device_reaper_finished.clear()
+
+    task = asyncio.create_task(
+        _reap_devices(
+            config.CONFIG.device_reaper_interval,
+            config.CONFIG.device_max_age,
+            config.CONFIG.device_reaper_batch_size,
+        ),
+    )
+    _device_reaper.add(task)
+    task.add_done_callback(_done_cb)
+
+
+async def stop_device_reaper():
+    """
+    Cancel device reaper task.
+
+    Do nothing if there is no running device reaper task.
+    """
+    device_reaper = next(iter(_device_reaper), None)
+    if not device_reaper:
+        return
+
+    device_reaper.cancel()
+    await _device_reaper_finished.wait()
@@ -8,18 +8,31 @@ Application device.
 Author(s): Artem Bezborodko
 """
 
+import functools
 import uuid
-from typing import Sequence, overload
+from collections.abc import AsyncGenerator, Iterable
+from typing import Sequence
 
 import sqlalchemy
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..cache import CacheKey, cache_key, cached
+from ..cache import LRUCache
 from ..database import core as database_core
 from ..errors import DatabaseError
-from .models import Device, DomikaDeviceCreate, DomikaDeviceUpdate
+from ..utils import chunks
+from .models import Device, DeviceRecord, DomikaDeviceCreate, DomikaDeviceUpdate
+
+# Maximum number of cached device records.
+DEVICE_RECORDS_CACHE_SIZE = 1000
+# Maximum number of app session ids in one bulk lookup query, kept under SQLite variables limit.
+GET_MANY_CHUNK_SIZE = 500
+# Number of devices loaded with one query by iter_all.
+ITER_PAGE_SIZE = 500
+
+# Device columns selected for DeviceRecord, in the record fields order.
+_RECORD_COLUMNS = tuple(getattr(Device, name) for name in DeviceRecord._fields)
 
 
 async def get(db_session: AsyncSession, app_session_id: uuid.UUID) -> Device | None:
@@ -36,6 +49,123 @@ async def get(db_session: AsyncSession, app_session_id: uuid.UUID) -> Device | N
         raise DatabaseError(str(e)) from e
 
 
+async def get_record(db_session: AsyncSession, app_session_id: uuid.UUID) -> DeviceRecord | None:
+    """
+    Get device snapshot by application session id.
+
+    Read through the device records cache. Cached records are invalidated by the device service
+    mutations, so they are never older than the last committed mutation.
+    Use get() if you need ORM object.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    record = _device_records.get(app_session_id)
+    if record:
+        return record
+
+    generation = _device_records_generation
+    stmt = select(*_RECORD_COLUMNS).where(Device.app_session_id == app_session_id)
+    try:
+        row = (await db_session.execute(stmt)).first()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+    if not row:
+        return None
+
+    record = DeviceRecord._make(row)
+    _cache_records(db_session, generation, [record])
+    return record
+
+
+async def get_many(
+    db_session: AsyncSession,
+    app_session_ids: Iterable[uuid.UUID],
+    chunk_size: int = GET_MANY_CHUNK_SIZE,
+) -> dict[uuid.UUID, Device]:
+    """
+    Get devices by application session ids.
+
+    Devices are queried in chunks of chunk_size app session ids.
+
+    Args:
+        db_session: sqlalchemy database session.
+        app_session_ids: application session ids.
+        chunk_size: maximum number of app session ids in one query. Defaults to
+            GET_MANY_CHUNK_SIZE.
+
+    Returns:
+        found devices by app session id. Unknown app session ids are omitted.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    devices: dict[uuid.UUID, Device] = {}
+    try:
+        for chunk in chunks(set(app_session_ids), chunk_size):
+            stmt = select(Device).where(Device.app_session_id.in_(list(chunk)))
+            for device in await db_session.scalars(stmt):
+                devices[device.app_session_id] = device
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return devices
+
+
+async def get_records(
+    db_session: AsyncSession,
+    app_session_ids: Iterable[uuid.UUID],
+    chunk_size: int = GET_MANY_CHUNK_SIZE,
+) -> dict[uuid.UUID, DeviceRecord]:
+    """
+    Get device snapshots by application session ids.
+
+    Read through the device records cache, only cache misses are queried, in chunks of chunk_size
+    app session ids.
+
+    Args:
+        db_session: sqlalchemy database session.
+        app_session_ids: application session ids.
+        chunk_size: maximum number of app session ids in one query. Defaults to
+            GET_MANY_CHUNK_SIZE.
+
+    Returns:
+        found device records by app session id. Unknown app session ids are omitted.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    records: dict[uuid.UUID, DeviceRecord] = {}
+    misses: list[uuid.UUID] = []
+    for app_session_id in set(app_session_ids):
+        record = _device_records.get(app_session_id)
+        if record:
+            records[app_session_id] = record
+        else:
+            misses.append(app_session_id)
+
+    generation = _device_records_generation
+    loaded: list[DeviceRecord] = []
+    try:
+        for chunk in chunks(misses, chunk_size):
+            stmt = select(*_RECORD_COLUMNS).where(Device.app_session_id.in_(list(chunk)))
+            loaded.extend(DeviceRecord._make(row) for row in await db_session.execute(stmt))
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    _cache_records(db_session, generation, loaded)
+    records.update((record.app_session_id, record) for record in loaded)
+    return records
+
+
+def _cache_records(db_session: AsyncSession, generation: int, records: Iterable[DeviceRecord]):
+    # Do not cache uncommitted changes, and records loaded before concurrent invalidation.
+    uncommitted = database_core.has_after_commit(db_session)
+    if generation == _device_records_generation and not uncommitted:
+        for record in records:
+            _device_records.put(record.app_session_id, record)
+
+
 async def get_all(
     db_session: AsyncSession,
     limit: int = 100,
@@ -54,33 +184,145 @@ async def get_all(
         raise DatabaseError(str(e)) from e
 
 
-def _cache_keys(*args, **kwargs) -> CacheKey:
+async def iter_all(
+    db_session: AsyncSession,
+    page_size: int = ITER_PAGE_SIZE,
+) -> AsyncGenerator[Device, None]:
     """
-    Generate cache key, ignoring first arg.
+    Iterate over all devices ordered by app session id.
 
-    Returns:
-        Generated cache key.
+    Devices are loaded by pages of page_size devices. Every page continues from the last loaded
+    app session id, so cost of the page does not depend on the number of devices before it.
+
+    Args:
+        db_session: sqlalchemy database session.
+        page_size: number of devices loaded with one query. Defaults to ITER_PAGE_SIZE.
+
+    Yields:
+        devices.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(Device).order_by(Device.app_session_id).limit(page_size)
+    last_app_session_id: uuid.UUID | None = None
+    while True:
+        page_stmt = stmt
+        if last_app_session_id is not None:
+            page_stmt = stmt.where(Device.app_session_id > last_app_session_id)
+        try:
+            devices = (await db_session.scalars(page_stmt)).all()
+        except SQLAlchemyError as e:
+            raise DatabaseError(str(e)) from e
+
+        if devices:
+            # Take the key before yielding, devices may be expired by the caller.
+            last_app_session_id = devices[-1].app_session_id
+
+        for device in devices:
+            yield device
+
+        if len(devices) < page_size:
+            return
+
+
+_device_records: LRUCache[uuid.UUID, DeviceRecord] = LRUCache(DEVICE_RECORDS_CACHE_SIZE)
+# Incremented on every device records invalidation.
+_device_records_generation = 0
+
+
+def _invalidate_records(app_session_ids: Iterable[uuid.UUID]):
+    global _device_records_generation  # noqa: PLW0603
+    _device_records_generation += 1
+    for app_session_id in app_session_ids:
+        _device_records.pop(app_session_id)
+
+
+def _invalidate_records_on_commit(db_session: AsyncSession, app_session_ids: Iterable[uuid.UUID]):
+    """Invalidate device records now, and when session transaction is committed."""
+    app_session_ids = list(app_session_ids)
+    _invalidate_records(app_session_ids)
+    database_core.after_commit(db_session, functools.partial(_invalidate_records, app_session_ids))
+
+
+class _PushSessionDevices:
     """
-    args = args[1:]
-    return cache_key(*args, **kwargs)
+    Records of devices which have push_session_id, keyed by app_session_id.
+
+    Loaded once, then patched by the device service mutations when their transaction is
+    committed. Patches of rolled back transactions are discarded.
+    """
+
+    def __init__(self):
+        self._devices: dict[uuid.UUID, DeviceRecord] | None = None
+        # Incremented on every committed patch, and on clear.
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._devices) if self._devices is not None else 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._devices is not None
+
+    def values(self) -> list[DeviceRecord]:
+        return list(self._devices.values()) if self._devices is not None else []
+
+    def load(self, devices: Sequence[DeviceRecord]):
+        self._devices = {device.app_session_id: device for device in devices}
+
+    def clear(self):
+        self.generation += 1
+        self._devices = None
+
+    def set_on_commit(self, db_session: AsyncSession, device: DeviceRecord):
+        """Add, update, or remove device depending on its push_session_id, on commit."""
+        record = device if device.push_session_id else None
+        database_core.after_commit(
+            db_session,
+            functools.partial(self._set, device.app_session_id, record),
+        )
+
+    def discard_on_commit(self, db_session: AsyncSession, app_session_ids: Iterable[uuid.UUID]):
+        """Remove devices on commit."""
+        for app_session_id in app_session_ids:
+            database_core.after_commit(
+                db_session,
+                functools.partial(self._set, app_session_id, None),
+            )
 
+    def _set(self, app_session_id: uuid.UUID, device: DeviceRecord | None):
+        self.generation += 1
+        if self._devices is None:
+            return
+        if device:
+            self._devices[app_session_id] = device
+        else:
+            self._devices.pop(app_session_id, None)
 
-@overload
-async def get_all_with_push_session_id() -> Sequence[Device]: ...
 
+_push_session_devices = _PushSessionDevices()
 
-@overload
-async def get_all_with_push_session_id(db_session: AsyncSession) -> Sequence[Device]: ...
 
+async def _get_all_with_push_session_id(db_session: AsyncSession) -> Sequence[DeviceRecord]:
+    stmt = select(*_RECORD_COLUMNS).where(Device.push_session_id.is_not(None))
+    try:
+        return [DeviceRecord._make(row) for row in await db_session.execute(stmt)]
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
 
-@cached(_cache_keys)
-async def get_all_with_push_session_id(db_session: AsyncSession | None = None) -> Sequence[Device]:
+
+async def get_all_with_push_session_id(
+    db_session: AsyncSession | None = None,
+) -> Sequence[DeviceRecord]:
     """
-    Get all devices which have push_session_id.
+    Get records of all devices which have push_session_id.
 
-    If cached value exists - return cached value, load and return cached otherwise.
-    Returned ORM objects are not bound to any database session. So you can't use them for database
-    manipulation. If you need bound objects use .without_cache() from this function.
+    Records are loaded once, then kept up to date by the device service mutations, so loading
+    happens again only after get_all_with_push_session_id.cache_clear() call. Records are not
+    cached if loaded within a transaction with uncommitted device changes, or if device changes
+    were committed while loading. Use .without_cache() from this function to load records from the
+    database.
 
     If db_session is not set - create database session implicitly, .without_cache() make no sense in
     this case.
@@ -92,17 +334,30 @@ async def get_all_with_push_session_id(db_session: AsyncSession | None = None) -
         DatabaseError: in case when database operation can't be performed.
 
     Returns:
-        All devices which have push_session_id set.
+        Records of all devices which have push_session_id set.
     """
+    if _push_session_devices.loaded:
+        return _push_session_devices.values()
+
     if db_session is None:
         async with database_core.get_session() as db_session_:
             return await get_all_with_push_session_id(db_session_)
 
-    stmt = select(Device).where(Device.push_session_id.is_not(None))
-    try:
-        return (await db_session.scalars(stmt)).all()
-    except SQLAlchemyError as e:
-        raise DatabaseError(str(e)) from e
+    generation = _push_session_devices.generation
+    devices = await get_all_with_push_session_id.without_cache(db_session)  # type: ignore
+    # Do not cache uncommitted changes, and devices loaded before concurrent patch.
+    uncommitted = database_core.has_after_commit(db_session)
+    if generation == _push_session_devices.generation and not uncommitted:
+        _push_session_devices.load(devices)
+    return devices
+
+
+get_all_with_push_session_id.without_cache = _get_all_with_push_session_id  # type: ignore
+get_all_with_push_session_id.cache_clear = _push_session_devices.clear  # type: ignore
+get_all_with_push_session_id.cache_size = _push_session_devices.__len__  # type: ignore
+
+get_record.cache_clear = _device_records.clear  # type: ignore
+get_record.cache_info = _device_records.info  # type: ignore
 
 
 async def get_by_user_id(db_session: AsyncSession, user_id: str) -> Sequence[Device]:
@@ -122,16 +377,16 @@ async def get_by_user_id(db_session: AsyncSession, user_id: str) -> Sequence[Dev
 async def get_all_with_push_token_hash(
     db_session: AsyncSession,
     push_token_hash: str,
-) -> Sequence[Device]:
+) -> Sequence[DeviceRecord]:
     """
-    Get all devices with given push_token_hash.
+    Get records of all devices with given push_token_hash.
 
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
-    stmt = select(Device).where(Device.push_token_hash == push_token_hash)
+    stmt = select(*_RECORD_COLUMNS).where(Device.push_token_hash == push_token_hash)
     try:
-        return (await db_session.scalars(stmt)).all()
+        return [DeviceRecord._make(row) for row in await db_session.execute(stmt)]
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
 
@@ -139,7 +394,7 @@ async def get_all_with_push_token_hash(
 async def remove_all_with_push_token_hash(
     db_session: AsyncSession,
     push_token_hash: str,
-    except_device: Device,
+    except_device: Device | DeviceRecord,
     *,
     commit: bool = True,
 ):
@@ -153,13 +408,13 @@ async def remove_all_with_push_token_hash(
         sqlalchemy.delete(Device)
         .where(Device.push_token_hash == push_token_hash)
         .where(Device.app_session_id != except_device.app_session_id)
+        .returning(Device.app_session_id)
     )
 
-    # Cleanup cache.
-    get_all_with_push_session_id.cache_clear()
-
     try:
-        await db_session.execute(stmt)
+        removed = (await db_session.scalars(stmt)).all()
+        _push_session_devices.discard_on_commit(db_session, removed)
+        _invalidate_records_on_commit(db_session, removed)
 
         if commit:
             await db_session.commit()
@@ -182,11 +437,10 @@ async def create(
     device = Device(**device_in.to_dict())
     db_session.add(device)
 
-    # Cleanup cache.
-    get_all_with_push_session_id.cache_clear()
-
     try:
         await db_session.flush()
+        _push_session_devices.set_on_commit(db_session, DeviceRecord.from_device(device))
+        _invalidate_records_on_commit(db_session, [device.app_session_id])
 
         if commit:
             await db_session.commit()
@@ -209,15 +463,16 @@ async def update(
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
-    device_data = device.dict()
     update_data = device_in.to_dict()
 
-    for field in device_data:
-        if field in update_data:
-            if field == "push_session_id":
-                # Cleanup cache.
-                get_all_with_push_session_id.cache_clear()
-            setattr(device, field, update_data[field])
+    # Iterate over columns instead of device.dict(), so expired attributes are never loaded.
+    for column in Device.__table__.columns:
+        if column.name in update_data:
+            setattr(device, column.name, update_data[column.name])
+
+    if "push_session_id" in update_data:
+        _push_session_devices.set_on_commit(db_session, DeviceRecord.from_device(device))
+    _invalidate_records_on_commit(db_session, [device.app_session_id])
 
     try:
         if commit:
@@ -244,13 +499,17 @@ async def update_in_place(
     stmt = sqlalchemy.update(Device)
     stmt = stmt.where(Device.app_session_id == app_session_id)
     update_data = device_in.to_dict()
-    if "push_session_id" in update_data:
-        # Cleanup cache.
-        get_all_with_push_session_id.cache_clear()
     stmt = stmt.values(**update_data)
 
     try:
-        await db_session.execute(stmt)
+        if "push_session_id" in update_data:
+            stmt = stmt.returning(*_RECORD_COLUMNS)
+            row = (await db_session.execute(stmt)).first()
+            if row:
+                _push_session_devices.set_on_commit(db_session, DeviceRecord._make(row))
+        else:
+            await db_session.execute(stmt)
+        _invalidate_records_on_commit(db_session, [app_session_id])
 
         if commit:
             await db_session.commit()
@@ -258,22 +517,115 @@ async def update_in_place(
         raise DatabaseError(str(e)) from e
 
 
-async def delete(db_session: AsyncSession, app_session_id: uuid.UUID, *, commit: bool = True):
+async def touch_many(
+    db_session: AsyncSession,
+    app_session_ids: list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
     """
-    Delete device.
+    Update last_update for all devices with given app session ids.
+
+    Returns:
+        number of updated devices.
 
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
-    stmt = sqlalchemy.delete(Device).where(Device.app_session_id == app_session_id)
+    if not app_session_ids:
+        return 0
 
-    # Cleanup cache.
-    get_all_with_push_session_id.cache_clear()
+    stmt = sqlalchemy.update(Device)
+    stmt = stmt.where(Device.app_session_id.in_(app_session_ids))
+    stmt = stmt.values(last_update=func.datetime("now"))
+
+    try:
+        result = await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
+async def clear_push_session_ids(
+    db_session: AsyncSession,
+    app_session_ids: list[uuid.UUID],
+    *,
+    commit: bool = True,
+):
+    """
+    Clear push_session_id for all devices with given app session ids.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not app_session_ids:
+        return
+
+    stmt = sqlalchemy.update(Device)
+    stmt = stmt.where(Device.app_session_id.in_(app_session_ids))
+    stmt = stmt.values(push_session_id=None)
 
     try:
         await db_session.execute(stmt)
+        _push_session_devices.discard_on_commit(db_session, app_session_ids)
+        _invalidate_records_on_commit(db_session, app_session_ids)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def delete(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID | list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Delete device by app session id, or list of app session id's.
+
+    Returns:
+        number of deleted devices.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    app_session_ids = app_session_id if isinstance(app_session_id, list) else [app_session_id]
+    stmt = sqlalchemy.delete(Device).where(Device.app_session_id.in_(app_session_ids))
+
+    try:
+        result = await db_session.execute(stmt)
+        _push_session_devices.discard_on_commit(db_session, app_session_ids)
+        _invalidate_records_on_commit(db_session, app_session_ids)
 
         if commit:
             await db_session.commit()
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
+async def get_stale(
+    db_session: AsyncSession,
+    max_age: float,
+    limit: int = 100,
+) -> Sequence[uuid.UUID]:
+    """
+    Get app session id's of devices which last_update is older than max_age seconds.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = select(Device.app_session_id)
+    stmt = stmt.where(Device.last_update < func.datetime("now", f"-{int(max_age)} seconds"))
+    stmt = stmt.order_by(Device.last_update).limit(limit)
+    try:
+        return (await db_session.scalars(stmt)).all()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
@@ -33,3 +33,11 @@ class PushSessionIdNotFoundError(DomikaFrameworkBaseError):
     def __init__(self, app_session_id: uuid.UUID):
         super().__init__(f'Push session id is missing for app session id "{app_session_id}".')
         self.app_session_id = app_session_id
+
+
+class InvalidPatternError(DomikaFrameworkBaseError):
+    """Entity pattern is not an entity id prefix followed by "*"."""
+
+    def __init__(self, entity_pattern: str):
+        super().__init__(f'Invalid entity pattern "{entity_pattern}".')
+        self.entity_pattern = entity_pattern
@@ -0,0 +1,78 @@
+"""
+intern entity_id and attribute.
+
+Revision ID: 0b7e4d92f6a1
+Revises: f5a93c1d07b2
+Create Date: 2024-11-08 13:52:04.381907
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0b7e4d92f6a1"
+down_revision: Union[str, None] = "f5a93c1d07b2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("subscriptions", "push_data", "events")
+COLUMNS = ("entity_id", "attribute")
+
+
+def _replace_values(table: str, select_replacement: str):
+    # Table and column names are constants, replacement is selected by the current column value.
+    set_ = ", ".join(
+        f"{column} = ({select_replacement.format(column=f'{table}.{column}')})"
+        for column in COLUMNS
+    )
+    op.execute(f"UPDATE {table} SET {set_}")  # noqa: S608
+
+
+def _has_rows(table: str) -> bool:
+    stmt = sa.select(sa.literal(1)).select_from(sa.table(table)).limit(1)
+    return op.get_bind().execute(stmt).first() is not None
+
+
+def upgrade() -> None:
+    """Upgrade step."""
+    op.create_table(
+        "interned_strings",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("value", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_interned_strings")),
+        sa.UniqueConstraint("value", name=op.f("uq_interned_strings_value")),
+    )
+
+    # Empty tables, e.g. of the new database, need no data migration.
+    tables = [table for table in TABLES if _has_rows(table)]
+    if tables:
+        values = " UNION ".join(
+            f"SELECT {column} FROM {table}"  # noqa: S608
+            for table in tables
+            for column in COLUMNS
+        )
+        op.execute(
+            "INSERT INTO interned_strings (id, value) "  # noqa: S608
+            f"SELECT row_number() OVER (), * FROM ({values})",
+        )
+
+    for table in TABLES:
+        if table in tables:
+            _replace_values(table, "SELECT id FROM interned_strings WHERE value = {column}")
+        with op.batch_alter_table(table) as batch_op:
+            for column in COLUMNS:
+                batch_op.alter_column(column, existing_type=sa.String(), type_=sa.Integer())
+
+
+def downgrade() -> None:
+    """Downgrade step."""
+    for table in TABLES:
+        if _has_rows(table):
+            _replace_values(table, "SELECT value FROM interned_strings WHERE id = {column}")
+        with op.batch_alter_table(table) as batch_op:
+            for column in COLUMNS:
+                batch_op.alter_column(column, existing_type=sa.Integer(), type_=sa.String())
+
+    op.drop_table("interned_strings")
@@ -0,0 +1,44 @@
+"""
+add push outbox.
+
+Revision ID: 5f0a7c2e91d4
+Revises: 58af1c34e1b2
+Create Date: 2024-10-21 12:14:05.417210
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5f0a7c2e91d4"
+down_revision: Union[str, None] = "58af1c34e1b2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade step."""
+    op.create_table(
+        "push_outbox",
+        sa.Column("idempotency_key", sa.String(), nullable=False),
+        sa.Column("app_session_id", sa.Uuid(), nullable=False),
+        sa.Column("push_session_id", sa.Uuid(), nullable=False),
+        sa.Column("payload", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("created", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["app_session_id"],
+            ["devices.app_session_id"],
+            name=op.f("fk_push_outbox_app_session_id_devices"),
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("idempotency_key", name=op.f("pk_push_outbox")),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade step."""
+    op.drop_table("push_outbox")
@@ -0,0 +1,37 @@
+"""
+add devices indexes.
+
+Revision ID: a3c81e5b7d20
+Revises: 5f0a7c2e91d4
+Create Date: 2024-10-24 10:37:52.118406
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a3c81e5b7d20"
+down_revision: Union[str, None] = "5f0a7c2e91d4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade step."""
+    op.create_index(op.f("ix_devices_user_id"), "devices", ["user_id"])
+    op.create_index(op.f("ix_devices_push_token_hash"), "devices", ["push_token_hash"])
+    op.create_index(
+        "ix_devices_push_session_id",
+        "devices",
+        ["push_session_id"],
+        sqlite_where=sa.text("push_session_id IS NOT NULL"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade step."""
+    op.drop_index("ix_devices_push_session_id", table_name="devices")
+    op.drop_index(op.f("ix_devices_push_token_hash"), table_name="devices")
+    op.drop_index(op.f("ix_devices_user_id"), table_name="devices")
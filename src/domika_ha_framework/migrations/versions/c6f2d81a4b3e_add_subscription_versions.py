@@ -0,0 +1,40 @@
+"""
+add subscription versions.
+
+Revision ID: c6f2d81a4b3e
+Revises: a3c81e5b7d20
+Create Date: 2024-10-28 15:02:41.730912
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c6f2d81a4b3e"
+down_revision: Union[str, None] = "a3c81e5b7d20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade step."""
+    op.create_table(
+        "subscription_versions",
+        sa.Column("app_session_id", sa.Uuid(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["app_session_id"],
+            ["devices.app_session_id"],
+            name=op.f("fk_subscription_versions_app_session_id_devices"),
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("app_session_id", name=op.f("pk_subscription_versions")),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade step."""
+    op.drop_table("subscription_versions")
@@ -0,0 +1,31 @@
+"""
+add subscriptions routing index.
+
+Revision ID: e41b7a09c5d8
+Revises: c6f2d81a4b3e
+Create Date: 2024-10-30 11:46:19.254873
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e41b7a09c5d8"
+down_revision: Union[str, None] = "c6f2d81a4b3e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade step."""
+    op.create_index(
+        "ix_subscriptions_entity_id_attribute",
+        "subscriptions",
+        ["entity_id", "attribute", "need_push", "app_session_id"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade step."""
+    op.drop_index("ix_subscriptions_entity_id_attribute", table_name="subscriptions")
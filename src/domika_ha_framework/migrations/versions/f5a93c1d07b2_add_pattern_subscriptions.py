@@ -0,0 +1,47 @@
+"""
+add pattern subscriptions.
+
+Revision ID: f5a93c1d07b2
+Revises: e41b7a09c5d8
+Create Date: 2024-11-04 09:21:37.608145
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f5a93c1d07b2"
+down_revision: Union[str, None] = "e41b7a09c5d8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade step."""
+    op.create_table(
+        "pattern_subscriptions",
+        sa.Column("app_session_id", sa.Uuid(), nullable=False),
+        sa.Column("entity_pattern", sa.String(), nullable=False),
+        sa.Column("attribute", sa.String(), nullable=False),
+        sa.Column("need_push", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["app_session_id"],
+            ["devices.app_session_id"],
+            name=op.f("fk_pattern_subscriptions_app_session_id_devices"),
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint(
+            "app_session_id",
+            "entity_pattern",
+            "attribute",
+            name=op.f("pk_pattern_subscriptions"),
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade step."""
+    op.drop_table("pattern_subscriptions")
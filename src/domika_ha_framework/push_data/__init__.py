@@ -13,7 +13,11 @@ import contextlib
 import datetime
 import uuid
 
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import logger
 from ..database import core as database_core
+from ..errors import DatabaseError
 from ..utils import chunks
 from . import service as push_data_service
 from .models import DomikaPushDataCreate
@@ -21,12 +25,52 @@ from .models import DomikaPushDataCreate
 events_queue = asyncio.Queue(maxsize=5000)
 confirmed_events_queue = asyncio.Queue(maxsize=5000)
 
+# Set when new push data stored.
+push_data_stored = asyncio.Event()
+
+# Confirmations of events which were not found in the events queue. Their push data is deleted by
+# the next store.
+_late_confirmed_events: set[uuid.UUID] = set()
+
 _push_data_processor: set[asyncio.Task] = set()
 _push_data_processor_finished = asyncio.Event()
 
 INTERVAL = 5
 THRESHOLD = 10
 STORE_CHUNK_SIZE = 500
+LATE_CONFIRMED_EVENTS_MAX_SIZE = 5000
+
+
+def _buffer_late_confirmed(event_ids: list[uuid.UUID]):
+    # Buffer is bounded, confirmations over the limit are dropped, and their push data is kept.
+    dropped = 0
+    for event_id in event_ids:
+        if len(_late_confirmed_events) >= LATE_CONFIRMED_EVENTS_MAX_SIZE:
+            dropped += 1
+            continue
+        _late_confirmed_events.add(event_id)
+    if dropped:
+        logger.logger.warning(
+            "%s late event confirmations dropped, %s are pending already.",
+            dropped,
+            LATE_CONFIRMED_EVENTS_MAX_SIZE,
+        )
+
+
+async def _purge_late_confirmed(
+    db_session: AsyncSession,
+    event_ids: list[uuid.UUID],
+    *,
+    commit: bool = True,
+):
+    # Confirmations are removed from the buffer once their push data deletion is committed.
+    if not event_ids:
+        return
+    database_core.after_commit(
+        db_session,
+        lambda: _late_confirmed_events.difference_update(event_ids),
+    )
+    await push_data_service.delete_by_event_id(db_session, event_ids, commit=commit)
 
 
 async def _process_pushed_data_once(
@@ -63,6 +107,9 @@ async def _process_pushed_data_once(
             else:
                 events_to_requeue.append(event)
 
+    # Remaining confirmations came after their events were stored.
+    _buffer_late_confirmed(confirmed_events)
+
     # Requeue events.
     for event in events_to_requeue:
         # QueueFull should not be raised due to requeued events count is less or equal to
@@ -70,12 +117,24 @@ async def _process_pushed_data_once(
         events_queue_.put_nowait(event)
 
     # Store events.
+    late_confirmed_events = list(_late_confirmed_events)
     async with database_core.get_session() as db_session:
         for chunk in chunks(events_to_push, store_chunk_size):
             try:
+                # Late confirmed events are deleted in the first chunk transaction.
+                await _purge_late_confirmed(db_session, late_confirmed_events, commit=False)
                 await push_data_service.create(db_session, list(chunk))
+                push_data_stored.set()
+                late_confirmed_events = []
             except Exception as e:
-                print(e)
+                await db_session.rollback()
+                logger.logger.error("Can't store push data: %s", e)
+
+        if late_confirmed_events:
+            try:
+                await _purge_late_confirmed(db_session, late_confirmed_events)
+            except DatabaseError as e:
+                logger.logger.error("Can't delete late confirmed events: %s", e)
 
 
 async def _process_pushed_data(
@@ -8,20 +8,46 @@ Push data.
 Author(s): Artem Bezborodko
 """
 
+import asyncio
+import datetime as dt
+import itertools
 import json
 import uuid
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Generator
 
 import aiohttp
 import sqlalchemy
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import config, logger, push_server_errors, statuses
+from .. import config, errors, logger, push_server_client, push_server_errors, statuses
 from ..database import core as database_core
 from ..device import service as device_service
-from ..device.models import Device, DomikaDeviceUpdate
+from ..device.models import Device
 from . import confirmed_events_queue, events_queue
-from .models import DomikaPushDataCreate, DomikaPushedEvents, PushData
-from .service import decrease_delay_all, delete_by_app_session_id
+from . import service as push_data_service
+from .models import (
+    DomikaPushDataCreate,
+    DomikaPushedEvents,
+    DomikaPushOutboxCreate,
+    DomikaPushOutcome,
+    PushData,
+    PushOutbox,
+)
+from .rate_limiter import push_allowed
+from .service import decrease_delay_all
+
+# Bulk push item size without push data.
+BULK_PUSH_ITEM_OVERHEAD = 64
+
+# Claim cycle counter. Starts from the current time in microseconds, so cycles are not repeated
+# after restart.
+_claim_cycles = itertools.count(int(dt.datetime.now(dt.UTC).timestamp() * 1e6))
+
+_critical_push_tasks: set[asyncio.Task] = set()
+_critical_push_lane: asyncio.Semaphore | None = None
 
 
 async def confirm_event(event_ids: list[uuid.UUID]) -> None:
@@ -36,7 +62,7 @@ async def confirm_event(event_ids: list[uuid.UUID]) -> None:
 
 
 async def register_event(
-    http_session: aiohttp.ClientSession,
+    http_session: aiohttp.ClientSession | None,
     *,
     push_data: list[DomikaPushDataCreate],
     critical_push_needed: bool,
@@ -48,17 +74,11 @@ async def register_event(
     All push data items must belong to the same entity and share same context.
 
     Args:
-        http_session: aiohttp session.
+        http_session: aiohttp session. If None - framework owned push server client is used.
         push_data: list of push data entities.
-        critical_push_needed: critical push flag.
+        critical_push_needed: critical push flag. Critical push is sent in background, see
+            send_critical_push.
         critical_alert_payload: payload in case we need to send a critical push.
-
-    Raises:
-        errors.DatabaseError: in case when database operation can't be performed.
-        push_server_errors.DomikaPushServerError: in case of internal aiohttp error.
-        push_server_errors.BadRequestError: if push server response with bad request.
-        push_server_errors.UnexpectedServerResponseError: if push server response with unexpected
-        status.
     """
     result: list[DomikaPushedEvents] = []
     if not push_data:
@@ -68,50 +88,170 @@ async def register_event(
         await events_queue.put(event)
 
     if critical_push_needed:
-        verified_devices = await device_service.get_all_with_push_session_id()
+        send_critical_push(http_session, critical_alert_payload)
 
-        for device in verified_devices:
-            if not device.push_session_id:
-                continue
+    return result
 
-            await _send_push_data(
-                None,
-                http_session,
-                device.app_session_id,
-                device.push_session_id,
-                critical_alert_payload,
-                critical=True,
-            )
 
-    return result
+def send_critical_push(
+    http_session: aiohttp.ClientSession | None,
+    critical_alert_payload: dict,
+) -> asyncio.Task[list[DomikaPushOutcome]]:
+    """
+    Send critical push to all verified devices in background.
+
+    Payload is encoded once and sent to the devices concurrently. Critical pushes have their own
+    concurrency limit, so they are never queued behind the regular pushes.
+    Push to every device carries its own idempotency key, which is repeated by hedged requests. Push
+    server deduplicates critical pushes by the key.
+
+    Args:
+        http_session: aiohttp session. If None - framework owned push server client is used.
+        critical_alert_payload: critical push payload.
+
+    Returns:
+        task that resolves to the per-device push outcomes. Task errors are logged.
+    """
+    task = asyncio.create_task(_send_critical_push(http_session, critical_alert_payload))
+    _critical_push_tasks.add(task)
+    task.add_done_callback(_critical_push_done_cb)
+    return task
+
+
+def _critical_push_done_cb(task: asyncio.Task):
+    _critical_push_tasks.discard(task)
+    # Task is usually not awaited, so its error is logged here.
+    if not task.cancelled() and (e := task.exception()):
+        logger.logger.error("Critical push failed: %s", e)
+
+
+async def stop_critical_pushes():
+    """Cancel all unfinished critical push tasks."""
+    global _critical_push_lane  # noqa: PLW0603
+
+    for task in _critical_push_tasks:
+        task.cancel()
+    await asyncio.gather(*_critical_push_tasks, return_exceptions=True)
+
+    # Lane will be recreated with the actual config.
+    _critical_push_lane = None
+
+
+def _get_critical_push_lane() -> asyncio.Semaphore:
+    global _critical_push_lane  # noqa: PLW0603
+    if _critical_push_lane is None:
+        _critical_push_lane = asyncio.Semaphore(config.CONFIG.critical_push_concurrency)
+    return _critical_push_lane
+
+
+async def _send_critical_push(
+    http_session: aiohttp.ClientSession | None,
+    critical_alert_payload: dict,
+) -> list[DomikaPushOutcome]:
+    verified_devices = await device_service.get_all_with_push_session_id()
+    data = json.dumps(critical_alert_payload)
+    lane = _get_critical_push_lane()
+    # Hedged requests of the same device share idempotency key, so push server delivers critical
+    # push once.
+    push_id = uuid.uuid4()
+
+    async def _send(app_session_id: uuid.UUID, push_session_id: uuid.UUID) -> DomikaPushOutcome:
+        outcome = DomikaPushOutcome(app_session_id, push_session_id)
+        async with lane:
+            try:
+                if not await push_server_client.hedge(
+                    "notification/critical_push",
+                    lambda: _send_push_data(
+                        http_session,
+                        push_session_id,
+                        data,
+                        critical=True,
+                        idempotency_key=f"{push_session_id}:{push_id}",
+                    ),
+                ):
+                    outcome.error = push_server_errors.PushSessionIdNotFoundError(push_session_id)
+            except push_server_errors.DomikaPushServerError as e:
+                logger.logger.debug("Critical push to %s failed: %s", push_session_id, e)
+                outcome.error = e
+        return outcome
+
+    outcomes = await asyncio.gather(
+        *(
+            _send(device.app_session_id, device.push_session_id)
+            for device in verified_devices
+            if device.push_session_id
+        ),
+    )
+
+    rejected_app_session_ids = [
+        outcome.app_session_id
+        for outcome in outcomes
+        if isinstance(outcome.error, push_server_errors.PushSessionIdNotFoundError)
+    ]
+    if rejected_app_session_ids:
+        async with database_core.get_session() as db_session:
+            await device_service.clear_push_session_ids(db_session, rejected_app_session_ids)
+
+    return outcomes
 
 
 async def push_registered_events(
     db_session: AsyncSession,
-    http_session: aiohttp.ClientSession,
+    http_session: aiohttp.ClientSession | None,
+    *,
+    decrease_delay: bool = True,
 ) -> list[DomikaPushedEvents]:
     """
     Push registered events with delay = 0 to the push server.
 
-    Select registered events with delay = 0, add events with delay > 0 for the same app_session_ids,
-    create formatted push data, send it to the push server api,
-    delete all registered events for involved app sessions.
+    Claim registered events ready to be pushed into the push outbox, then deliver the push outbox
+    to the push server. See claim_registered_events and deliver_outbox.
 
     Args:
         db_session: sqlalchemy session.
-        http_session: aiohttp session.
+        http_session: aiohttp session. If None - framework owned push server client is used.
+        decrease_delay: decrease delay of registered events before claim.
+
+    Returns:
+        events delivered to the push server.
 
     Raises:
         errors.DatabaseError: in case when database operation can't be performed.
-        push_server_errors.DomikaPushServerError: in case of internal aiohttp error.
-        push_server_errors.BadRequestError: if push server response with bad request.
-        push_server_errors.UnexpectedServerResponseError: if push server response with unexpected
-        status.
     """
     logger.logger.debug("Push_registered_events started.")
 
-    result: list[DomikaPushedEvents] = []
-    await decrease_delay_all(db_session)
+    await claim_registered_events(db_session, decrease_delay=decrease_delay)
+    return await deliver_outbox(db_session, http_session)
+
+
+async def claim_registered_events(
+    db_session: AsyncSession,
+    *,
+    decrease_delay: bool = True,
+) -> int:
+    """
+    Move registered events ready to be pushed to the push outbox.
+
+    Select registered events with delay = 0, add events with delay > 0 for the same app_session_ids,
+    create formatted push data, write it to the push outbox, delete all registered events for
+    involved app sessions. Everything is done in a single transaction, so push data is either
+    still registered or already in the push outbox.
+    Push sessions that are over their rate limit are skipped, their events stay registered and
+    are coalesced with the new ones.
+
+    Args:
+        db_session: sqlalchemy session.
+        decrease_delay: decrease delay of registered events before claim. Delay counts the calls
+            which decrease it.
+
+    Returns:
+        number of push sessions claimed.
+
+    Raises:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if decrease_delay:
+        await decrease_delay_all(db_session, commit=False)
 
     stmt = sqlalchemy.select(PushData, Device.push_session_id)
     stmt = stmt.join(Device, PushData.app_session_id == Device.app_session_id)
@@ -120,7 +260,10 @@ async def push_registered_events(
         Device.push_session_id,
         PushData.entity_id,
     )
-    push_data_records = (await db_session.execute(stmt)).all()
+    try:
+        push_data_records = (await db_session.execute(stmt)).all()
+    except SQLAlchemyError as e:
+        raise errors.DatabaseError(str(e)) from e
 
     # Create push data dict.
     # Format example:
@@ -138,7 +281,7 @@ async def push_registered_events(
     # '     }
     # '  },
     # '}
-    app_sessions_ids_to_delete_list: list[uuid.UUID] = []
+    sessions_to_push: list[tuple[uuid.UUID, uuid.UUID, dict]] = []
     events_dict = {}
     current_entity_id: str | None = None
     current_push_session_id: uuid.UUID | None = None
@@ -154,15 +297,9 @@ async def push_registered_events(
                 and current_push_session_id
                 and current_app_session_id
             ):
-                result.append(DomikaPushedEvents(current_push_session_id, events_dict))
-                await _send_push_data(
-                    db_session,
-                    http_session,
-                    current_app_session_id,
-                    current_push_session_id,
-                    events_dict,
+                sessions_to_push.append(
+                    (current_app_session_id, current_push_session_id, events_dict),
                 )
-                app_sessions_ids_to_delete_list.append(current_app_session_id)
             current_push_session_id = push_data_record[1]
             current_app_session_id = push_data_record[0].app_session_id
             current_entity_id = None
@@ -179,92 +316,316 @@ async def push_registered_events(
         found_delay_zero = found_delay_zero or (push_data_record[0].delay == 0)
 
     if found_delay_zero and events_dict and current_push_session_id and current_app_session_id:
-        result.append(DomikaPushedEvents(current_push_session_id, events_dict))
-        await _send_push_data(
-            db_session,
-            http_session,
-            current_app_session_id,
-            current_push_session_id,
-            events_dict,
+        sessions_to_push.append((current_app_session_id, current_push_session_id, events_dict))
+
+    # Idempotency key is unique for push session and claim cycle, so push server can detect
+    # repeated deliveries.
+    cycle = next(_claim_cycles)
+    created = int(dt.datetime.now(dt.UTC).timestamp() * 1e6)
+    outbox: list[DomikaPushOutboxCreate] = []
+    for app_session_id, push_session_id, events in sessions_to_push:
+        # Sessions over their rate limit keep their push data, so it is coalesced with new events
+        # and pushed in one of the next cycles.
+        if not push_allowed(app_session_id, push_session_id):
+            logger.logger.debug("Push session %s is over its rate limit.", push_session_id)
+            continue
+
+        outbox.append(
+            DomikaPushOutboxCreate(
+                idempotency_key=f"{push_session_id}:{cycle}",
+                app_session_id=app_session_id,
+                push_session_id=push_session_id,
+                payload=json.dumps(events),
+                created=created,
+            ),
         )
-        app_sessions_ids_to_delete_list.append(current_app_session_id)
 
-    await delete_by_app_session_id(db_session, app_sessions_ids_to_delete_list)
+    await push_data_service.create_outbox(db_session, outbox, commit=False)
+    await push_data_service.delete_by_app_session_id(
+        db_session,
+        [outbox_in.app_session_id for outbox_in in outbox],
+        commit=False,
+    )
+    try:
+        await db_session.commit()
+    except SQLAlchemyError as e:
+        raise errors.DatabaseError(str(e)) from e
+
+    return len(outbox)
+
+
+async def deliver_outbox(
+    db_session: AsyncSession,
+    http_session: aiohttp.ClientSession | None,
+) -> list[DomikaPushedEvents]:
+    """
+    Deliver push outbox records to the push server.
+
+    Records are delivered from the oldest, in batches of push_outbox_batch_size records, each
+    batch in its own transaction, until all records are tried once.
+    Every push carries its record idempotency key. Delivered records are deleted. Records which
+    push server can't accept are deleted too, push sessions rejected by the push server are
+    cleared. Other records stay in the push outbox and are retried by the next call, until
+    push_outbox_max_attempts reached.
+
+    Args:
+        db_session: sqlalchemy session.
+        http_session: aiohttp session. If None - framework owned push server client is used.
+
+    Returns:
+        events delivered to the push server.
+
+    Raises:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    result: list[DomikaPushedEvents] = []
+    batch_size = config.CONFIG.push_outbox_batch_size
+    after: tuple[int, str] | None = None
+    while True:
+        records = await push_data_service.get_outbox(db_session, batch_size, after)
+        if not records:
+            break
+
+        # Take the key before delivery, failed records are skipped by the next batch.
+        after = (records[-1].created, records[-1].idempotency_key)
+        result.extend(await _deliver_outbox_batch(db_session, http_session, records))
+
+        if len(records) < batch_size:
+            break
 
     return result
 
 
-async def _clear_push_session_id(
+async def _deliver_outbox_batch(
     db_session: AsyncSession,
-    app_session_id: uuid.UUID,
-    push_session_id: uuid.UUID,
-) -> None:
-    # Push session id not found on push server.
-    # Remove push session id for device.
-    device = await device_service.get(db_session, app_session_id)
-    if device:
-        logger.logger.debug(
-            'The server rejected push session id "%s"',
-            push_session_id,
-        )
-        await device_service.update(
-            db_session,
-            device,
-            DomikaDeviceUpdate(push_session_id=None),
-        )
-        logger.logger.debug(
-            'Push session "%s" for app session "%s" successfully removed',
-            push_session_id,
-            app_session_id,
-        )
+    http_session: aiohttp.ClientSession | None,
+    records: Sequence[PushOutbox],
+) -> list[DomikaPushedEvents]:
+    delivery = _OutboxDelivery()
+    send = _send_bulk_push_data if config.CONFIG.push_server_bulk_push else _send_push_data_many
+    await send(http_session, records, delivery)
+
+    await device_service.clear_push_session_ids(db_session, delivery.rejected, commit=False)
+    await push_data_service.delete_outbox(
+        db_session,
+        delivery.delivered + delivery.dropped,
+        commit=False,
+    )
+    dropped = await push_data_service.increase_outbox_attempts(
+        db_session,
+        delivery.failed,
+        config.CONFIG.push_outbox_max_attempts,
+        commit=False,
+    )
+    try:
+        await db_session.commit()
+    except SQLAlchemyError as e:
+        raise errors.DatabaseError(str(e)) from e
+
+    if dropped:
+        logger.logger.warning("%s push outbox records dropped after max attempts.", dropped)
+
+    delivered = set(delivery.delivered)
+    return [
+        DomikaPushedEvents(record.push_session_id, json.loads(record.payload))
+        for record in records
+        if record.idempotency_key in delivered
+    ]
+
+
+@dataclass
+class _OutboxDelivery:
+    """Push outbox delivery results."""
+
+    # Idempotency keys of delivered records.
+    delivered: list[str] = field(default_factory=list)
+    # Idempotency keys of records which push server can't accept.
+    dropped: list[str] = field(default_factory=list)
+    # Idempotency keys of records to retry.
+    failed: list[str] = field(default_factory=list)
+    # App session ids which push sessions are rejected by the push server.
+    rejected: list[uuid.UUID] = field(default_factory=list)
+
+
+async def _send_push_data_many(
+    http_session: aiohttp.ClientSession | None,
+    records: Sequence[PushOutbox],
+    delivery: _OutboxDelivery,
+):
+    """Send push outbox records one by one."""
+    for record in records:
+        try:
+            if await _send_push_data(
+                http_session,
+                record.push_session_id,
+                record.payload,
+                idempotency_key=record.idempotency_key,
+            ):
+                delivery.delivered.append(record.idempotency_key)
+            else:
+                delivery.dropped.append(record.idempotency_key)
+                delivery.rejected.append(record.app_session_id)
+        except push_server_errors.BadRequestError as e:
+            logger.logger.warning('Push to "%s" rejected: %s', record.push_session_id, e.body)
+            delivery.dropped.append(record.idempotency_key)
+        except push_server_errors.DomikaPushServerError as e:
+            logger.logger.debug('Push to "%s" failed: %s', record.push_session_id, e)
+            delivery.failed.append(record.idempotency_key)
+
+
+def _bulk_push_batches(
+    records: Sequence[PushOutbox],
+    max_sessions: int,
+    max_bytes: int,
+) -> Generator[list[PushOutbox], None, None]:
+    batch: list[PushOutbox] = []
+    batch_size = 0
+    for record in records:
+        # Approximate size of the encoded bulk push item.
+        size = len(record.payload) + BULK_PUSH_ITEM_OVERHEAD
+        if batch and (len(batch) >= max_sessions or batch_size + size > max_bytes):
+            yield batch
+            batch = []
+            batch_size = 0
+        batch.append(record)
+        batch_size += size
+    if batch:
+        yield batch
+
+
+async def _send_bulk_push_data(
+    http_session: aiohttp.ClientSession | None,
+    records: Sequence[PushOutbox],
+    delivery: _OutboxDelivery,
+):
+    """Send push outbox records with bulk push requests."""
+    http_session = push_server_client.get_http_session(http_session)
+    for batch in _bulk_push_batches(
+        records,
+        config.CONFIG.push_server_bulk_max_sessions,
+        config.CONFIG.push_server_bulk_max_bytes,
+    ):
+        logger.logger.debug("Bulk push events to %s push sessions.", len(batch))
+        try:
+            results = await _send_bulk_push_batch(http_session, batch)
+        except push_server_errors.DomikaPushServerError as e:
+            logger.logger.debug("Bulk push failed: %s", e)
+            delivery.failed.extend(record.idempotency_key for record in batch)
+            continue
+
+        for record in batch:
+            status = results.get(str(record.push_session_id))
+            if status == statuses.HTTP_204_NO_CONTENT:
+                delivery.delivered.append(record.idempotency_key)
+            elif status == statuses.HTTP_401_UNAUTHORIZED:
+                logger.logger.debug(
+                    'The server rejected push session id "%s"',
+                    record.push_session_id,
+                )
+                delivery.dropped.append(record.idempotency_key)
+                delivery.rejected.append(record.app_session_id)
+            elif status == statuses.HTTP_400_BAD_REQUEST:
+                logger.logger.warning('Push to "%s" rejected', record.push_session_id)
+                delivery.dropped.append(record.idempotency_key)
+            else:
+                logger.logger.debug(
+                    'Bulk push to push session "%s" failed with status %s',
+                    record.push_session_id,
+                    status,
+                )
+                delivery.failed.append(record.idempotency_key)
 
 
-async def _send_push_data(
-    db_session: AsyncSession | None,
+async def _send_bulk_push_batch(
     http_session: aiohttp.ClientSession,
-    app_session_id: uuid.UUID,
+    batch: list[PushOutbox],
+) -> dict[str, int]:
+    """
+    Send bulk push request.
+
+    Returns:
+        push statuses by push session id.
+    """
+    try:
+        async with (
+            push_server_client.request(
+                http_session,
+                "POST",
+                "notification/bulk_push",
+                json={
+                    "items": [
+                        {
+                            "push_session_id": str(record.push_session_id),
+                            "idempotency_key": record.idempotency_key,
+                            "data": record.payload,
+                        }
+                        for record in batch
+                    ],
+                },
+            ) as resp,
+        ):
+            if resp.status == statuses.HTTP_400_BAD_REQUEST:
+                raise push_server_errors.BadRequestError(await resp.json())
+
+            if resp.status != statuses.HTTP_207_MULTI_STATUS:
+                raise push_server_errors.UnexpectedServerResponseError(resp.status)
+
+            try:
+                body = await resp.json()
+                return {item["push_session_id"]: item["status"] for item in body["results"]}
+            except (json.JSONDecodeError, aiohttp.ContentTypeError, KeyError, TypeError) as e:
+                raise push_server_errors.ResponseError(e) from None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise push_server_errors.DomikaPushServerError(str(e)) from None
+
+
+async def _send_push_data(
+    http_session: aiohttp.ClientSession | None,
     push_session_id: uuid.UUID,
-    critical_alert_payload: dict,
+    data: str,
     *,
     critical: bool = False,
-) -> None:
+    idempotency_key: str | None = None,
+) -> bool:
+    """
+    Send push to the push server.
+
+    Returns:
+        True if push is sent, False if push session id was rejected by the push server.
+    """
     logger.logger.debug(
         "Push events %sto %s. %s",
         "(critical) " if critical else "",
         push_session_id,
-        critical_alert_payload,
+        data,
     )
 
+    http_session = push_server_client.get_http_session(http_session)
     try:
         async with (
-            http_session.post(
-                f"{config.CONFIG.push_server_url}/notification/critical_push"
-                if critical
-                else f"{config.CONFIG.push_server_url}/notification/push",
+            push_server_client.request(
+                http_session,
+                "POST",
+                "notification/critical_push" if critical else "notification/push",
                 headers={
                     "x-session-id": str(push_session_id),
+                    **({"x-idempotency-key": idempotency_key} if idempotency_key else {}),
                 },
-                json={"data": json.dumps(critical_alert_payload)},
-                timeout=config.CONFIG.push_server_timeout,
+                json={"data": data},
             ) as resp,
         ):
             if resp.status == statuses.HTTP_204_NO_CONTENT:
                 # All OK. Notification pushed.
-                return
+                return True
 
             if resp.status == statuses.HTTP_401_UNAUTHORIZED:
-                if db_session is None:
-                    # Create database session implicitly.
-                    async with database_core.get_session() as db_session_:
-                        await _clear_push_session_id(db_session_, app_session_id, push_session_id)
-                    return
-
-                await _clear_push_session_id(db_session, app_session_id, push_session_id)
-                return
+                # Push session id not found on push server.
+                logger.logger.debug('The server rejected push session id "%s"', push_session_id)
+                return False
 
             if resp.status == statuses.HTTP_400_BAD_REQUEST:
                 raise push_server_errors.BadRequestError(await resp.json())
 
             raise push_server_errors.UnexpectedServerResponseError(resp.status)
-    except aiohttp.ClientError as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise push_server_errors.DomikaPushServerError(str(e)) from None
@@ -18,6 +18,7 @@ from mashumaro.mixins.json import DataClassJSONMixin
 from sqlalchemy import ForeignKey, func
 from sqlalchemy.orm import Mapped, mapped_column
 
+from ..database.interning import Interned
 from ..models import AsyncBase
 
 
@@ -31,22 +32,37 @@ class PushData(AsyncBase):
         ForeignKey("devices.app_session_id", ondelete="CASCADE", onupdate="CASCADE"),
         primary_key=True,
     )
-    entity_id: Mapped[str] = mapped_column(primary_key=True)
-    attribute: Mapped[str] = mapped_column(primary_key=True)
+    entity_id: Mapped[str] = mapped_column(Interned, primary_key=True)
+    attribute: Mapped[str] = mapped_column(Interned, primary_key=True)
     value: Mapped[str]
     context_id: Mapped[str]
     timestamp: Mapped[int] = mapped_column(server_default=func.datetime("now"))
     delay: Mapped[int]
 
 
+class PushOutbox(AsyncBase):
+    """Push data claimed for delivery to the push server."""
+
+    __tablename__ = "push_outbox"
+
+    idempotency_key: Mapped[str] = mapped_column(primary_key=True)
+    app_session_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("devices.app_session_id", ondelete="CASCADE", onupdate="CASCADE"),
+    )
+    push_session_id: Mapped[uuid.UUID]
+    payload: Mapped[str]
+    attempts: Mapped[int] = mapped_column(default=0)
+    created: Mapped[int]
+
+
 class _Event(AsyncBase):
     """HomeAssistant temporary event."""
 
     __tablename__ = "events"
 
     event_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
-    entity_id: Mapped[str] = mapped_column(primary_key=True)
-    attribute: Mapped[str] = mapped_column(primary_key=True)
+    entity_id: Mapped[str] = mapped_column(Interned, primary_key=True)
+    attribute: Mapped[str] = mapped_column(Interned, primary_key=True)
     value: Mapped[str]
     context_id: Mapped[str]
     timestamp: Mapped[int] = mapped_column(server_default=func.datetime("now"))
@@ -88,6 +104,25 @@ class DomikaPushDataUpdate(DataClassJSONMixin):
         omit_default = True
 
 
+@dataclass
+class DomikaPushOutboxCreate(DataClassJSONMixin):
+    """Push outbox create model."""
+
+    idempotency_key: str
+    app_session_id: uuid.UUID = field(
+        metadata={
+            "serialization_strategy": pass_through,
+        },
+    )
+    push_session_id: uuid.UUID = field(
+        metadata={
+            "serialization_strategy": pass_through,
+        },
+    )
+    payload: str
+    created: int
+
+
 @dataclass
 class DomikaPushedEvents(DataClassJSONMixin):
     """Pushed events' config."""
@@ -98,3 +133,12 @@ class DomikaPushedEvents(DataClassJSONMixin):
         },
     )
     events: dict[str, dict[str, Any]]
+
+
+@dataclass
+class DomikaPushOutcome:
+    """Push outcome for a single device."""
+
+    app_session_id: uuid.UUID
+    push_session_id: uuid.UUID
+    error: Exception | None = None
@@ -0,0 +1,174 @@
+# vim: set fileencoding=utf-8
+"""
+Push data.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import math
+import time
+import uuid
+
+from .. import config
+
+# Bucket table size after which full buckets are pruned.
+MAX_BUCKETS = 10000
+
+
+class _Bucket:
+    """Token bucket state."""
+
+    __slots__ = ("limit", "tokens", "updated")
+
+    def __init__(self, limit: config.PushRateLimit, now: float):
+        self.limit = limit
+        self.tokens = limit.capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(
+            self.limit.capacity,
+            self.tokens + (now - self.updated) * self.limit.refill_rate,
+        )
+        self.updated = now
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.limit.refill_rate >= self.limit.capacity
+
+
+class PushRateLimiter:
+    """
+    Token bucket push rate limiter keyed by push session id.
+
+    Buckets that refilled to their capacity are indistinguishable from the new ones, so they are
+    pruned when table grows over max_buckets.
+    """
+
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self._buckets: dict[uuid.UUID, _Bucket] = {}
+        self._max_buckets = max_buckets
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def try_acquire(
+        self,
+        push_session_id: uuid.UUID,
+        limit: config.PushRateLimit,
+        now: float | None = None,
+    ) -> bool:
+        """
+        Try to take one token from push session's bucket.
+
+        Args:
+            push_session_id: push session id.
+            limit: rate limit for the push session.
+            now: current monotonic time. Defaults to time.monotonic().
+
+        Returns:
+            True if push is allowed, False if push session is over its budget.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self._buckets.get(push_session_id)
+        if bucket is None:
+            if len(self._buckets) >= self._max_buckets:
+                self.prune(now)
+            bucket = _Bucket(limit, now)
+            self._buckets[push_session_id] = bucket
+        else:
+            bucket.limit = limit
+            bucket.refill(now)
+
+        if bucket.tokens < 1:
+            return False
+
+        bucket.tokens -= 1
+        return True
+
+    def retry_after(self, push_session_id: uuid.UUID, now: float | None = None) -> float:
+        """
+        Get time until push session's bucket has a token, without taking it.
+
+        Args:
+            push_session_id: push session id.
+            now: current monotonic time. Defaults to time.monotonic().
+
+        Returns:
+            seconds until push is allowed, 0 if push is allowed now.
+        """
+        bucket = self._buckets.get(push_session_id)
+        if bucket is None:
+            return 0
+
+        if now is None:
+            now = time.monotonic()
+
+        tokens = bucket.tokens + (now - bucket.updated) * bucket.limit.refill_rate
+        if tokens >= 1:
+            return 0
+        if bucket.limit.refill_rate <= 0:
+            return math.inf
+        return (1 - tokens) / bucket.limit.refill_rate
+
+    def prune(self, now: float | None = None):
+        """Remove buckets which are refilled to their capacity."""
+        if now is None:
+            now = time.monotonic()
+
+        for push_session_id in [k for k, v in self._buckets.items() if v.is_full(now)]:
+            del self._buckets[push_session_id]
+
+    def clear(self):
+        """Remove all buckets."""
+        self._buckets.clear()
+
+
+push_rate_limiter = PushRateLimiter()
+
+
+def get_push_rate_limit(app_session_id: uuid.UUID) -> config.PushRateLimit | None:
+    """
+    Get push rate limit for the device with given app session id.
+
+    Returns:
+        rate limit of the device class, or default rate limit. None if push is not limited.
+    """
+    limits = config.CONFIG.push_rate_limits
+    if not limits:
+        return None
+
+    device_class = config.DEFAULT_DEVICE_CLASS
+    if config.CONFIG.push_device_class:
+        device_class = config.CONFIG.push_device_class(app_session_id)
+
+    return limits.get(device_class, limits.get(config.DEFAULT_DEVICE_CLASS))
+
+
+def push_allowed(app_session_id: uuid.UUID, push_session_id: uuid.UUID) -> bool:
+    """
+    Check that push session is within its rate limit, and consume one push if so.
+
+    Returns:
+        True if push can be sent.
+    """
+    limit = get_push_rate_limit(app_session_id)
+    if limit is None:
+        return True
+    return push_rate_limiter.try_acquire(push_session_id, limit)
+
+
+def push_retry_after(app_session_id: uuid.UUID, push_session_id: uuid.UUID) -> float:
+    """
+    Get time until push session is within its rate limit, without consuming a push.
+
+    Returns:
+        seconds until push can be sent, 0 if push can be sent now.
+    """
+    if get_push_rate_limit(app_session_id) is None:
+        return 0
+    return push_rate_limiter.retry_after(push_session_id)
@@ -0,0 +1,154 @@
+# vim: set fileencoding=utf-8
+"""
+Push data.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+import contextlib
+import time
+from typing import NamedTuple
+
+from .. import config, errors, logger
+from ..database import core as database_core
+from . import flow as push_data_flow
+from . import push_data_stored, rate_limiter
+from . import service as push_data_service
+
+_push_scheduler: set[asyncio.Task] = set()
+_push_scheduler_finished = asyncio.Event()
+
+
+class _PendingPush(NamedTuple):
+    # Seconds until some push data or push outbox record is due, None if nothing is due.
+    due_in: float | None
+    # There is push data waiting for its delay.
+    delayed: bool
+
+
+async def _run_push_cycle(*, decrease_delay: bool) -> _PendingPush:
+    """
+    Push registered events, and deliver push outbox.
+
+    Returns:
+        push data and push outbox left to push.
+    """
+    async with database_core.get_session() as db_session:
+        pushed = await push_data_flow.push_registered_events(
+            db_session,
+            None,
+            decrease_delay=decrease_delay,
+        )
+        logger.logger.debug("Push scheduler pushed events to %s push sessions.", len(pushed))
+
+        if await push_data_service.has_outbox(db_session):
+            due_in = 0
+        else:
+            # Push data of push sessions over their rate limit is due when their budget refills.
+            due_in = min(
+                (
+                    rate_limiter.push_retry_after(app_session_id, push_session_id)
+                    for app_session_id, push_session_id in (
+                        await push_data_service.get_due_push_sessions(db_session)
+                    )
+                ),
+                default=None,
+            )
+        return _PendingPush(due_in, await push_data_service.has_delayed_push(db_session))
+
+
+async def _schedule_pushes(min_interval: float, max_interval: float, delay_interval: float):
+    # Time of the next push data delay decrease. None while there is no delayed push data.
+    next_delay_decrease: float | None = None
+    while True:
+        started = time.monotonic()
+        push_data_stored.clear()
+        decrease_delay = next_delay_decrease is not None and started >= next_delay_decrease
+        # Check on the first cycle, and after errors.
+        pending = _PendingPush(due_in=0, delayed=True)
+        task = asyncio.create_task(_run_push_cycle(decrease_delay=decrease_delay))
+        try:
+            pending = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            await task
+            raise
+        except errors.DomikaFrameworkBaseError as e:
+            logger.logger.error("Push cycle failed: %s", e)
+
+        # Decrease delays with fixed cadence, which starts when delayed push data appears.
+        if not pending.delayed:
+            next_delay_decrease = None
+        elif next_delay_decrease is None:
+            next_delay_decrease = started + delay_interval
+        elif decrease_delay:
+            next_delay_decrease += delay_interval
+            if next_delay_decrease <= started:
+                next_delay_decrease = started + delay_interval
+
+        wake_up = started + max_interval
+        if pending.due_in is not None:
+            wake_up = min(wake_up, time.monotonic() + pending.due_in)
+        if next_delay_decrease is not None:
+            wake_up = min(wake_up, next_delay_decrease)
+
+        # Keep minimal cadence.
+        await asyncio.sleep(max(0, min_interval - (time.monotonic() - started)))
+
+        # Wait for due push data, delay decrease, or new push data.
+        timeout = wake_up - time.monotonic()
+        if timeout > 0:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(push_data_stored.wait(), timeout)
+
+
+def _done_cb(task: asyncio.Task):
+    _push_scheduler.discard(task)
+    _push_scheduler_finished.set()
+
+
+def start_push_scheduler():
+    """
+    Start new push scheduler task.
+
+    Push scheduler runs push cycles with push_scheduler_min_interval while there is push data with
+    delay = 0 of push sessions within their rate limit, or undelivered push outbox records.
+    Otherwise it waits for new push data stored by push data processor, rate limited push session
+    budget refill, or the next push data delay decrease, but runs push cycle at least every
+    push_scheduler_max_interval. Push data delay is decreased every push_scheduler_delay_interval,
+    independently of push cycles.
+    Framework owned push server client is used.
+
+    Do nothing if push scheduler is disabled in config, or already started.
+    """
+    if not config.CONFIG.push_scheduler or _push_scheduler:
+        return
+
+    _push_scheduler_finished.clear()
+
+    task = asyncio.create_task(
+        _schedule_pushes(
+            config.CONFIG.push_scheduler_min_interval,
+            config.CONFIG.push_scheduler_max_interval,
+            config.CONFIG.push_scheduler_delay_interval,
+        ),
+    )
+    _push_scheduler.add(task)
+    task.add_done_callback(_done_cb)
+
+
+async def stop_push_scheduler():
+    """
+    Cancel push scheduler task.
+
+    Do nothing if there is no running push scheduler task.
+    """
+    push_scheduler = next(iter(_push_scheduler), None)
+    if not push_scheduler:
+        return
+
+    push_scheduler.cancel()
+    await _push_scheduler_finished.wait()
@@ -9,7 +9,7 @@ Author(s): Artem Bezborodko
 """
 
 import uuid
-from collections.abc import Sequence
+from collections.abc import AsyncGenerator, Sequence
 from typing import Optional
 
 import sqlalchemy
@@ -18,9 +18,22 @@ from sqlalchemy import and_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..database import interning
+from ..device.models import Device
 from ..errors import DatabaseError
+from ..subscription import service as subscription_service
 from ..subscription.models import Subscription
-from .models import DomikaPushDataCreate, DomikaPushDataUpdate, PushData, _Event
+from .models import (
+    DomikaPushDataCreate,
+    DomikaPushDataUpdate,
+    DomikaPushOutboxCreate,
+    PushData,
+    PushOutbox,
+    _Event,
+)
+
+# Number of push data records loaded with one query by iter_all.
+ITER_PAGE_SIZE = 500
 
 
 async def get(
@@ -65,6 +78,76 @@ async def get_all(
         raise DatabaseError(str(e)) from e
 
 
+async def iter_all(
+    db_session: AsyncSession,
+    page_size: int = ITER_PAGE_SIZE,
+) -> AsyncGenerator[PushData, None]:
+    """
+    Iterate over all push data ordered by primary key.
+
+    Push data is loaded by pages of page_size records. Every page continues from the last loaded
+    primary key, so cost of the page does not depend on the number of records before it.
+
+    Args:
+        db_session: sqlalchemy database session.
+        page_size: number of records loaded with one query. Defaults to ITER_PAGE_SIZE.
+
+    Yields:
+        push data.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    key = sqlalchemy.tuple_(
+        PushData.event_id,
+        PushData.app_session_id,
+        PushData.entity_id,
+        PushData.attribute,
+    )
+    stmt = sqlalchemy.select(PushData)
+    stmt = stmt.order_by(
+        PushData.event_id,
+        PushData.app_session_id,
+        PushData.entity_id,
+        PushData.attribute,
+    )
+    stmt = stmt.limit(page_size)
+    last_key: tuple | None = None
+    while True:
+        page_stmt = stmt if last_key is None else stmt.where(key > last_key)
+        try:
+            push_data = (await db_session.scalars(page_stmt)).all()
+        except SQLAlchemyError as e:
+            raise DatabaseError(str(e)) from e
+
+        if push_data:
+            # Take the key before yielding, records may be expired by the caller.
+            last = push_data[-1]
+            last_key = (last.event_id, last.app_session_id, last.entity_id, last.attribute)
+
+        for record in push_data:
+            yield record
+
+        if len(push_data) < page_size:
+            return
+
+
+def _on_conflict_update(stmt: sqlite_dialect.Insert) -> sqlite_dialect.Insert:
+    """Update value and timestamp of existing push data, if the new timestamp is greater."""
+    return stmt.on_conflict_do_update(
+        index_elements=[
+            PushData.app_session_id,
+            PushData.entity_id,
+            PushData.attribute,
+        ],
+        set_={
+            "value": stmt.excluded.value,
+            "timestamp": stmt.excluded.timestamp,
+        },
+        where=PushData.timestamp < stmt.excluded.timestamp,
+    )
+
+
 async def create(
     db_session: AsyncSession,
     events_in: list[DomikaPushDataCreate],
@@ -75,6 +158,8 @@ async def create(
     """
     Create new push data.
 
+    Push data is created for exact subscriptions which need push, and for pattern subscriptions
+    which need push and match event entity_id and attribute.
     If already exists updates value and timestamp.
 
     Raise:
@@ -82,12 +167,17 @@ async def create(
     """
     result: Sequence[PushData] = []
 
+    # Only events with interned entity_id and attribute may match exact subscriptions.
+    subscribed_events = [
+        pd.to_dict()
+        for pd in events_in
+        if interning.is_interned(pd.entity_id) and interning.is_interned(pd.attribute)
+    ]
+
     try:
         # Insert temporary homeassistant events.
-        await db_session.execute(
-            sqlalchemy.insert(_Event),
-            [pd.to_dict() for pd in events_in],
-        )
+        if subscribed_events:
+            await db_session.execute(sqlalchemy.insert(_Event), subscribed_events)
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
 
@@ -125,18 +215,7 @@ async def create(
         ],
         sel,
     )
-    stmt = stmt.on_conflict_do_update(
-        index_elements=[
-            PushData.app_session_id,
-            PushData.entity_id,
-            PushData.attribute,
-        ],
-        set_={
-            "value": stmt.excluded.value,
-            "timestamp": stmt.excluded.timestamp,
-        },
-        where=PushData.timestamp < stmt.excluded.timestamp,
-    )
+    stmt = _on_conflict_update(stmt)
 
     try:
         if returning:
@@ -145,6 +224,27 @@ async def create(
         else:
             await db_session.execute(stmt)
 
+        # Insert events that need to be pushed by pattern subscriptions.
+        matcher = await subscription_service.get_pattern_matcher(db_session)
+        pattern_push_data: list[dict] = []
+        for pd in events_in if matcher else []:
+            for app_session_id, need_push in matcher.match(pd.entity_id, pd.attribute).items():
+                if need_push:
+                    pattern_push_data.append({**pd.to_dict(), "app_session_id": app_session_id})
+        if pattern_push_data:
+            await interning.intern(
+                db_session,
+                {pd["entity_id"] for pd in pattern_push_data}
+                | {pd["attribute"] for pd in pattern_push_data},
+            )
+            pattern_stmt = _on_conflict_update(sqlite_dialect.insert(PushData))
+            if returning:
+                pattern_stmt = pattern_stmt.returning(PushData)
+                pattern_result = await db_session.scalars(pattern_stmt, pattern_push_data)
+                result = [*result, *pattern_result.all()]
+            else:
+                await db_session.execute(pattern_stmt, pattern_push_data)
+
         # Remove temporary events.
         del_ = sqlalchemy.delete(_Event)
         await db_session.execute(del_)
@@ -215,6 +315,37 @@ async def delete(
         raise DatabaseError(str(e)) from e
 
 
+async def delete_by_event_id(
+    db_session: AsyncSession,
+    event_ids: list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Delete push data of all app sessions by list of event id's.
+
+    Returns:
+        number of deleted push data records.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not event_ids:
+        return 0
+
+    stmt = sqlalchemy.delete(PushData).where(PushData.event_id.in_(event_ids))
+
+    try:
+        result = await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
 async def delete_all(
     db_session: AsyncSession,
     *,
@@ -242,9 +373,12 @@ async def delete_by_app_session_id(
     app_session_id: uuid.UUID | list[uuid.UUID],
     *,
     commit: bool = True,
-):
+) -> int:
     """
-    Delete push data by event id, or list of event id's.
+    Delete push data by app session id, or list of app session id's.
+
+    Returns:
+        number of deleted push data records.
 
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
@@ -255,13 +389,15 @@ async def delete_by_app_session_id(
         stmt = sqlalchemy.delete(PushData).where(PushData.app_session_id == app_session_id)
 
     try:
-        await db_session.execute(stmt)
+        result = await db_session.execute(stmt)
 
         if commit:
             await db_session.commit()
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
 
+    return result.rowcount
+
 
 async def decrease_delay_all(
     db_session: AsyncSession,
@@ -311,3 +447,204 @@ async def delete_for_app_session(
             await db_session.commit()
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
+
+
+async def get_outbox(
+    db_session: AsyncSession,
+    limit: int = 100,
+    after: tuple[int, str] | None = None,
+) -> Sequence[PushOutbox]:
+    """
+    Get oldest push outbox records.
+
+    Args:
+        db_session: sqlalchemy database session.
+        limit: maximum number of records.
+        after: created and idempotency_key of the record, records up to which are skipped.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(PushOutbox)
+    if after is not None:
+        stmt = stmt.where(sqlalchemy.tuple_(PushOutbox.created, PushOutbox.idempotency_key) > after)
+    stmt = stmt.order_by(PushOutbox.created, PushOutbox.idempotency_key)
+    stmt = stmt.limit(limit)
+    try:
+        return (await db_session.scalars(stmt)).all()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def get_due_push_sessions(
+    db_session: AsyncSession,
+) -> Sequence[tuple[uuid.UUID, uuid.UUID]]:
+    """
+    Get app session ids and push session ids of devices which have push data with delay = 0.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(Device.app_session_id, Device.push_session_id).distinct()
+    stmt = stmt.join(PushData, PushData.app_session_id == Device.app_session_id)
+    stmt = stmt.where(Device.push_session_id.is_not(None))
+    stmt = stmt.where(PushData.delay == 0)
+
+    try:
+        result = await db_session.execute(stmt)
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return [(app_session_id, push_session_id) for app_session_id, push_session_id in result]
+
+
+async def has_delayed_push(db_session: AsyncSession) -> bool:
+    """
+    Check if there is push data with delay > 0 of devices with push session.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    push_data = sqlalchemy.select(PushData.event_id)
+    push_data = push_data.join(Device, PushData.app_session_id == Device.app_session_id)
+    push_data = push_data.where(Device.push_session_id.is_not(None))
+    push_data = push_data.where(PushData.delay > 0)
+    stmt = sqlalchemy.select(sqlalchemy.exists(push_data))
+
+    try:
+        return bool(await db_session.scalar(stmt))
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def has_outbox(db_session: AsyncSession) -> bool:
+    """
+    Check if there are undelivered push outbox records.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(sqlalchemy.exists(sqlalchemy.select(PushOutbox.idempotency_key)))
+
+    try:
+        return bool(await db_session.scalar(stmt))
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def create_outbox(
+    db_session: AsyncSession,
+    outbox_in: list[DomikaPushOutboxCreate],
+    *,
+    commit: bool = True,
+):
+    """
+    Create new push outbox records.
+
+    Records with already existing idempotency key are ignored.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not outbox_in:
+        return
+
+    stmt = sqlite_dialect.insert(PushOutbox)
+    stmt = stmt.on_conflict_do_nothing(index_elements=[PushOutbox.idempotency_key])
+
+    try:
+        await db_session.execute(stmt, [outbox.to_dict() for outbox in outbox_in])
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def delete_outbox(
+    db_session: AsyncSession,
+    idempotency_keys: list[str],
+    *,
+    commit: bool = True,
+):
+    """
+    Delete push outbox records by idempotency keys.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.delete(PushOutbox).where(PushOutbox.idempotency_key.in_(idempotency_keys))
+
+    try:
+        await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def delete_outbox_by_app_session_id(
+    db_session: AsyncSession,
+    app_session_ids: list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Delete push outbox records of the given app sessions.
+
+    Returns:
+        number of deleted push outbox records.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.delete(PushOutbox).where(PushOutbox.app_session_id.in_(app_session_ids))
+
+    try:
+        result = await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
+async def increase_outbox_attempts(
+    db_session: AsyncSession,
+    idempotency_keys: list[str],
+    max_attempts: int,
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Increase delivery attempts for push outbox records.
+
+    Records that reached max_attempts are deleted.
+
+    Returns:
+        number of deleted records.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.update(PushOutbox)
+    stmt = stmt.where(PushOutbox.idempotency_key.in_(idempotency_keys))
+    stmt = stmt.values(attempts=PushOutbox.attempts + 1)
+
+    del_ = sqlalchemy.delete(PushOutbox)
+    del_ = del_.where(PushOutbox.idempotency_key.in_(idempotency_keys))
+    del_ = del_.where(PushOutbox.attempts >= max_attempts)
+
+    try:
+        await db_session.execute(stmt)
+        deleted = (await db_session.execute(del_)).rowcount
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return deleted
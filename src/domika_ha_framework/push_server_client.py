@@ -0,0 +1,255 @@
+# vim: set fileencoding=utf-8
+"""
+Push server client.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+import math
+import ssl
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Awaitable, Callable, Optional, TypeVar
+
+import aiohttp
+
+from . import config, logger
+from .push_server_errors import DomikaPushServerError
+
+T = TypeVar("T")
+
+HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+
+
+class LatencyWindow:
+    """Rolling window of the latest request latencies."""
+
+    def __init__(self, size: int):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, latency: float):
+        """Add request latency in seconds."""
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        """
+        Get latency percentile.
+
+        Args:
+            q: percentile in range (0, 1].
+
+        Returns:
+            latency percentile in seconds, None if there are no samples.
+        """
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[max(math.ceil(q * len(samples)) - 1, 0)]
+
+
+_latency: dict[str, LatencyWindow] = {}
+
+
+async def init_client():
+    """
+    Create framework owned push server client.
+
+    Do nothing if managed client and push scheduler are disabled in config. If previously created -
+    close old client.
+    """
+    global HTTP_SESSION  # noqa: PLW0603
+
+    if HTTP_SESSION:
+        await close_client()
+
+    _latency.clear()
+
+    if not (config.CONFIG.push_server_managed_client or config.CONFIG.push_scheduler):
+        return
+
+    ssl_context = config.CONFIG.push_server_ssl_context or ssl.create_default_context()
+    connector = aiohttp.TCPConnector(
+        limit=config.CONFIG.push_server_connection_limit,
+        limit_per_host=config.CONFIG.push_server_connection_limit_per_host,
+        keepalive_timeout=config.CONFIG.push_server_keepalive_timeout,
+        use_dns_cache=True,
+        ttl_dns_cache=config.CONFIG.push_server_dns_cache_ttl,
+        ssl=ssl_context,
+    )
+    HTTP_SESSION = aiohttp.ClientSession(
+        connector=connector,
+        timeout=config.CONFIG.push_server_timeout,
+    )
+
+    logger.logger.debug("Push server client initialized.")
+
+
+async def close_client():
+    """Close framework owned push server client and its connections."""
+    global HTTP_SESSION  # noqa: PLW0603
+    if HTTP_SESSION:
+        await HTTP_SESSION.close()
+
+        logger.logger.debug("Push server client closed.")
+
+        HTTP_SESSION = None
+
+
+def get_http_session(http_session: aiohttp.ClientSession | None = None) -> aiohttp.ClientSession:
+    """
+    Get http session for the push server calls.
+
+    Args:
+        http_session: externally supplied aiohttp session. Defaults to None.
+
+    Returns:
+        http_session if set, framework owned client otherwise.
+
+    Raise:
+        push_server_errors.DomikaPushServerError: if http_session is not set and managed client is
+        not initialized.
+    """
+    if http_session is not None:
+        return http_session
+
+    if HTTP_SESSION is None:
+        msg = "Push server client not initialized."
+        raise DomikaPushServerError(msg)
+
+    return HTTP_SESSION
+
+
+def get_latency_percentile(endpoint: str, q: float) -> float | None:
+    """
+    Get latency percentile of the push server endpoint.
+
+    Returns:
+        latency percentile in seconds, None if not enough requests observed.
+    """
+    window = _latency.get(endpoint)
+    if window is None or len(window) < config.CONFIG.push_server_latency_min_samples:
+        return None
+    return window.percentile(q)
+
+
+def get_timeout(endpoint: str) -> aiohttp.ClientTimeout:
+    """
+    Get timeout for the push server endpoint request.
+
+    If adaptive timeout is enabled and enough requests observed, timeout is derived from the
+    endpoint latency percentile. Config push_server_timeout is used otherwise.
+    """
+    if not config.CONFIG.push_server_adaptive_timeout:
+        return config.CONFIG.push_server_timeout
+
+    latency = get_latency_percentile(endpoint, config.CONFIG.push_server_timeout_percentile)
+    if latency is None:
+        return config.CONFIG.push_server_timeout
+
+    return aiohttp.ClientTimeout(
+        total=min(
+            max(
+                latency * config.CONFIG.push_server_timeout_multiplier,
+                config.CONFIG.push_server_timeout_floor,
+            ),
+            config.CONFIG.push_server_timeout_ceiling,
+        ),
+    )
+
+
+def observe_latency(endpoint: str, latency: float):
+    """Add push server endpoint request latency in seconds."""
+    window = _latency.get(endpoint)
+    if window is None:
+        window = LatencyWindow(config.CONFIG.push_server_latency_window)
+        _latency[endpoint] = window
+    window.observe(latency)
+
+
+@asynccontextmanager
+async def request(
+    http_session: aiohttp.ClientSession,
+    method: str,
+    endpoint: str,
+    **kwargs,
+) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+    """
+    Make push server request.
+
+    Request uses endpoint timeout, time to response is added to endpoint latency. Timed out requests
+    are observed too, so timeout grows when push server slows down.
+
+    Args:
+        http_session: aiohttp session.
+        method: http method.
+        endpoint: push server endpoint path, e.g. "notification/push".
+        **kwargs: aiohttp request arguments.
+
+    Yields:
+        push server response.
+    """
+    started = time.monotonic()
+    try:
+        async with http_session.request(
+            method,
+            f"{config.CONFIG.push_server_url}/{endpoint}",
+            timeout=get_timeout(endpoint),
+            **kwargs,
+        ) as resp:
+            observe_latency(endpoint, time.monotonic() - started)
+            yield resp
+    except asyncio.TimeoutError:
+        observe_latency(endpoint, time.monotonic() - started)
+        raise
+
+
+async def hedge(endpoint: str, request_fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    Make hedged push server request.
+
+    If hedging is enabled and request is not finished after hedging percentile latency of the
+    endpoint, the same request is issued once more. First successful result is returned, unfinished
+    request is cancelled. Both requests may reach the push server, so request must be safe to
+    repeat, e.g. carry x-idempotency-key header the push server deduplicates on.
+
+    Args:
+        endpoint: push server endpoint path.
+        request_fn: function that makes the request.
+
+    Returns:
+        request result.
+    """
+    delay = None
+    if config.CONFIG.push_server_hedging:
+        delay = get_latency_percentile(endpoint, config.CONFIG.push_server_hedging_percentile)
+    if delay is None:
+        return await request_fn()
+
+    pending: set[asyncio.Future[T]] = {asyncio.ensure_future(request_fn())}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            logger.logger.debug("Hedging %s request.", endpoint)
+            pending.add(asyncio.ensure_future(request_fn()))
+
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+
+        # All requests failed.
+        raise error  # type: ignore
+    finally:
+        for task in pending:
+            task.cancel()
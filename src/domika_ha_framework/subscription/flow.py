@@ -8,6 +8,7 @@ Subscription data.
 Author(s): Artem Bezborodko
 """
 
+import json
 import uuid
 from typing import Sequence
 
@@ -15,37 +16,87 @@ import sqlalchemy
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..admission import admitted
 from ..errors import DatabaseError
-from .models import DomikaSubscriptionCreate, DomikaSubscriptionUpdate, Subscription
-from .service import create, delete, get, update_in_place
+from .models import DomikaSubscriptionCreate, Subscription
+from .service import (
+    claim_version,
+    create_many,
+    delete_many,
+    get,
+    get_need_push,
+    get_pattern_matcher,
+    replace_patterns,
+    set_need_push,
+    update_need_push_many,
+    upsert_many,
+)
+
+
+def _resubscribe_key(
+    db_session: AsyncSession,  # noqa: ARG001
+    app_session_id: uuid.UUID,
+    subscriptions: dict[str, dict[str, int]],
+) -> tuple:
+    return ("resubscribe", app_session_id, json.dumps(subscriptions, sort_keys=True))
 
 
 # TODO: maybe reorganize data so it can support schemas.
+@admitted(_resubscribe_key)
 async def resubscribe(
     db_session: AsyncSession,
     app_session_id: uuid.UUID,
     subscriptions: dict[str, dict[str, int]],
 ):
     """
-    Remove all existing subscriptions, and subscribe to the new subscriptions.
+    Replace all existing subscriptions with the new subscriptions.
+
+    Only the difference with the existing subscriptions is written: missing subscriptions are
+    created, extra subscriptions are deleted, and changed need_push flags are updated, each with a
+    single executemany statement, in one transaction.
+
+    Runs through the admission controller, identical resubscriptions in flight are coalesced.
 
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
-    await delete(db_session, app_session_id, commit=False)
-    for entity, attrs in subscriptions.items():
-        for attr_name, need_push in attrs.items():
-            # TODO: create_many
-            await create(
-                db_session,
-                DomikaSubscriptionCreate(
-                    app_session_id=app_session_id,
-                    entity_id=entity,
-                    attribute=attr_name,
-                    need_push=bool(need_push),
-                ),
-                commit=False,
+    current = await get_need_push(db_session, app_session_id)
+    new = {
+        (entity, attr_name): bool(need_push)
+        for entity, attrs in subscriptions.items()
+        for attr_name, need_push in attrs.items()
+    }
+
+    await delete_many(
+        db_session,
+        app_session_id,
+        [key for key in current if key not in new],
+        commit=False,
+    )
+    await create_many(
+        db_session,
+        [
+            DomikaSubscriptionCreate(
+                app_session_id=app_session_id,
+                entity_id=entity,
+                attribute=attr_name,
+                need_push=need_push,
             )
+            for (entity, attr_name), need_push in new.items()
+            if (entity, attr_name) not in current
+        ],
+        commit=False,
+    )
+    await update_need_push_many(
+        db_session,
+        app_session_id,
+        {
+            key: need_push
+            for key, need_push in new.items()
+            if key in current and current[key] != need_push
+        },
+        commit=False,
+    )
     try:
         await db_session.commit()
     except SQLAlchemyError as e:
@@ -57,39 +108,167 @@ async def resubscribe_push(
     db_session: AsyncSession,
     app_session_id: uuid.UUID,
     subscriptions: dict[str, set[str]],
-):
+) -> int:
     """
     Set need_push for given app_session_id.
 
     Set need_push to true for given entities attributes, for all other set need_push to false.
 
+    Returns:
+        number of subscriptions which need_push flag changed.
+
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
-    await update_in_place(
+    changed = await set_need_push(
         db_session,
         app_session_id,
-        entity_id="",
-        attribute="",
-        subscription_in=DomikaSubscriptionUpdate(need_push=False),
+        [(entity, attr) for entity, attrs in subscriptions.items() for attr in attrs],
         commit=False,
     )
-    for entity, attrs in subscriptions.items():
-        for attr in attrs:
-            # TODO: update_many
-            await update_in_place(
-                db_session,
+    try:
+        await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return changed
+
+
+async def resubscribe_patterns(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    patterns: dict[str, dict[str, int]],
+):
+    """
+    Replace all pattern subscriptions of the application session.
+
+    Pattern subscription matches all entities which entity id starts with the entity pattern
+    prefix, e.g. "binary_sensor.*" matches the whole domain, "*" matches all entities. Attribute
+    "*" matches all attributes. Pattern subscriptions are never expanded to the subscription rows,
+    they are matched against events when events are stored.
+
+    Args:
+        db_session: sqlalchemy session.
+        app_session_id: application session id.
+        patterns: need_push flag by attribute by entity pattern.
+
+    Raise:
+        errors.InvalidPatternError: if entity pattern is not an entity id prefix followed by "*".
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    await replace_patterns(
+        db_session,
+        app_session_id,
+        {
+            (entity_pattern, attribute): bool(need_push)
+            for entity_pattern, attrs in patterns.items()
+            for attribute, need_push in attrs.items()
+        },
+        commit=False,
+    )
+    try:
+        await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+def _subscription_delta_key(
+    db_session: AsyncSession,  # noqa: ARG001
+    app_session_id: uuid.UUID,
+    *,
+    version: int,
+    added: dict[str, dict[str, int]] | None = None,
+    **changes: dict[str, set[str]] | None,
+) -> tuple:
+    delta = {
+        "added": added or {},
+        **{
+            name: {entity: sorted(attrs) for entity, attrs in (entities or {}).items()}
+            for name, entities in changes.items()
+        },
+    }
+    return ("subscription_delta", app_session_id, version, json.dumps(delta, sort_keys=True))
+
+
+@admitted(_subscription_delta_key)
+async def apply_subscription_delta(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    *,
+    version: int,
+    added: dict[str, dict[str, int]] | None = None,
+    removed: dict[str, set[str]] | None = None,
+    push_on: dict[str, set[str]] | None = None,
+    push_off: dict[str, set[str]] | None = None,
+) -> bool:
+    """
+    Change subscriptions of the application session by delta.
+
+    Added subscriptions are created, or their need_push is updated if they exist. Removed
+    subscriptions are deleted. need_push is set for push_on, and cleared for push_off
+    subscriptions. Every kind of change is applied with a single statement, all in one transaction.
+
+    Delta is applied only if version is greater than the version of the last applied delta, so
+    retries of the same delta are ignored. Identical deltas in flight are coalesced.
+
+    Args:
+        db_session: sqlalchemy session.
+        app_session_id: application session id.
+        version: delta version.
+        added: need_push flag by attribute by entity id of subscriptions to add.
+        removed: attributes by entity id of subscriptions to remove.
+        push_on: attributes by entity id of subscriptions to set need_push.
+        push_off: attributes by entity id of subscriptions to clear need_push.
+
+    Returns:
+        True if delta is applied, False if delta with the same or greater version was applied
+        before.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not await claim_version(db_session, app_session_id, version, commit=False):
+        try:
+            await db_session.rollback()
+        except SQLAlchemyError as e:
+            raise DatabaseError(str(e)) from e
+        return False
+
+    await delete_many(
+        db_session,
+        app_session_id,
+        [(entity, attr) for entity, attrs in (removed or {}).items() for attr in attrs],
+        commit=False,
+    )
+    await upsert_many(
+        db_session,
+        [
+            DomikaSubscriptionCreate(
                 app_session_id=app_session_id,
                 entity_id=entity,
-                attribute=attr,
-                subscription_in=DomikaSubscriptionUpdate(need_push=True),
-                commit=False,
+                attribute=attr_name,
+                need_push=bool(need_push),
             )
+            for entity, attrs in (added or {}).items()
+            for attr_name, need_push in attrs.items()
+        ],
+        commit=False,
+    )
+    need_push_changes = {
+        (entity, attr): True for entity, attrs in (push_on or {}).items() for attr in attrs
+    }
+    need_push_changes.update(
+        ((entity, attr), False) for entity, attrs in (push_off or {}).items() for attr in attrs
+    )
+    await update_need_push_many(db_session, app_session_id, need_push_changes, commit=False)
+
     try:
         await db_session.commit()
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
 
+    return True
+
 
 async def get_push_attributes(db_session: AsyncSession, app_session_id: uuid.UUID) -> list:
     """
@@ -146,6 +325,8 @@ async def get_app_session_id_by_attributes(
     """
     Get all app session id's for with given entity_id that contains attribute from attributes.
 
+    Includes app session id's which pattern subscriptions match entity_id and attribute.
+
     Args:
         db_session: sqlalchemy session.
         entity_id: homeassistant entity id.
@@ -164,6 +345,15 @@ async def get_app_session_id_by_attributes(
         Subscription.attribute.in_(attributes),
     )
     try:
-        return (await db_session.scalars(stmt)).all()
+        app_session_ids = (await db_session.scalars(stmt)).all()
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
+
+    matcher = await get_pattern_matcher(db_session)
+    if not matcher:
+        return app_session_ids
+
+    matched = dict.fromkeys(app_session_ids)
+    for attribute in attributes:
+        matched.update(dict.fromkeys(matcher.match(entity_id, attribute)))
+    return list(matched)
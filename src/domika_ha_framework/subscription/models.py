@@ -13,9 +13,10 @@ import uuid
 
 from mashumaro import pass_through
 from mashumaro.mixins.json import DataClassJSONMixin
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
+from ..database.interning import Interned
 from ..models import AsyncBase
 
 
@@ -28,11 +29,52 @@ class Subscription(AsyncBase):
         ForeignKey("devices.app_session_id", ondelete="CASCADE", onupdate="CASCADE"),
         primary_key=True,
     )
-    entity_id: Mapped[str] = mapped_column(primary_key=True)
+    entity_id: Mapped[str] = mapped_column(Interned, primary_key=True)
+    attribute: Mapped[str] = mapped_column(Interned, primary_key=True)
+    need_push: Mapped[bool]
+
+    __table_args__ = (
+        # Covers routing of events to subscribed application sessions.
+        Index(
+            "ix_subscriptions_entity_id_attribute",
+            "entity_id",
+            "attribute",
+            "need_push",
+            "app_session_id",
+        ),
+    )
+
+
+class PatternSubscription(AsyncBase):
+    """
+    Event subscriptions by entity pattern.
+
+    entity_pattern is an entity id prefix followed by "*", attribute "*" matches all attributes.
+    """
+
+    __tablename__ = "pattern_subscriptions"
+
+    app_session_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("devices.app_session_id", ondelete="CASCADE", onupdate="CASCADE"),
+        primary_key=True,
+    )
+    entity_pattern: Mapped[str] = mapped_column(primary_key=True)
     attribute: Mapped[str] = mapped_column(primary_key=True)
     need_push: Mapped[bool]
 
 
+class SubscriptionVersion(AsyncBase):
+    """Version of the last subscription delta applied for the application session."""
+
+    __tablename__ = "subscription_versions"
+
+    app_session_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("devices.app_session_id", ondelete="CASCADE", onupdate="CASCADE"),
+        primary_key=True,
+    )
+    version: Mapped[int]
+
+
 @dataclass
 class DomikaSubscriptionBase(DataClassJSONMixin):
     """Base subscription model."""
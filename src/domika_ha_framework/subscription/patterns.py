@@ -0,0 +1,94 @@
+# vim: set fileencoding=utf-8
+"""
+Subscription data.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import uuid
+
+from ..errors import InvalidPatternError
+
+# Matches any entity id, or any attribute.
+WILDCARD = "*"
+
+
+def entity_prefix(entity_pattern: str) -> str:
+    """
+    Return entity id prefix of the entity pattern.
+
+    Entity pattern is an entity id prefix followed by "*", e.g. "binary_sensor.*" for the whole
+    domain, "light.kitchen_*" for entity id prefix, or "*" for all entities.
+
+    Raise:
+        errors.InvalidPatternError: if entity pattern is not a prefix followed by "*".
+    """
+    if not entity_pattern.endswith(WILDCARD) or WILDCARD in entity_pattern[:-1]:
+        raise InvalidPatternError(entity_pattern)
+    return entity_pattern[:-1]
+
+
+class PatternMatcher:
+    """
+    Matches entity attributes against pattern subscriptions.
+
+    Patterns are kept in a hash of entity id prefixes, so match costs one lookup per distinct
+    prefix length, regardless of the number of patterns.
+    """
+
+    def __init__(self):
+        # need_push by app session id by attribute by entity id prefix.
+        self._prefixes: dict[str, dict[str, dict[uuid.UUID, bool]]] = {}
+        self._lengths: list[int] = []
+
+    def __bool__(self) -> bool:
+        return bool(self._prefixes)
+
+    def __len__(self) -> int:
+        return sum(
+            len(app_session_ids)
+            for attributes in self._prefixes.values()
+            for app_session_ids in attributes.values()
+        )
+
+    def add(
+        self,
+        app_session_id: uuid.UUID,
+        entity_pattern: str,
+        attribute: str,
+        *,
+        need_push: bool,
+    ):
+        """
+        Add pattern subscription.
+
+        Raise:
+            errors.InvalidPatternError: if entity pattern is not a prefix followed by "*".
+        """
+        prefix = entity_prefix(entity_pattern)
+        if prefix not in self._prefixes:
+            self._prefixes[prefix] = {}
+            if len(prefix) not in self._lengths:
+                self._lengths.append(len(prefix))
+        self._prefixes[prefix].setdefault(attribute, {})[app_session_id] = need_push
+
+    def match(self, entity_id: str, attribute: str) -> dict[uuid.UUID, bool]:
+        """
+        Match entity attribute against pattern subscriptions.
+
+        Returns:
+            need_push by app session id of matched subscriptions. need_push is true if any of the
+            matched subscriptions of the app session needs push.
+        """
+        matched: dict[uuid.UUID, bool] = {}
+        for length in self._lengths:
+            attributes = self._prefixes.get(entity_id[:length])
+            if attributes is None:
+                continue
+            for attr in (attribute, WILDCARD):
+                for app_session_id, need_push in attributes.get(attr, {}).items():
+                    matched[app_session_id] = matched.get(app_session_id, False) or need_push
+        return matched
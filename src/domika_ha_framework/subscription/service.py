@@ -8,17 +8,29 @@ Subscription data.
 Author(s): Artem Bezborodko
 """
 
+import json
 import uuid
 from collections.abc import Sequence
 from dataclasses import asdict
 from typing import Optional
 
 import sqlalchemy
+import sqlalchemy.dialects.sqlite as sqlite_dialect
+from sqlalchemy import orm
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..database import core as database_core
+from ..database import interning
 from ..errors import DatabaseError
-from .models import DomikaSubscriptionCreate, DomikaSubscriptionUpdate, Subscription
+from .models import (
+    DomikaSubscriptionCreate,
+    DomikaSubscriptionUpdate,
+    PatternSubscription,
+    Subscription,
+    SubscriptionVersion,
+)
+from .patterns import PatternMatcher, entity_prefix
 
 
 async def get(
@@ -32,6 +44,7 @@ async def get(
     Get all subscriptions by application session id.
 
     Subscriptions filtered by need_push flag. If need_push is None no filtering applied.
+    Subscriptions are ordered by entity_id and attribute.
 
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
@@ -41,7 +54,12 @@ async def get(
         stmt = stmt.where(Subscription.need_push == need_push)
     if entity_id:
         stmt = stmt.where(Subscription.entity_id == entity_id)
-    stmt = stmt.order_by(Subscription.entity_id).order_by(Subscription.attribute)
+    # Order by interned strings, not by their ids.
+    entity_id_value = orm.aliased(interning.InternedString)
+    attribute_value = orm.aliased(interning.InternedString)
+    stmt = stmt.join(entity_id_value, entity_id_value.id == Subscription.entity_id)
+    stmt = stmt.join(attribute_value, attribute_value.id == Subscription.attribute)
+    stmt = stmt.order_by(entity_id_value.value).order_by(attribute_value.value)
 
     try:
         return (await db_session.scalars(stmt)).all()
@@ -49,6 +67,40 @@ async def get(
         raise DatabaseError(str(e)) from e
 
 
+async def get_need_push(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+) -> dict[tuple[str, str], bool]:
+    """
+    Get need_push flags of all subscriptions by application session id.
+
+    Returns:
+        need_push flags by (entity_id, attribute).
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(
+        Subscription.entity_id,
+        Subscription.attribute,
+        Subscription.need_push,
+    ).where(Subscription.app_session_id == app_session_id)
+
+    try:
+        result = await db_session.execute(stmt)
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return {(entity_id, attribute): need_push for entity_id, attribute, need_push in result}
+
+
+async def _intern(db_session: AsyncSession, subscriptions_in: Sequence[DomikaSubscriptionCreate]):
+    await interning.intern(
+        db_session,
+        {s.entity_id for s in subscriptions_in} | {s.attribute for s in subscriptions_in},
+    )
+
+
 async def create(
     db_session: AsyncSession,
     subscription_in: DomikaSubscriptionCreate,
@@ -61,6 +113,8 @@ async def create(
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
+    await _intern(db_session, [subscription_in])
+
     subscription = Subscription(**subscription_in.to_dict())
     db_session.add(subscription)
 
@@ -72,6 +126,76 @@ async def create(
         raise DatabaseError(str(e)) from e
 
 
+async def create_many(
+    db_session: AsyncSession,
+    subscriptions_in: Sequence[DomikaSubscriptionCreate],
+    *,
+    commit: bool = True,
+):
+    """
+    Create new subscriptions with a single executemany INSERT.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not subscriptions_in:
+        return
+
+    await _intern(db_session, subscriptions_in)
+
+    try:
+        await db_session.execute(
+            sqlalchemy.insert(Subscription),
+            [subscription_in.to_dict() for subscription_in in subscriptions_in],
+        )
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def upsert_many(
+    db_session: AsyncSession,
+    subscriptions_in: Sequence[DomikaSubscriptionCreate],
+    *,
+    commit: bool = True,
+):
+    """
+    Create new subscriptions, or update need_push of existing, with a single executemany INSERT.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not subscriptions_in:
+        return
+
+    await _intern(db_session, subscriptions_in)
+
+    stmt = sqlite_dialect.insert(Subscription)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            Subscription.app_session_id,
+            Subscription.entity_id,
+            Subscription.attribute,
+        ],
+        set_={
+            "need_push": stmt.excluded.need_push,
+        },
+    )
+
+    try:
+        await db_session.execute(
+            stmt,
+            [subscription_in.to_dict() for subscription_in in subscriptions_in],
+        )
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
 async def update(
     db_session: AsyncSession,
     subscription: Subscription,
@@ -130,19 +254,408 @@ async def update_in_place(
         raise DatabaseError(str(e)) from e
 
 
-async def delete(db_session: AsyncSession, app_session_id: uuid.UUID, *, commit: bool = True):
+async def update_need_push_many(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    need_push: dict[tuple[str, str], bool],
+    *,
+    commit: bool = True,
+):
+    """
+    Set need_push flags by (entity_id, attribute) with a single executemany UPDATE.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not need_push:
+        return
+
+    try:
+        await db_session.execute(
+            sqlalchemy.update(Subscription),
+            [
+                {
+                    "app_session_id": app_session_id,
+                    "entity_id": entity_id,
+                    "attribute": attribute,
+                    "need_push": need_push_,
+                }
+                for (entity_id, attribute), need_push_ in need_push.items()
+            ],
+        )
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def set_need_push(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    keys: Sequence[tuple[str, str]],
+    *,
+    commit: bool = True,
+) -> int:
     """
-    Delete subscription.
+    Set need_push for given (entity_id, attribute) pairs, for all other set need_push to false.
+
+    Applied with a single UPDATE statement, and touches only subscriptions which need_push flag
+    changes. Pairs are bound as one JSON array parameter, so number of pairs is not limited by the
+    number of statement parameters.
+
+    Returns:
+        number of changed subscriptions.
 
     Raise:
         errors.DatabaseError: in case when database operation can't be performed.
     """
-    stmt = sqlalchemy.delete(Subscription).where(Subscription.app_session_id == app_session_id)
+    pairs = sqlalchemy.func.json_each(json.dumps([list(key) for key in keys])).table_valued(
+        "value",
+    )
+    entity_id = orm.aliased(interning.InternedString)
+    attribute = orm.aliased(interning.InternedString)
+    # Interned string ids of the pairs, pairs with strings which are not interned match nothing.
+    need_push_keys = sqlalchemy.select(entity_id.id, attribute.id)
+    need_push_keys = need_push_keys.join_from(
+        pairs,
+        entity_id,
+        entity_id.value == sqlalchemy.func.json_extract(pairs.c.value, "$[0]"),
+    )
+    need_push_keys = need_push_keys.join(
+        attribute,
+        attribute.value == sqlalchemy.func.json_extract(pairs.c.value, "$[1]"),
+    )
+    need_push_keys_cte = need_push_keys.cte("need_push_keys")
+    need_push = sqlalchemy.tuple_(Subscription.entity_id, Subscription.attribute).in_(
+        sqlalchemy.select(need_push_keys_cte),
+    )
+
+    stmt = sqlalchemy.update(Subscription)
+    stmt = stmt.add_cte(need_push_keys_cte)
+    stmt = stmt.where(Subscription.app_session_id == app_session_id)
+    stmt = stmt.where(Subscription.need_push != need_push)
+    stmt = stmt.values(need_push=need_push)
+
+    try:
+        result = await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
+async def delete_many(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    keys: Sequence[tuple[str, str]],
+    *,
+    commit: bool = True,
+):
+    """
+    Delete subscriptions by (entity_id, attribute) with a single executemany DELETE.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    if not keys:
+        return
+
+    table = Subscription.__table__
+    stmt = sqlalchemy.delete(table).where(
+        table.c.app_session_id == app_session_id,
+        table.c.entity_id == sqlalchemy.bindparam("b_entity_id"),
+        table.c.attribute == sqlalchemy.bindparam("b_attribute"),
+    )
+
+    try:
+        await db_session.execute(
+            stmt,
+            [{"b_entity_id": entity_id, "b_attribute": attribute} for entity_id, attribute in keys],
+        )
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def delete(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID | list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Delete all subscriptions by app session id, or list of app session id's.
+
+    Returns:
+        number of deleted subscriptions.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    app_session_ids = app_session_id if isinstance(app_session_id, list) else [app_session_id]
+    stmt = sqlalchemy.delete(Subscription).where(Subscription.app_session_id.in_(app_session_ids))
+
+    try:
+        result = await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
+async def get_version(db_session: AsyncSession, app_session_id: uuid.UUID) -> int:
+    """
+    Get version of the last subscription delta applied for the application session.
+
+    Returns:
+        subscription version, 0 if no delta was applied.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(SubscriptionVersion.version)
+    stmt = stmt.where(SubscriptionVersion.app_session_id == app_session_id)
+    try:
+        return await db_session.scalar(stmt) or 0
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+
+async def claim_version(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    version: int,
+    *,
+    commit: bool = True,
+) -> bool:
+    """
+    Set subscription version for the application session, if it is greater than the current one.
+
+    Returns:
+        True if version is set, False if the current version is the same or greater.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlite_dialect.insert(SubscriptionVersion)
+    stmt = stmt.values(app_session_id=app_session_id, version=version)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SubscriptionVersion.app_session_id],
+        set_={
+            "version": stmt.excluded.version,
+        },
+        where=stmt.excluded.version > SubscriptionVersion.version,
+    )
+    stmt = stmt.returning(SubscriptionVersion.version)
+
+    try:
+        claimed = await db_session.scalar(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return claimed is not None
+
+
+async def delete_versions(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID | list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Delete subscription versions by app session id, or list of app session id's.
+
+    Returns:
+        number of deleted subscription versions.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    app_session_ids = app_session_id if isinstance(app_session_id, list) else [app_session_id]
+    stmt = sqlalchemy.delete(SubscriptionVersion)
+    stmt = stmt.where(SubscriptionVersion.app_session_id.in_(app_session_ids))
+
+    try:
+        result = await db_session.execute(stmt)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
+
+
+_pattern_matcher: PatternMatcher | None = None
+# Incremented on every pattern matcher invalidation.
+_pattern_matcher_generation = 0
+
+
+def _invalidate_pattern_matcher():
+    global _pattern_matcher, _pattern_matcher_generation  # noqa: PLW0603
+    _pattern_matcher = None
+    _pattern_matcher_generation += 1
+
+
+def _invalidate_pattern_matcher_on_commit(db_session: AsyncSession):
+    """Invalidate pattern matcher now, and when session transaction is committed."""
+    _invalidate_pattern_matcher()
+    database_core.after_commit(db_session, _invalidate_pattern_matcher)
+
+
+async def get_pattern_matcher(db_session: AsyncSession) -> PatternMatcher:
+    """
+    Get matcher of all pattern subscriptions.
+
+    Matcher is loaded once, then loaded again only after pattern subscriptions are changed.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    global _pattern_matcher  # noqa: PLW0603
+    if _pattern_matcher is not None:
+        return _pattern_matcher
+
+    generation = _pattern_matcher_generation
+    stmt = sqlalchemy.select(
+        PatternSubscription.app_session_id,
+        PatternSubscription.entity_pattern,
+        PatternSubscription.attribute,
+        PatternSubscription.need_push,
+    )
+    matcher = PatternMatcher()
+    try:
+        for app_session_id, entity_pattern, attribute, need_push in await db_session.execute(stmt):
+            matcher.add(app_session_id, entity_pattern, attribute, need_push=need_push)
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    # Do not cache uncommitted changes, and matcher loaded before concurrent invalidation.
+    if generation == _pattern_matcher_generation and not database_core.has_after_commit(db_session):
+        _pattern_matcher = matcher
+    return matcher
+
+
+get_pattern_matcher.cache_clear = _invalidate_pattern_matcher  # type: ignore
+
+
+async def get_patterns(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+) -> dict[tuple[str, str], bool]:
+    """
+    Get need_push flags of all pattern subscriptions by application session id.
+
+    Returns:
+        need_push flags by (entity_pattern, attribute).
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    stmt = sqlalchemy.select(
+        PatternSubscription.entity_pattern,
+        PatternSubscription.attribute,
+        PatternSubscription.need_push,
+    ).where(PatternSubscription.app_session_id == app_session_id)
+
+    try:
+        result = await db_session.execute(stmt)
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return {
+        (entity_pattern, attribute): need_push for entity_pattern, attribute, need_push in result
+    }
+
+
+async def replace_patterns(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID,
+    patterns: dict[tuple[str, str], bool],
+    *,
+    commit: bool = True,
+):
+    """
+    Replace all pattern subscriptions of the application session.
+
+    Args:
+        db_session: sqlalchemy session.
+        app_session_id: application session id.
+        patterns: need_push flags by (entity_pattern, attribute).
+        commit: commit transaction. Defaults to True.
+
+    Raise:
+        errors.InvalidPatternError: if entity pattern is not an entity id prefix followed by "*".
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    for entity_pattern, _attribute in patterns:
+        entity_prefix(entity_pattern)
+
+    stmt = sqlalchemy.delete(PatternSubscription)
+    stmt = stmt.where(PatternSubscription.app_session_id == app_session_id)
 
     try:
         await db_session.execute(stmt)
+        if patterns:
+            await db_session.execute(
+                sqlalchemy.insert(PatternSubscription),
+                [
+                    {
+                        "app_session_id": app_session_id,
+                        "entity_pattern": entity_pattern,
+                        "attribute": attribute,
+                        "need_push": need_push,
+                    }
+                    for (entity_pattern, attribute), need_push in patterns.items()
+                ],
+            )
+        _invalidate_pattern_matcher_on_commit(db_session)
 
         if commit:
             await db_session.commit()
     except SQLAlchemyError as e:
         raise DatabaseError(str(e)) from e
+
+
+async def delete_patterns(
+    db_session: AsyncSession,
+    app_session_id: uuid.UUID | list[uuid.UUID],
+    *,
+    commit: bool = True,
+) -> int:
+    """
+    Delete all pattern subscriptions by app session id, or list of app session id's.
+
+    Returns:
+        number of deleted pattern subscriptions.
+
+    Raise:
+        errors.DatabaseError: in case when database operation can't be performed.
+    """
+    app_session_ids = app_session_id if isinstance(app_session_id, list) else [app_session_id]
+    stmt = sqlalchemy.delete(PatternSubscription)
+    stmt = stmt.where(PatternSubscription.app_session_id.in_(app_session_ids))
+
+    try:
+        result = await db_session.execute(stmt)
+        if result.rowcount:
+            _invalidate_pattern_matcher_on_commit(db_session)
+
+        if commit:
+            await db_session.commit()
+    except SQLAlchemyError as e:
+        raise DatabaseError(str(e)) from e
+
+    return result.rowcount
@@ -11,20 +11,29 @@ Author(s): Artem Bezborodko
 import asyncio
 import datetime
 import os
+import uuid
 from contextlib import asynccontextmanager
-from typing import AsyncContextManager, TypeVar
+from typing import AsyncContextManager, AsyncGenerator, Awaitable, Callable, TypeVar
 
 import aiohttp
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import domika_ha_framework.device.service as device_service
+import domika_ha_framework.subscription.service as subscription_service
 from domika_ha_framework import config, push_data
 from domika_ha_framework.database import core as database_core
+from domika_ha_framework.database import interning
 from domika_ha_framework.database import manage as database_manage
+from domika_ha_framework.device import heartbeat
+from domika_ha_framework.device.models import Device
 from domika_ha_framework.models import AsyncBase
 
+from .utils import NOT_SET, NotSet, PushServerStub
+
 load_dotenv(override=True)
 
 T = TypeVar("T")
@@ -52,6 +61,10 @@ async def db_session(session: AsyncSession):
     async with session as db_session:
         # Clear caches.
         device_service.get_all_with_push_session_id.cache_clear()
+        device_service.get_record.cache_clear()
+        heartbeat.clear()
+        subscription_service.get_pattern_matcher.cache_clear()
+        interning.clear()
 
         # Clear DB before test function.
         for table in reversed(AsyncBase.metadata.sorted_tables):
@@ -102,3 +115,43 @@ async def push_data_processor(request: pytest.FixtureRequest) -> AsyncContextMan
 @pytest.fixture
 def timestamp_now() -> int:
     return int(datetime.datetime.now(datetime.UTC).timestamp() * 1e6)
+
+
+@pytest.fixture
+def domika_device_factory(
+    db_session: AsyncSession,
+    timestamp_now: int,
+) -> Callable[..., Awaitable[Device]]:
+    async def fn(
+        app_session_id: uuid.UUID | NotSet = NOT_SET,
+        user_id: str | NotSet = NOT_SET,
+        push_session_id: uuid.UUID | None | NotSet = NOT_SET,
+        push_token_hash: str | NotSet = NOT_SET,
+    ) -> Device:
+        device = Device(
+            app_session_id=uuid.uuid4() if app_session_id is NOT_SET else app_session_id,
+            user_id="user_id" if user_id is NOT_SET else user_id,
+            push_session_id=uuid.uuid4() if push_session_id is NOT_SET else push_session_id,
+            push_token_hash="push_token_hash" if push_token_hash is NOT_SET else push_token_hash,
+            last_update=timestamp_now,
+        )
+        db_session.add(device)
+        await db_session.commit()
+        return device
+
+    return fn
+
+
+@pytest.fixture
+async def push_server() -> AsyncGenerator[PushServerStub, None]:
+    stub = PushServerStub()
+    app = web.Application()
+    app.router.add_post("/notification/bulk_push", stub.handle_bulk)
+    app.router.add_post("/notification/{kind}", stub.handle)
+    async with TestServer(app) as server:
+        push_server_url = config.CONFIG.push_server_url
+        config.CONFIG.push_server_url = str(server.make_url("")).rstrip("/")
+        try:
+            yield stub
+        finally:
+            config.CONFIG.push_server_url = push_server_url
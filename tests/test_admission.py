@@ -0,0 +1,123 @@
+# vim: set fileencoding=utf-8
+"""
+Test admission control.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+
+import pytest
+
+from domika_ha_framework.admission import AdmissionController
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_concurrency_limit() -> None:
+    controller = AdmissionController(2)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fn() -> None:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    await asyncio.gather(*(controller.run(None, fn) for _ in range(6)))
+
+    assert max_in_flight == 2
+    assert controller.metrics.admitted == 6
+    assert controller.metrics.waiting == 0
+    assert controller.metrics.max_wait > 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_coalescing() -> None:
+    controller = AdmissionController(10)
+    calls = 0
+
+    async def fn() -> int:
+        nonlocal calls
+        calls += 1
+        call = calls
+        await asyncio.sleep(0.01)
+        return call
+
+    results = await asyncio.gather(
+        controller.run("key", fn),
+        controller.run("key", fn),
+        controller.run("other_key", fn),
+    )
+
+    assert sorted(results) == [1, 1, 2]
+    assert calls == 2
+    assert controller.metrics.coalesced == 1
+
+    # Key is released after the call is finished.
+    assert await controller.run("key", fn) == 3
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_coalesced_error() -> None:
+    controller = AdmissionController(10)
+
+    async def fn() -> None:
+        await asyncio.sleep(0.01)
+        msg = "failed"
+        raise ValueError(msg)
+
+    results = await asyncio.gather(
+        controller.run("key", fn),
+        controller.run("key", fn),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_coalesced_leader_cancelled() -> None:
+    controller = AdmissionController(10)
+    calls = 0
+
+    async def fn() -> int:
+        nonlocal calls
+        calls += 1
+        call = calls
+        await asyncio.sleep(0.01)
+        return call
+
+    leader = asyncio.create_task(controller.run("key", fn))
+    await asyncio.sleep(0)
+    followers = [asyncio.create_task(controller.run("key", fn)) for _ in range(2)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    # One of the followers runs the call instead of the cancelled one, the other joins it.
+    assert await asyncio.gather(*followers) == [2, 2]
+    assert leader.cancelled()
+    assert calls == 2
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_coalesced_follower_cancelled() -> None:
+    controller = AdmissionController(10)
+
+    async def fn() -> int:
+        await asyncio.sleep(0.01)
+        return 1
+
+    leader = asyncio.create_task(controller.run("key", fn))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(controller.run("key", fn))
+    await asyncio.sleep(0)
+    follower.cancel()
+
+    assert await leader == 1
+    with pytest.raises(asyncio.CancelledError):
+        await follower
@@ -13,7 +13,7 @@ from unittest.mock import Mock, patch
 
 import pytest
 
-from domika_ha_framework.cache import CacheKey, cache_key, cached
+from domika_ha_framework.cache import CacheInfo, CacheKey, LRUCache, cache_key, cached
 
 pytestmark = pytest.mark.usefixtures("_clear_cache")
 
@@ -102,3 +102,21 @@ async def test_without_cache(mock_counter_stub: Mock) -> None:
     await _fn1(3)
     await _fn1.without_cache(3)
     assert mock_counter_stub.call_count == 2
+
+
+def test_lru_cache() -> None:
+    cache: LRUCache[int, str] = LRUCache(2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+
+    assert cache.get(1) == "a"
+    # 2 is least recently used, so it is evicted.
+    cache.put(3, "c")
+
+    assert cache.get(2) is None
+    assert cache.get(3) == "c"
+    assert cache.info() == CacheInfo(hits=2, misses=1, maxsize=2, currsize=2)
+
+    cache.pop(3)
+    assert cache.get(3) is None
+    assert len(cache) == 1
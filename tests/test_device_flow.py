@@ -0,0 +1,138 @@
+# vim: set fileencoding=utf-8
+"""
+Test device flow.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import uuid
+from collections.abc import Generator
+from typing import Awaitable, Callable
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import domika_ha_framework.device.flow as device_flow
+import domika_ha_framework.device.service as device_service
+from domika_ha_framework import config
+from domika_ha_framework.device import heartbeat
+from domika_ha_framework.device.models import Device, DomikaDeviceUpdate
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_update_app_session_id_existing(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(push_token_hash="hash")  # noqa: S106
+    old_device = await domika_device_factory(push_token_hash="hash")  # noqa: S106
+    app_session_id = device.app_session_id
+    old_app_session_id = old_device.app_session_id
+
+    with patch.object(db_session, "commit", wraps=db_session.commit) as commit:
+        result = await device_flow.update_app_session_id(
+            db_session,
+            app_session_id,
+            "user_id",
+            "hash",
+        )
+
+    assert result == (app_session_id, [old_app_session_id])
+    commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_update_app_session_id_user_mismatch(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(user_id="other_user_id")
+    app_session_id = device.app_session_id
+
+    new_app_session_id, old_app_sessions = await device_flow.update_app_session_id(
+        db_session,
+        app_session_id,
+        "user_id",
+        "",
+    )
+
+    assert new_app_session_id != app_session_id
+    assert not old_app_sessions
+    devices = await device_service.get_all(db_session)
+    assert [(d.app_session_id, d.user_id) for d in devices] == [(new_app_session_id, "user_id")]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_update_app_session_id_unknown(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+
+    new_app_session_id, _ = await device_flow.update_app_session_id(
+        db_session,
+        app_session_id,
+        "user_id",
+        "hash",
+    )
+
+    # Unknown app session id is not registered, new one is generated.
+    assert new_app_session_id != app_session_id
+    assert await device_service.get(db_session, new_app_session_id)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_update_app_session_id_keyword_arguments(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(push_token_hash="hash")  # noqa: S106
+
+    result = await device_flow.update_app_session_id(
+        db_session=db_session,
+        app_session_id=device.app_session_id,
+        user_id="user_id",
+        push_token_hash="hash",  # noqa: S106
+    )
+
+    assert result == (device.app_session_id, [])
+
+
+@pytest.fixture
+def heartbeat_granularity() -> Generator[None, None, None]:
+    config.CONFIG.heartbeat_granularity = 60
+    yield
+    config.CONFIG.heartbeat_granularity = 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.usefixtures("heartbeat_granularity")
+async def test_heartbeat(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory()
+    app_session_id = device.app_session_id
+    await device_service.update_in_place(
+        db_session,
+        app_session_id,
+        DomikaDeviceUpdate(last_update=0),
+    )
+
+    # Touch is buffered until flush.
+    await device_flow.update_app_session_id(db_session, app_session_id, "user_id", "")
+    assert heartbeat.pending() == {app_session_id}
+
+    assert await heartbeat.flush(now=100) == 1
+    assert not heartbeat.pending()
+    db_device = await device_service.get(db_session, app_session_id)
+    assert db_device
+    await db_session.refresh(db_device)
+    assert db_device.last_update != 0
+
+    # Touch within granularity is skipped.
+    heartbeat.touch(app_session_id, now=150)
+    assert not heartbeat.pending()
+    heartbeat.touch(app_session_id, now=160)
+    assert heartbeat.pending() == {app_session_id}
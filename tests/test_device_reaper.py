@@ -0,0 +1,99 @@
+# vim: set fileencoding=utf-8
+"""
+Test device reaper.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import uuid
+from typing import Awaitable, Callable
+
+import pytest
+import sqlalchemy
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import domika_ha_framework.device.service as device_service
+import domika_ha_framework.push_data.service as push_data_service
+import domika_ha_framework.subscription.flow as subscription_flow
+import domika_ha_framework.subscription.service as subscription_service
+from domika_ha_framework.device import heartbeat, reaper
+from domika_ha_framework.device.models import Device
+from domika_ha_framework.push_data.models import DomikaPushDataCreate, DomikaPushOutboxCreate
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_reap(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+    timestamp_now: int,
+) -> None:
+    devices = [await domika_device_factory(app_session_id=uuid.UUID(int=n)) for n in range(5)]
+    for device in devices:
+        await subscription_flow.resubscribe(
+            db_session,
+            device.app_session_id,
+            {"ent1": {"attr1": 1}},
+        )
+    await subscription_flow.resubscribe_patterns(
+        db_session,
+        uuid.UUID(int=0),
+        {"light.*": {"state": 1}},
+    )
+    await subscription_flow.apply_subscription_delta(db_session, uuid.UUID(int=0), version=1)
+    await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id="ent1",
+                attribute="attr1",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            ),
+        ],
+    )
+    await push_data_service.create_outbox(
+        db_session,
+        [
+            DomikaPushOutboxCreate(
+                idempotency_key="key",
+                app_session_id=uuid.UUID(int=0),
+                push_session_id=uuid.uuid4(),
+                payload="{}",
+                created=0,
+            ),
+        ],
+    )
+    # Devices 0..3 are stale, device 4 is active.
+    await db_session.execute(
+        sqlalchemy.update(Device).values(last_update=func.datetime("now", "-2 days")),
+    )
+    await db_session.execute(
+        sqlalchemy.update(Device)
+        .where(Device.app_session_id == uuid.UUID(int=4))
+        .values(last_update=func.datetime("now")),
+    )
+    await db_session.commit()
+    # Device 3 has connected, but heartbeat is not flushed yet.
+    heartbeat.touch(uuid.UUID(int=3))
+
+    result = await reaper.reap(max_age=24 * 60 * 60, batch_size=2)
+
+    assert result == reaper.DomikaReapResult(
+        devices=3,
+        subscriptions=3,
+        push_data=3,
+        push_outbox=1,
+    )
+    remaining = await device_service.get_all(db_session)
+    assert [d.app_session_id for d in remaining] == [uuid.UUID(int=3), uuid.UUID(int=4)]
+    assert len(await push_data_service.get_all(db_session)) == 2
+    assert not await push_data_service.get_outbox(db_session)
+    assert not await subscription_service.get_patterns(db_session, uuid.UUID(int=0))
+    assert await subscription_service.get_version(db_session, uuid.UUID(int=0)) == 0
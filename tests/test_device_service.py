@@ -9,52 +9,130 @@ Author(s): Artem Bezborodko
 """
 
 import uuid
+from collections.abc import Sequence
 from typing import Awaitable, Callable
+from unittest.mock import patch
 
 import pytest
+import sqlalchemy
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import domika_ha_framework.device.service as device_service
-from domika_ha_framework.device.models import Device, DomikaDeviceCreate, DomikaDeviceUpdate
+from domika_ha_framework.device.models import (
+    Device,
+    DeviceRecord,
+    DomikaDeviceCreate,
+    DomikaDeviceUpdate,
+)
 
-from .utils import NOT_SET, NotSet
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory()
+
+    device = await device_service.get(db_session, device.app_session_id)
 
-@pytest.fixture
-def domika_device_factory(
+    assert device
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_record(
     db_session: AsyncSession,
-    timestamp_now: int,
-) -> Callable[..., Awaitable[Device]]:
-    async def fn(
-        app_session_id: uuid.UUID | NotSet = NOT_SET,
-        user_id: str | NotSet = NOT_SET,
-        push_session_id: uuid.UUID | None | NotSet = NOT_SET,
-        push_token_hash: str | NotSet = NOT_SET,
-    ) -> Device:
-        device = Device(
-            app_session_id=uuid.uuid4() if app_session_id is NOT_SET else app_session_id,
-            user_id="user_id" if user_id is NOT_SET else user_id,
-            push_session_id=uuid.uuid4() if push_session_id is NOT_SET else push_session_id,
-            push_token_hash="push_token_hash" if push_token_hash is NOT_SET else push_token_hash,
-            last_update=timestamp_now,
-        )
-        db_session.add(device)
-        await db_session.commit()
-        return device
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory()
+
+    record = await device_service.get_record(db_session, device.app_session_id)
+    assert record == DeviceRecord.from_device(device)
+    assert await device_service.get_record(db_session, device.app_session_id) is record
+    assert await device_service.get_record(db_session, uuid.uuid4()) is None
 
-    return fn
+    cache_info = device_service.get_record.cache_info()
+    assert (cache_info.hits, cache_info.misses, cache_info.currsize) == (1, 2, 1)
 
 
 @pytest.mark.asyncio(loop_scope="session")
-async def test_get(
+async def test_get_many(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    app_session_ids = [uuid.UUID(int=n) for n in range(5)]
+    for app_session_id in app_session_ids:
+        await domika_device_factory(app_session_id=app_session_id)
+
+    devices = await device_service.get_many(
+        db_session,
+        [*app_session_ids, uuid.uuid4()],
+        chunk_size=2,
+    )
+
+    assert sorted(devices) == app_session_ids
+    assert all(devices[key].app_session_id == key for key in app_session_ids)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_records(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    devices = [await domika_device_factory(app_session_id=uuid.UUID(int=n)) for n in range(5)]
+    cached = await device_service.get_record(db_session, uuid.UUID(int=0))
+
+    records = await device_service.get_records(
+        db_session,
+        [d.app_session_id for d in devices] + [uuid.uuid4()],
+        chunk_size=2,
+    )
+
+    assert records == {d.app_session_id: DeviceRecord.from_device(d) for d in devices}
+    assert records[uuid.UUID(int=0)] is cached
+
+    # Loaded records are cached.
+    cache_info = device_service.get_record.cache_info()
+    assert (cache_info.hits, cache_info.currsize) == (1, 5)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_record_invalidation(
     db_session: AsyncSession,
     domika_device_factory: Callable[..., Awaitable[Device]],
 ) -> None:
     device = await domika_device_factory()
+    app_session_id = device.app_session_id
+    await device_service.get_record(db_session, app_session_id)
 
-    device = await device_service.get(db_session, device.app_session_id)
+    await device_service.update_in_place(
+        db_session,
+        app_session_id,
+        DomikaDeviceUpdate(push_session_id=None),
+    )
 
-    assert device
+    record = await device_service.get_record(db_session, app_session_id)
+    assert record
+    assert record.push_session_id is None
+
+    # Uncommitted changes are not cached.
+    await device_service.update_in_place(
+        db_session,
+        app_session_id,
+        DomikaDeviceUpdate(push_token_hash="new_hash"),  # noqa: S106
+        commit=False,
+    )
+    record = await device_service.get_record(db_session, app_session_id)
+    assert record
+    assert record.push_token_hash == "new_hash"  # noqa: S105
+    await db_session.rollback()
+
+    record = await device_service.get_record(db_session, app_session_id)
+    assert record
+    assert record.push_token_hash == "push_token_hash"  # noqa: S105
+
+    await device_service.delete(db_session, app_session_id)
+
+    assert await device_service.get_record(db_session, app_session_id) is None
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -72,6 +150,20 @@ async def test_get_all(
     assert devices[1].app_session_id == device2.app_session_id
 
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_iter_all(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    app_session_ids = [uuid.UUID(int=n) for n in range(5)]
+    for app_session_id in reversed(app_session_ids):
+        await domika_device_factory(app_session_id=app_session_id)
+
+    devices = [d async for d in device_service.iter_all(db_session, page_size=2)]
+
+    assert [d.app_session_id for d in devices] == app_session_ids
+
+
 @pytest.mark.asyncio(loop_scope="session")
 async def test_get_all_with_push_session_id(
     db_session: AsyncSession,
@@ -82,8 +174,7 @@ async def test_get_all_with_push_session_id(
 
     devices = await device_service.get_all_with_push_session_id(db_session)
 
-    assert len(devices) == 1
-    assert devices[0].app_session_id == device1.app_session_id
+    assert devices == [DeviceRecord.from_device(device1)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -99,24 +190,41 @@ async def test_get_all_with_push_session_id_no_db_session(
     assert devices[0].app_session_id == device1.app_session_id
 
 
+async def _cached_app_session_ids() -> list[uuid.UUID]:
+    """Return app session ids of the cached devices, fail if cache is not loaded."""
+    with patch.object(
+        device_service.get_all_with_push_session_id,
+        "without_cache",
+        side_effect=AssertionError("cache reloaded"),
+    ):
+        assert device_service.get_all_with_push_session_id.cache_size()
+        devices = await device_service.get_all_with_push_session_id()
+    return sorted(device.app_session_id for device in devices)
+
+
 @pytest.mark.asyncio(loop_scope="session")
 async def test_get_all_with_push_session_id_cache_after_remove_all_with_push_token_hash(
     db_session: AsyncSession,
     domika_device_factory: Callable[..., Awaitable[Device]],
 ) -> None:
-    device1 = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    device1 = await domika_device_factory(
+        app_session_id=uuid.UUID(int=1),
+        push_token_hash="hash",  # noqa: S106
+    )
+    await domika_device_factory(app_session_id=uuid.UUID(int=2), push_token_hash="hash")  # noqa: S106
+    await domika_device_factory(app_session_id=uuid.UUID(int=3))
 
     await device_service.get_all_with_push_session_id(db_session)
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 1
+    assert device_service.get_all_with_push_session_id.cache_size() == 3
 
     await device_service.remove_all_with_push_token_hash(
         db_session,
-        "any_hash",
+        "hash",
         except_device=device1,
     )
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 0
+    assert await _cached_app_session_ids() == [uuid.UUID(int=1), uuid.UUID(int=3)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -130,17 +238,22 @@ async def test_get_all_with_push_session_id_cache_after_create(
 
     assert device_service.get_all_with_push_session_id.cache_size() == 1
 
-    await device_service.create(
-        db_session,
-        DomikaDeviceCreate(
-            app_session_id=uuid.UUID(int=2),
-            user_id="user_id",
-            push_session_id=uuid.uuid4(),
-            push_token_hash="push_token_hash",  # noqa: S106
-        ),
-    )
+    for app_session_id, push_session_id in (
+        (uuid.UUID(int=2), uuid.uuid4()),
+        (uuid.UUID(int=3), None),
+    ):
+        await device_service.create(
+            db_session,
+            DomikaDeviceCreate(
+                app_session_id=app_session_id,
+                user_id="user_id",
+                push_session_id=push_session_id,
+                push_token_hash="push_token_hash",  # noqa: S106
+            ),
+        )
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 0
+    # Device without push_session_id is not added.
+    assert await _cached_app_session_ids() == [uuid.UUID(int=1), uuid.UUID(int=2)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -149,20 +262,25 @@ async def test_get_all_with_push_session_id_cache_after_update(
     domika_device_factory: Callable[..., Awaitable[Device]],
 ) -> None:
     device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    await domika_device_factory(app_session_id=uuid.UUID(int=2))
 
     await device_service.get_all_with_push_session_id(db_session)
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 1
+    assert device_service.get_all_with_push_session_id.cache_size() == 2
 
-    # When update arguments other than push_session_id than cache should not be cleared.
-    await device_service.update(db_session, device, DomikaDeviceUpdate(last_update=0))
+    push_session_id = uuid.uuid4()
+    await device_service.update(
+        db_session,
+        device,
+        DomikaDeviceUpdate(push_session_id=push_session_id),
+    )
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 1
+    devices = await device_service.get_all_with_push_session_id()
+    assert push_session_id in {d.push_session_id for d in devices}
 
-    # Cache must be cleared here.
     await device_service.update(db_session, device, DomikaDeviceUpdate(push_session_id=None))
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 0
+    assert await _cached_app_session_ids() == [uuid.UUID(int=2)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -170,29 +288,29 @@ async def test_get_all_with_push_session_id_cache_after_update_in_place(
     db_session: AsyncSession,
     domika_device_factory: Callable[..., Awaitable[Device]],
 ) -> None:
-    device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    device = await domika_device_factory(app_session_id=uuid.UUID(int=1), push_session_id=None)
+    await domika_device_factory(app_session_id=uuid.UUID(int=2))
 
     await device_service.get_all_with_push_session_id(db_session)
 
     assert device_service.get_all_with_push_session_id.cache_size() == 1
 
-    # When update arguments other than push_session_id than cache should not be cleared.
+    # Device which gets push_session_id is added.
     await device_service.update_in_place(
         db_session,
         device.app_session_id,
-        DomikaDeviceUpdate(last_update=0),
+        DomikaDeviceUpdate(push_session_id=uuid.uuid4()),
     )
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 1
+    assert await _cached_app_session_ids() == [uuid.UUID(int=1), uuid.UUID(int=2)]
 
-    # Cache must be cleared here.
     await device_service.update_in_place(
         db_session,
         device.app_session_id,
         DomikaDeviceUpdate(push_session_id=None),
     )
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 0
+    assert await _cached_app_session_ids() == [uuid.UUID(int=2)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -201,14 +319,75 @@ async def test_get_all_with_push_session_id_cache_after_delete(
     domika_device_factory: Callable[..., Awaitable[Device]],
 ) -> None:
     device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    await domika_device_factory(app_session_id=uuid.UUID(int=2))
 
     await device_service.get_all_with_push_session_id(db_session)
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 1
+    assert device_service.get_all_with_push_session_id.cache_size() == 2
 
     await device_service.delete(db_session, device.app_session_id)
 
-    assert device_service.get_all_with_push_session_id.cache_size() == 0
+    assert await _cached_app_session_ids() == [uuid.UUID(int=2)]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_all_with_push_session_id_cache_after_rollback(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+
+    await device_service.get_all_with_push_session_id(db_session)
+    await device_service.delete(db_session, device.app_session_id, commit=False)
+    await db_session.rollback()
+
+    assert await _cached_app_session_ids() == [uuid.UUID(int=1)]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_all_with_push_session_id_not_cached_uncommitted(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    await domika_device_factory(app_session_id=uuid.UUID(int=2))
+
+    await device_service.delete(db_session, device.app_session_id, commit=False)
+    devices = await device_service.get_all_with_push_session_id(db_session)
+    await db_session.rollback()
+
+    assert [d.app_session_id for d in devices] == [uuid.UUID(int=2)]
+    assert not device_service.get_all_with_push_session_id.cache_size()
+    assert len(await device_service.get_all_with_push_session_id(db_session)) == 2
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_all_with_push_session_id_not_cached_concurrent_commit(
+    db_session: AsyncSession,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    await domika_device_factory(app_session_id=uuid.UUID(int=2))
+
+    load = device_service.get_all_with_push_session_id.without_cache
+
+    async def _load_with_concurrent_delete(db_session_: AsyncSession) -> Sequence[DeviceRecord]:
+        records = await load(db_session_)
+        # Delete is committed while records are loading.
+        await device_service.delete(db_session, device.app_session_id)
+        return records
+
+    with patch.object(
+        device_service.get_all_with_push_session_id,
+        "without_cache",
+        _load_with_concurrent_delete,
+    ):
+        devices = await device_service.get_all_with_push_session_id(db_session)
+
+    assert len(devices) == 2
+    assert not device_service.get_all_with_push_session_id.cache_size()
+    await device_service.get_all_with_push_session_id(db_session)
+    assert await _cached_app_session_ids() == [uuid.UUID(int=2)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -253,8 +432,7 @@ async def test_get_all_with_push_token_hash(
 
     devices = await device_service.get_all_with_push_token_hash(db_session, "test1")
 
-    assert len(devices) == 1
-    assert device1.push_token_hash == devices[0].push_token_hash
+    assert devices == [DeviceRecord.from_device(device1)]
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -352,3 +530,41 @@ async def test_delete(
     devices = await device_service.get_all(db_session)
 
     assert not devices
+
+
+async def _query_plan(db_session: AsyncSession, stmt: sqlalchemy.Executable) -> str:
+    compiled = stmt.compile(db_session.bind, compile_kwargs={"literal_binds": True})
+    result = await db_session.execute(sqlalchemy.text(f"EXPLAIN QUERY PLAN {compiled}"))
+    return "\n".join(row.detail for row in result)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.parametrize(
+    ("stmt", "index"),
+    [
+        (
+            sqlalchemy.select(Device).where(Device.push_token_hash == "hash"),  # noqa: S105
+            "ix_devices_push_token_hash",
+        ),
+        (
+            sqlalchemy.delete(Device)
+            .where(Device.push_token_hash == "hash")  # noqa: S105
+            .where(Device.app_session_id != uuid.UUID(int=1)),
+            "ix_devices_push_token_hash",
+        ),
+        (
+            sqlalchemy.select(Device).where(Device.user_id == "user"),
+            "ix_devices_user_id",
+        ),
+        (
+            sqlalchemy.select(Device).where(Device.push_session_id.is_not(None)),
+            "ix_devices_push_session_id",
+        ),
+    ],
+)
+async def test_device_lookup_uses_index(
+    db_session: AsyncSession,
+    stmt: sqlalchemy.Executable,
+    index: str,
+) -> None:
+    assert f"USING INDEX {index}" in await _query_plan(db_session, stmt)
@@ -0,0 +1,132 @@
+# vim: set fileencoding=utf-8
+"""
+Test interned strings.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import uuid
+
+import pytest
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import domika_ha_framework.push_data.service as push_data_service
+import domika_ha_framework.subscription.flow as subscription_flow
+import domika_ha_framework.subscription.service as subscription_service
+from domika_ha_framework.database import interning
+from domika_ha_framework.errors import DatabaseError
+from domika_ha_framework.push_data.models import DomikaPushDataCreate
+
+
+async def _interned_strings(db_session: AsyncSession) -> dict[str, int]:
+    result = await db_session.execute(
+        sqlalchemy.select(interning.InternedString.value, interning.InternedString.id),
+    )
+    return dict(result.all())
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_subscriptions_are_stored_by_id(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id,
+        {"light.kitchen": {"state": 1, "brightness": 0}, "light.hall": {"state": 1}},
+    )
+
+    interned_strings = await _interned_strings(db_session)
+    assert set(interned_strings) == {"light.kitchen", "light.hall", "state", "brightness"}
+
+    result = await db_session.execute(
+        sqlalchemy.text("SELECT typeof(entity_id), typeof(attribute) FROM subscriptions"),
+    )
+    assert set(result.all()) == {("integer", "integer")}
+
+    # Interned strings are loaded from the database.
+    interning.clear()
+    await interning.load(db_session)
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("light.kitchen", "state"): True,
+        ("light.kitchen", "brightness"): False,
+        ("light.hall", "state"): True,
+    }
+    await subscription_flow.resubscribe(db_session, app_session_id, {"light.hall": {"state": 1}})
+    assert await _interned_strings(db_session) == interned_strings
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_intern_after_rollback(db_session: AsyncSession) -> None:
+    await interning.intern(db_session, ["light.kitchen"])
+    await db_session.rollback()
+    assert await _interned_strings(db_session) == {}
+
+    await interning.intern(db_session, ["light.kitchen", "state"])
+    await db_session.commit()
+    interned_strings = await _interned_strings(db_session)
+    assert set(interned_strings) == {"light.kitchen", "state"}
+
+    # Committed strings are not written again.
+    await interning.intern(db_session, ["light.kitchen", "state"])
+    await db_session.commit()
+    assert await _interned_strings(db_session) == interned_strings
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_create_push_data_interns_subscribed_only(
+    db_session: AsyncSession,
+    timestamp_now: int,
+) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(db_session, app_session_id, {"light.kitchen": {"state": 1}})
+
+    push_data = await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id=entity_id,
+                attribute="state",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            )
+            for entity_id in ("light.kitchen", "light.hall")
+        ],
+        returning=True,
+    )
+
+    assert [(pd.entity_id, pd.attribute) for pd in push_data] == [("light.kitchen", "state")]
+    assert set(await _interned_strings(db_session)) == {"light.kitchen", "state"}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_subscriptions_ordered_by_strings(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    # Strings are interned in reverse order.
+    await subscription_flow.resubscribe(db_session, app_session_id, {"light.b": {"b": 1, "a": 1}})
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id,
+        {"light.b": {"b": 1, "a": 1}, "light.a": {"b": 1}},
+    )
+
+    assert await subscription_flow.get_push_attributes(db_session, app_session_id) == [
+        {"entity_id": "light.a", "attributes": ["b"]},
+        {"entity_id": "light.b", "attributes": ["a", "b"]},
+    ]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_not_loaded_interned_string(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(db_session, app_session_id, {"light.kitchen": {"state": 1}})
+
+    # Strings are written by another process.
+    interning.clear()
+    with pytest.raises(DatabaseError, match="is not loaded"):
+        await subscription_service.get(db_session, app_session_id, need_push=None)
@@ -0,0 +1,398 @@
+# vim: set fileencoding=utf-8
+"""
+Test push data flow.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import AsyncGenerator, Generator
+from typing import Any, Awaitable, Callable
+from unittest.mock import patch
+
+import pytest
+from aiohttp import ClientSession
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import domika_ha_framework.device.service as device_service
+import domika_ha_framework.push_data.flow as push_data_flow
+import domika_ha_framework.push_data.scheduler as push_data_scheduler
+import domika_ha_framework.push_data.service as push_data_service
+import domika_ha_framework.subscription.flow as subscription_flow
+from domika_ha_framework import config, push_data, push_server_client
+from domika_ha_framework.device.models import Device
+from domika_ha_framework.errors import DatabaseError
+from domika_ha_framework.push_data.models import (
+    DomikaPushDataCreate,
+    DomikaPushedEvents,
+    DomikaPushOutboxCreate,
+)
+from domika_ha_framework.push_server_errors import PushSessionIdNotFoundError
+
+from .utils import PushServerStub
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_send_critical_push(
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    devices = [await domika_device_factory() for _ in range(5)]
+    await domika_device_factory(push_session_id=None)
+    push_server.delay = 0.05
+
+    outcomes = await push_data_flow.send_critical_push(http_session, {"alert": "smoke"})
+
+    assert sorted(outcome.app_session_id for outcome in outcomes) == sorted(
+        device.app_session_id for device in devices
+    )
+    assert all(outcome.error is None for outcome in outcomes)
+    assert sorted(push_server.pushed_sessions("/notification/critical_push")) == sorted(
+        str(device.push_session_id) for device in devices
+    )
+    # Payload encoded once, and sent concurrently.
+    data = json.dumps({"alert": "smoke"})
+    assert all(body == {"data": data} for _, _, body in push_server.requests)
+    assert push_server.max_in_flight > 1
+    # Every device push has its own idempotency key.
+    keys = {headers["x-idempotency-key"] for _, headers, _ in push_server.requests}
+    assert len(keys) == len(devices)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_send_critical_push_outcome_error(
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory(app_session_id=uuid.UUID(int=1))
+    await domika_device_factory(app_session_id=uuid.UUID(int=2))
+    push_server.statuses[str(device.push_session_id)] = 500
+
+    outcomes = await push_data_flow.send_critical_push(http_session, {})
+
+    failed = [outcome for outcome in outcomes if outcome.error]
+    assert len(outcomes) == 2
+    assert len(failed) == 1
+    assert failed[0].app_session_id == device.app_session_id
+
+
+@pytest.fixture
+def bulk_push() -> Generator[None, None, None]:
+    config.CONFIG.push_server_bulk_push = True
+    config.CONFIG.push_server_bulk_max_sessions = 2
+    yield
+    config.CONFIG.push_server_bulk_push = False
+    config.CONFIG.push_server_bulk_max_sessions = 100
+
+
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.usefixtures("bulk_push")
+async def test_push_registered_events_bulk(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+    timestamp_now: int,
+) -> None:
+    devices = [await domika_device_factory() for _ in range(5)]
+    for device in devices:
+        await subscription_flow.resubscribe(
+            db_session,
+            device.app_session_id,
+            {"ent1": {"attr1": 1}},
+        )
+    await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id="ent1",
+                attribute="attr1",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            ),
+        ],
+    )
+    rejected_app_session_id = devices[0].app_session_id
+    push_server.statuses[str(devices[0].push_session_id)] = 401
+
+    pushed = await push_data_flow.push_registered_events(db_session, http_session)
+
+    # 5 push sessions in batches of 2.
+    assert [path for path, _, _ in push_server.requests] == ["/notification/bulk_push"] * 3
+    assert all(
+        item["idempotency_key"].startswith(item["push_session_id"])
+        for _, _, body in push_server.requests
+        for item in body["items"]
+    )
+    assert len(pushed) == 4
+    assert not await push_data_service.get_all(db_session)
+    assert not await push_data_service.get_outbox(db_session)
+
+    devices_with_push_session = await device_service.get_all_with_push_session_id(db_session)
+    assert len(devices_with_push_session) == 4
+    assert rejected_app_session_id not in {d.app_session_id for d in devices_with_push_session}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_push_registered_events_rejected_push_sessions(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+    timestamp_now: int,
+) -> None:
+    devices = [await domika_device_factory() for _ in range(3)]
+    for device in devices:
+        await subscription_flow.resubscribe(
+            db_session,
+            device.app_session_id,
+            {"ent1": {"attr1": 1}},
+        )
+    await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id="ent1",
+                attribute="attr1",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            ),
+        ],
+    )
+    accepted_app_session_id = devices[0].app_session_id
+    for device in devices[1:]:
+        push_server.statuses[str(device.push_session_id)] = 401
+
+    with patch.object(
+        device_service,
+        "clear_push_session_ids",
+        wraps=device_service.clear_push_session_ids,
+    ) as clear_push_session_ids:
+        pushed = await push_data_flow.push_registered_events(db_session, http_session)
+
+    assert [p.push_session_id for p in pushed] == [devices[0].push_session_id]
+    assert not await push_data_service.get_all(db_session)
+    assert not await push_data_service.get_outbox(db_session)
+    # Rejected push sessions cleared at once.
+    clear_push_session_ids.assert_awaited_once()
+    devices_with_push_session = await device_service.get_all_with_push_session_id(db_session)
+    assert [d.app_session_id for d in devices_with_push_session] == [accepted_app_session_id]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_push_registered_events_outbox_retry(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+    timestamp_now: int,
+) -> None:
+    device = await domika_device_factory()
+    await subscription_flow.resubscribe(db_session, device.app_session_id, {"ent1": {"attr1": 1}})
+    await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id="ent1",
+                attribute="attr1",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            ),
+        ],
+    )
+    push_server.statuses[str(device.push_session_id)] = 500
+
+    assert not await push_data_flow.push_registered_events(db_session, http_session)
+
+    # Push data is claimed, but stays in the outbox until delivered.
+    assert not await push_data_service.get_all(db_session)
+    outbox = await push_data_service.get_outbox(db_session)
+    assert len(outbox) == 1
+    assert outbox[0].attempts == 1
+
+    del push_server.statuses[str(device.push_session_id)]
+    pushed = await push_data_flow.deliver_outbox(db_session, http_session)
+
+    assert [p.push_session_id for p in pushed] == [device.push_session_id]
+    assert pushed[0].events == {"ent1": {"attr1": {"v": "on", "t": timestamp_now}}}
+    assert not await push_data_service.get_outbox(db_session)
+    # Same idempotency key is used for the retry.
+    keys = [headers["x-idempotency-key"] for _, headers, _ in push_server.requests]
+    assert len(keys) == 2
+    assert keys[0] == keys[1]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_deliver_outbox_max_attempts(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory()
+    await push_data_service.create_outbox(
+        db_session,
+        [
+            DomikaPushOutboxCreate(
+                idempotency_key="key",
+                app_session_id=device.app_session_id,
+                push_session_id=device.push_session_id,
+                payload="{}",
+                created=0,
+            ),
+        ],
+    )
+    push_server.statuses[str(device.push_session_id)] = 500
+
+    for _ in range(config.CONFIG.push_outbox_max_attempts):
+        assert not await push_data_flow.deliver_outbox(db_session, http_session)
+
+    assert not await push_data_service.get_outbox(db_session)
+    assert len(push_server.requests) == config.CONFIG.push_outbox_max_attempts
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_deliver_outbox_batches(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    devices = [await domika_device_factory() for _ in range(5)]
+    await push_data_service.create_outbox(
+        db_session,
+        [
+            DomikaPushOutboxCreate(
+                idempotency_key=f"key{i}",
+                app_session_id=device.app_session_id,
+                push_session_id=device.push_session_id,
+                payload="{}",
+                created=0,
+            )
+            for i, device in enumerate(devices)
+        ],
+    )
+    push_server.statuses[str(devices[0].push_session_id)] = 500
+
+    with patch.object(config.CONFIG, "push_outbox_batch_size", 2):
+        pushed = await push_data_flow.deliver_outbox(db_session, http_session)
+
+    # All records are tried once, failed record stays in the outbox.
+    assert len(pushed) == 4
+    assert len(push_server.requests) == 5
+    assert [r.idempotency_key for r in await push_data_service.get_outbox(db_session)] == ["key0"]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_send_critical_push_error_logged(
+    http_session: ClientSession,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with patch.object(
+        device_service,
+        "get_all_with_push_session_id",
+        side_effect=DatabaseError("failed"),
+    ):
+        task = push_data_flow.send_critical_push(http_session, {})
+        await asyncio.wait([task])
+
+    assert "Critical push failed: failed" in caplog.text
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_send_critical_push_rejected_push_sessions(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    push_server: PushServerStub,
+    domika_device_factory: Callable[..., Awaitable[Device]],
+) -> None:
+    device = await domika_device_factory()
+    rejected_app_session_id = device.app_session_id
+    push_server.statuses[str(device.push_session_id)] = 401
+
+    outcomes = await push_data_flow.send_critical_push(http_session, {})
+
+    assert isinstance(outcomes[0].error, PushSessionIdNotFoundError)
+    assert not await device_service.get_all_with_push_session_id(db_session)
+    assert outcomes[0].app_session_id == rejected_app_session_id
+
+
+@pytest.fixture
+async def push_scheduler() -> AsyncGenerator[None, None]:
+    config.CONFIG.push_scheduler = True
+    config.CONFIG.push_scheduler_min_interval = 0.01
+    config.CONFIG.push_scheduler_max_interval = 0.5
+    config.CONFIG.push_scheduler_delay_interval = 0.2
+    await push_server_client.init_client()
+    push_data_scheduler.start_push_scheduler()
+    yield
+    await push_data_scheduler.stop_push_scheduler()
+    await push_server_client.close_client()
+    config.CONFIG.push_scheduler = False
+    config.CONFIG.push_scheduler_min_interval = 1
+    config.CONFIG.push_scheduler_max_interval = 60
+    config.CONFIG.push_scheduler_delay_interval = 1
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_push_scheduler(
+    db_session: AsyncSession,
+    push_server: PushServerStub,
+    push_scheduler: None,  # noqa: ARG001
+    domika_device_factory: Callable[..., Awaitable[Device]],
+    timestamp_now: int,
+) -> None:
+    # Delay cadence may start by a cycle which runs while push data is created.
+    started = time.monotonic()
+    device = await domika_device_factory()
+    await subscription_flow.resubscribe(db_session, device.app_session_id, {"ent1": {"attr1": 1}})
+    await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id="ent1",
+                attribute="attr1",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=1,
+            ),
+        ],
+    )
+    push_cycles = 0
+    push_registered_events = push_data_flow.push_registered_events
+
+    async def _push_registered_events(*args: Any, **kwargs: Any) -> list[DomikaPushedEvents]:
+        nonlocal push_cycles
+        push_cycles += 1
+        return await push_registered_events(*args, **kwargs)
+
+    with patch.object(push_data_flow, "push_registered_events", _push_registered_events):
+        # Wake scheduler up, as push data processor does.
+        push_data.push_data_stored.set()
+
+        await asyncio.wait_for(push_server.received.wait(), 1)
+
+    assert push_server.pushed_sessions("/notification/push") == [str(device.push_session_id)]
+    assert not await push_data_service.get_all(db_session)
+    # Delay is counted by push_scheduler_delay_interval, scheduler does not spin while waiting.
+    assert time.monotonic() - started >= 0.2
+    assert push_cycles <= 3
@@ -23,6 +23,8 @@ import domika_ha_framework.subscription.flow as subscription_flow
 from domika_ha_framework import push_data
 from domika_ha_framework.push_data.models import DomikaPushDataCreate
 
+from .utils import capture_statements, explain_query_plan
+
 
 @pytest.mark.asyncio(loop_scope="session")
 @pytest.mark.push_data_interval(2)
@@ -155,3 +157,135 @@ async def test_create_a_lot_of_events(
     stored_push_data = await push_data_service.get_all(db_session, limit=-1)
 
     assert len(stored_push_data) == 1000
+
+
+async def _process_pushed_data_once():
+    await push_data._process_pushed_data_once(  # noqa: SLF001
+        push_data.events_queue,
+        push_data.confirmed_events_queue,
+        threshold=0,
+        store_chunk_size=push_data.STORE_CHUNK_SIZE,
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_late_confirmed_event(
+    db_session: AsyncSession,
+    http_session: ClientSession,
+    timestamp_now: int,
+):
+    # Create subscriptions.
+    for _ in range(2):
+        await subscription_flow.resubscribe(
+            db_session,
+            app_session_id=uuid.uuid4(),
+            subscriptions={"ent1": {"attr1": 1, "attr2": 1}},
+        )
+
+    push_data_ = [
+        DomikaPushDataCreate(
+            event_id=uuid.uuid4(),
+            entity_id="ent1",
+            attribute=attribute,
+            value="on",
+            context_id="123",
+            timestamp=timestamp_now,
+            delay=0,
+        )
+        for attribute in ("attr1", "attr2")
+    ]
+    await push_data_flow.register_event(
+        http_session,
+        push_data=push_data_,
+        critical_push_needed=False,
+        critical_alert_payload={},
+    )
+    await _process_pushed_data_once()
+    assert len(await push_data_service.get_all(db_session)) == 4
+
+    # Confirm event after it was stored.
+    await push_data_flow.confirm_event([push_data_[0].event_id])
+    await _process_pushed_data_once()
+
+    stored_push_data = await push_data_service.get_all(db_session)
+    assert [pd.attribute for pd in stored_push_data] == ["attr2", "attr2"]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_late_confirmed_events_limit(
+    db_session: AsyncSession,  # noqa: ARG001
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    monkeypatch.setattr(push_data, "LATE_CONFIRMED_EVENTS_MAX_SIZE", 1)
+
+    await push_data_flow.confirm_event([uuid.uuid4() for _ in range(3)])
+    await _process_pushed_data_once()
+
+    assert "2 late event confirmations dropped" in caplog.text
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_iter_all(
+    db_session: AsyncSession,
+    timestamp_now: int,
+):
+    for n in range(3):
+        await subscription_flow.resubscribe(
+            db_session,
+            app_session_id=uuid.UUID(int=n),
+            subscriptions={"ent_1": {"attr_1": 1, "attr_2": 1}, "ent_2": {"attr_1": 1}},
+        )
+    # Push data records share event id, app session id and entity id, so paging must compare
+    # the whole primary key.
+    await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.UUID(int=1),
+                entity_id=entity_id,
+                attribute=attribute,
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            )
+            for entity_id, attribute in (
+                ("ent_1", "attr_1"),
+                ("ent_1", "attr_2"),
+                ("ent_2", "attr_1"),
+            )
+        ],
+    )
+
+    stored_push_data = await push_data_service.get_all(db_session, limit=-1)
+    iterated_push_data = [pd async for pd in push_data_service.iter_all(db_session, page_size=4)]
+
+    assert len(stored_push_data) == 9
+    assert iterated_push_data == list(stored_push_data)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_create_uses_subscriptions_index(
+    db_session: AsyncSession,
+    timestamp_now: int,
+):
+    with capture_statements(db_session) as statements:
+        await push_data_service.create(
+            db_session,
+            [
+                DomikaPushDataCreate(
+                    event_id=uuid.uuid4(),
+                    entity_id="ent_1",
+                    attribute="attr_1",
+                    value="on",
+                    context_id="123",
+                    timestamp=timestamp_now,
+                    delay=0,
+                ),
+            ],
+        )
+
+    [(statement, parameters)] = [s for s in statements if s[0].startswith("INSERT INTO push_data")]
+    query_plan = await explain_query_plan(db_session, statement, parameters)
+    assert "USING COVERING INDEX ix_subscriptions_entity_id_attribute" in query_plan
@@ -0,0 +1,131 @@
+# vim: set fileencoding=utf-8
+"""
+Test push server client.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+from collections.abc import AsyncGenerator, Generator
+
+import aiohttp
+import pytest
+
+from domika_ha_framework import config, push_server_client
+from domika_ha_framework.push_server_client import LatencyWindow
+from domika_ha_framework.push_server_errors import DomikaPushServerError
+
+
+@pytest.fixture
+async def managed_client() -> AsyncGenerator[aiohttp.ClientSession, None]:
+    config.CONFIG.push_server_managed_client = True
+    config.CONFIG.push_server_connection_limit_per_host = 7
+    try:
+        await push_server_client.init_client()
+        yield push_server_client.get_http_session()
+    finally:
+        await push_server_client.close_client()
+        config.CONFIG.push_server_managed_client = False
+        config.CONFIG.push_server_connection_limit_per_host = 20
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_managed_client(managed_client: aiohttp.ClientSession) -> None:
+    assert isinstance(managed_client.connector, aiohttp.TCPConnector)
+    assert managed_client.connector.limit_per_host == 7
+    assert managed_client.timeout == config.CONFIG.push_server_timeout
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_external_session_preferred(
+    managed_client: aiohttp.ClientSession,
+    http_session: aiohttp.ClientSession,
+) -> None:
+    assert push_server_client.get_http_session(http_session) is http_session
+    assert push_server_client.get_http_session() is managed_client
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_not_initialized() -> None:
+    await push_server_client.init_client()
+
+    with pytest.raises(DomikaPushServerError):
+        push_server_client.get_http_session()
+
+
+@pytest.fixture
+def adaptive_timeout() -> Generator[None, None, None]:
+    config.CONFIG.push_server_adaptive_timeout = True
+    config.CONFIG.push_server_hedging = True
+    config.CONFIG.push_server_latency_min_samples = 10
+    push_server_client._latency.clear()  # noqa: SLF001
+    yield
+    config.CONFIG.push_server_adaptive_timeout = False
+    config.CONFIG.push_server_hedging = False
+    config.CONFIG.push_server_latency_min_samples = 20
+    push_server_client._latency.clear()  # noqa: SLF001
+
+
+def test_latency_window() -> None:
+    window = LatencyWindow(100)
+    for latency in range(200):
+        window.observe(latency / 100)
+
+    assert len(window) == 100
+    assert window.percentile(0.5) == 1.49
+    assert window.percentile(0.99) == 1.98
+    assert window.percentile(1) == 1.99
+
+
+@pytest.mark.usefixtures("adaptive_timeout")
+def test_get_timeout() -> None:
+    # Not enough samples.
+    for _ in range(9):
+        push_server_client.observe_latency("notification/push", 2)
+    assert push_server_client.get_timeout("notification/push") == config.CONFIG.push_server_timeout
+
+    push_server_client.observe_latency("notification/push", 2)
+    assert push_server_client.get_timeout("notification/push").total == 3
+
+    # Timeout limited by floor and ceiling.
+    for _ in range(10):
+        push_server_client.observe_latency("notification/critical_push", 0.01)
+        push_server_client.observe_latency("push_session/create", 100)
+    assert push_server_client.get_timeout("notification/critical_push").total == 1
+    assert push_server_client.get_timeout("push_session/create").total == 10
+
+
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.usefixtures("adaptive_timeout")
+async def test_hedge() -> None:
+    for _ in range(10):
+        push_server_client.observe_latency("notification/critical_push", 0.01)
+
+    delays = [1.0, 0.0]
+    started: list[float] = []
+
+    async def request() -> float:
+        delay = delays[len(started)]
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    # Slow request is reissued, fast one wins.
+    assert await push_server_client.hedge("notification/critical_push", request) == 0
+    assert started == [1.0, 0.0]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_hedge_disabled() -> None:
+    calls: list[None] = []
+
+    async def request() -> int:
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return 1
+
+    assert await push_server_client.hedge("notification/critical_push", request) == 1
+    assert len(calls) == 1
@@ -0,0 +1,98 @@
+# vim: set fileencoding=utf-8
+"""
+Test push rate limiter.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import uuid
+from collections.abc import Generator
+
+import pytest
+
+from domika_ha_framework import config
+from domika_ha_framework.push_data import rate_limiter
+from domika_ha_framework.push_data.rate_limiter import PushRateLimiter
+
+
+@pytest.fixture
+def push_rate_limits() -> Generator[dict[str, config.PushRateLimit], None, None]:
+    """Set push rate limits for the test, restore config afterwards."""
+    limits = {
+        config.DEFAULT_DEVICE_CLASS: config.PushRateLimit(capacity=1, refill_rate=0),
+        "tablet": config.PushRateLimit(capacity=3, refill_rate=0),
+    }
+    config.CONFIG.push_rate_limits = limits
+    yield limits
+    config.CONFIG.push_rate_limits = {}
+    config.CONFIG.push_device_class = None
+    rate_limiter.push_rate_limiter.clear()
+
+
+def test_try_acquire() -> None:
+    limiter = PushRateLimiter()
+    limit = config.PushRateLimit(capacity=2, refill_rate=1)
+    push_session_id = uuid.uuid4()
+
+    assert limiter.try_acquire(push_session_id, limit, now=0)
+    assert limiter.try_acquire(push_session_id, limit, now=0)
+    # Bucket is empty.
+    assert not limiter.try_acquire(push_session_id, limit, now=0.5)
+    # Other push sessions are not affected.
+    assert limiter.try_acquire(uuid.uuid4(), limit, now=0.5)
+    # One token refilled.
+    assert limiter.try_acquire(push_session_id, limit, now=1.5)
+    assert not limiter.try_acquire(push_session_id, limit, now=1.5)
+
+
+def test_retry_after() -> None:
+    limiter = PushRateLimiter()
+    limit = config.PushRateLimit(capacity=1, refill_rate=2)
+    push_session_id = uuid.uuid4()
+
+    assert limiter.retry_after(push_session_id, now=0) == 0
+    assert limiter.try_acquire(push_session_id, limit, now=0)
+    assert limiter.retry_after(push_session_id, now=0.25) == 0.25
+    # Token is not taken.
+    assert limiter.retry_after(push_session_id, now=0.5) == 0
+    assert limiter.try_acquire(push_session_id, limit, now=0.5)
+
+
+def test_prune() -> None:
+    limiter = PushRateLimiter(max_buckets=2)
+    limit = config.PushRateLimit(capacity=1, refill_rate=1)
+
+    limiter.try_acquire(uuid.UUID(int=1), limit, now=0)
+    limiter.try_acquire(uuid.UUID(int=2), limit, now=5)
+    limiter.try_acquire(uuid.UUID(int=3), limit, now=5.5)
+
+    # Bucket 1 was refilled and pruned, bucket 2 is still in use.
+    assert len(limiter) == 2
+
+
+@pytest.mark.usefixtures("push_rate_limits")
+def test_push_allowed_by_device_class() -> None:
+    tablet = uuid.UUID(int=1)
+    config.CONFIG.push_device_class = lambda app_session_id: (
+        "tablet" if app_session_id == tablet else "phone"
+    )
+
+    assert [rate_limiter.push_allowed(tablet, uuid.UUID(int=10)) for _ in range(4)] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+    # Unknown device class falls back to the default limit.
+    assert [rate_limiter.push_allowed(uuid.UUID(int=2), uuid.UUID(int=20)) for _ in range(2)] == [
+        True,
+        False,
+    ]
+
+
+def test_push_allowed_without_limits() -> None:
+    push_session_id = uuid.uuid4()
+    assert all(rate_limiter.push_allowed(uuid.uuid4(), push_session_id) for _ in range(100))
@@ -0,0 +1,332 @@
+# vim: set fileencoding=utf-8
+"""
+Test subscription flow.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import domika_ha_framework.push_data.service as push_data_service
+import domika_ha_framework.subscription.flow as subscription_flow
+import domika_ha_framework.subscription.service as subscription_service
+from domika_ha_framework.database import core as database_core
+from domika_ha_framework.errors import InvalidPatternError
+from domika_ha_framework.push_data.models import DomikaPushDataCreate
+
+from .utils import capture_statements, explain_query_plan
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_resubscribe(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id,
+        {"ent1": {"attr1": 1, "attr2": 0}, "ent2": {"attr1": 1}},
+    )
+
+    with capture_statements(db_session) as statements:
+        await subscription_flow.resubscribe(
+            db_session,
+            app_session_id,
+            {"ent1": {"attr1": 0, "attr2": 0, "attr3": 1}, "ent3": {"attr1": 1}},
+        )
+
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("ent1", "attr1"): False,
+        ("ent1", "attr2"): False,
+        ("ent1", "attr3"): True,
+        ("ent3", "attr1"): True,
+    }
+    # Diff is applied with one statement per operation, new strings are interned with one more.
+    assert sorted(s.split(maxsplit=1)[0] for s, _ in statements) == [
+        "DELETE",
+        "INSERT",
+        "INSERT",
+        "SELECT",
+        "UPDATE",
+    ]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_resubscribe_keyword_arguments(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(
+        db_session=db_session,
+        app_session_id=app_session_id,
+        subscriptions={"ent1": {"attr1": 1}},
+    )
+
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("ent1", "attr1"): True,
+    }
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_resubscribe_push(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id,
+        {"ent1": {"attr1": 1, "attr2": 0}, "ent2": {"attr1": 1, "attr2": 0}},
+    )
+
+    changed = await subscription_flow.resubscribe_push(
+        db_session,
+        app_session_id,
+        {"ent1": {"attr1", "attr2"}, "ent3": {"attr1"}},
+    )
+
+    assert changed == 2
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("ent1", "attr1"): True,
+        ("ent1", "attr2"): True,
+        ("ent2", "attr1"): False,
+        ("ent2", "attr2"): False,
+    }
+
+    changed = await subscription_flow.resubscribe_push(
+        db_session,
+        app_session_id,
+        {"ent1": {"attr1", "attr2"}},
+    )
+
+    assert changed == 0
+
+    changed = await subscription_flow.resubscribe_push(db_session, app_session_id, {})
+
+    assert changed == 2
+    assert not any((await subscription_service.get_need_push(db_session, app_session_id)).values())
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_resubscribe_push_many(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id,
+        {"ent1": {"attr1": 0, "attr2": 0}},
+    )
+
+    # More pairs than SQLite allows statement parameters.
+    subscriptions = {f"ent{i}": {"attr1"} for i in range(40000)}
+    with capture_statements(db_session) as statements:
+        changed = await subscription_flow.resubscribe_push(
+            db_session,
+            app_session_id,
+            subscriptions,
+        )
+
+    assert changed == 1
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("ent1", "attr1"): True,
+        ("ent1", "attr2"): False,
+    }
+    # Pairs are bound once, as a single parameter.
+    [(_, parameters)] = [s for s in statements if s[0].startswith("WITH")]
+    assert len(parameters) == 4
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_apply_subscription_delta(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id,
+        {"ent1": {"attr1": 1, "attr2": 0}, "ent2": {"attr1": 1, "attr2": 0}},
+    )
+
+    assert await subscription_flow.apply_subscription_delta(
+        db_session,
+        app_session_id,
+        version=1,
+        added={"ent1": {"attr2": 1}, "ent3": {"attr1": 0}},
+        removed={"ent2": {"attr1"}},
+        push_on={"ent3": {"attr1"}},
+        push_off={"ent1": {"attr1"}},
+    )
+
+    expected = {
+        ("ent1", "attr1"): False,
+        ("ent1", "attr2"): True,
+        ("ent2", "attr2"): False,
+        ("ent3", "attr1"): True,
+    }
+    assert await subscription_service.get_need_push(db_session, app_session_id) == expected
+    assert await subscription_service.get_version(db_session, app_session_id) == 1
+
+    # Retry of the applied delta is ignored.
+    assert not await subscription_flow.apply_subscription_delta(
+        db_session,
+        app_session_id,
+        version=1,
+        removed={"ent1": {"attr1", "attr2"}},
+    )
+    assert await subscription_service.get_need_push(db_session, app_session_id) == expected
+
+    assert await subscription_flow.apply_subscription_delta(
+        db_session,
+        app_session_id,
+        version=2,
+        removed={"ent1": {"attr1", "attr2"}},
+    )
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("ent2", "attr2"): False,
+        ("ent3", "attr1"): True,
+    }
+    assert await subscription_service.get_version(db_session, app_session_id) == 2
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_apply_subscription_delta_keyword_arguments(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+
+    assert await subscription_flow.apply_subscription_delta(
+        db_session=db_session,
+        app_session_id=app_session_id,
+        version=1,
+        added={"ent1": {"attr1": 1}},
+    )
+    assert await subscription_service.get_need_push(db_session, app_session_id) == {
+        ("ent1", "attr1"): True,
+    }
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_apply_subscription_delta_same_version(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(db_session, app_session_id, {"ent1": {"attr1": 1}})
+
+    async def apply(added: dict[str, dict[str, int]]) -> bool:
+        async with database_core.get_session() as session:
+            return await subscription_flow.apply_subscription_delta(
+                session,
+                app_session_id,
+                version=1,
+                added=added,
+            )
+
+    # Different deltas with the same version are not coalesced, only one of them is applied.
+    results = await asyncio.gather(apply({"ent2": {"attr1": 1}}), apply({"ent3": {"attr1": 1}}))
+
+    assert sorted(results) == [False, True]
+    assert len(await subscription_service.get_need_push(db_session, app_session_id)) == 2
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_delete_keeps_patterns_and_versions(db_session: AsyncSession) -> None:
+    app_session_id = uuid.uuid4()
+    await subscription_flow.resubscribe(db_session, app_session_id, {"ent1": {"attr1": 1}})
+    await subscription_flow.resubscribe_patterns(db_session, app_session_id, {"light.*": {"*": 1}})
+    await subscription_flow.apply_subscription_delta(db_session, app_session_id, version=1)
+
+    assert await subscription_service.delete(db_session, app_session_id) == 1
+    assert not await subscription_service.get_need_push(db_session, app_session_id)
+    assert await subscription_service.get_patterns(db_session, app_session_id)
+    assert await subscription_service.get_version(db_session, app_session_id) == 1
+
+    assert await subscription_service.delete_patterns(db_session, app_session_id) == 1
+    assert not await subscription_service.get_patterns(db_session, app_session_id)
+    assert not await subscription_flow.get_app_session_id_by_attributes(
+        db_session,
+        "light.kitchen",
+        ["state"],
+    )
+
+    assert await subscription_service.delete_versions(db_session, app_session_id) == 1
+    assert await subscription_service.get_version(db_session, app_session_id) == 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_app_session_id_by_attributes_uses_index(db_session: AsyncSession) -> None:
+    with capture_statements(db_session) as statements:
+        await subscription_flow.get_app_session_id_by_attributes(
+            db_session,
+            "ent1",
+            ["attr1", "attr2"],
+        )
+
+    [(statement, parameters)] = [s for s in statements if "FROM subscriptions" in s[0]]
+    query_plan = await explain_query_plan(db_session, statement, parameters)
+    assert "USING COVERING INDEX ix_subscriptions_entity_id_attribute" in query_plan
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_resubscribe_patterns(
+    db_session: AsyncSession,
+    timestamp_now: int,
+) -> None:
+    app_session_id1 = uuid.UUID(int=1)
+    app_session_id2 = uuid.UUID(int=2)
+    await subscription_flow.resubscribe(
+        db_session,
+        app_session_id1,
+        {"light.kitchen": {"state": 1}},
+    )
+    await subscription_flow.resubscribe_patterns(
+        db_session,
+        app_session_id2,
+        {"light.*": {"state": 1}, "sensor.*": {"*": 0}},
+    )
+
+    assert await subscription_service.get_patterns(db_session, app_session_id2) == {
+        ("light.*", "state"): True,
+        ("sensor.*", "*"): False,
+    }
+    assert await subscription_flow.get_app_session_id_by_attributes(
+        db_session,
+        "light.kitchen",
+        ["state"],
+    ) == [app_session_id1, app_session_id2]
+    assert await subscription_flow.get_app_session_id_by_attributes(
+        db_session,
+        "sensor.temperature",
+        ["state"],
+    ) == [app_session_id2]
+
+    push_data = await push_data_service.create(
+        db_session,
+        [
+            DomikaPushDataCreate(
+                event_id=uuid.uuid4(),
+                entity_id=entity_id,
+                attribute="state",
+                value="on",
+                context_id="123",
+                timestamp=timestamp_now,
+                delay=0,
+            )
+            for entity_id in ("light.kitchen", "light.hall", "sensor.temperature")
+        ],
+        returning=True,
+    )
+
+    assert sorted((pd.app_session_id, pd.entity_id) for pd in push_data) == [
+        (app_session_id1, "light.kitchen"),
+        (app_session_id2, "light.hall"),
+        (app_session_id2, "light.kitchen"),
+    ]
+
+    # Pattern subscriptions are replaced.
+    await subscription_flow.resubscribe_patterns(db_session, app_session_id2, {})
+
+    assert await subscription_flow.get_app_session_id_by_attributes(
+        db_session,
+        "light.kitchen",
+        ["state"],
+    ) == [app_session_id1]
+
+    with pytest.raises(InvalidPatternError):
+        await subscription_flow.resubscribe_patterns(
+            db_session,
+            app_session_id2,
+            {"light.kitchen": {"state": 1}},
+        )
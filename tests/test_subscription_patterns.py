@@ -0,0 +1,48 @@
+# vim: set fileencoding=utf-8
+"""
+Test subscription patterns.
+
+(c) DevPocket, 2024
+
+
+Author(s): Artem Bezborodko
+"""
+
+import uuid
+
+import pytest
+
+from domika_ha_framework.errors import InvalidPatternError
+from domika_ha_framework.subscription.patterns import PatternMatcher, entity_prefix
+
+
+def test_entity_prefix() -> None:
+    assert entity_prefix("binary_sensor.*") == "binary_sensor."
+    assert entity_prefix("*") == ""
+
+    for entity_pattern in ("binary_sensor.door", "binary_sensor.*_door", ""):
+        with pytest.raises(InvalidPatternError):
+            entity_prefix(entity_pattern)
+
+
+def test_pattern_matcher() -> None:
+    app_session_id1 = uuid.UUID(int=1)
+    app_session_id2 = uuid.UUID(int=2)
+    app_session_id3 = uuid.UUID(int=3)
+
+    matcher = PatternMatcher()
+    assert not matcher
+
+    matcher.add(app_session_id1, "binary_sensor.*", "state", need_push=True)
+    matcher.add(app_session_id2, "binary_sensor.door_*", "*", need_push=False)
+    matcher.add(app_session_id2, "*", "state", need_push=True)
+    matcher.add(app_session_id3, "light.*", "*", need_push=True)
+
+    assert len(matcher) == 4
+    assert matcher.match("binary_sensor.door_1", "state") == {
+        app_session_id1: True,
+        app_session_id2: True,
+    }
+    assert matcher.match("binary_sensor.door_1", "battery") == {app_session_id2: False}
+    assert matcher.match("binary_sensor.window", "battery") == {}
+    assert matcher.match("light.kitchen", "brightness") == {app_session_id3: True}
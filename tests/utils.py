@@ -8,7 +8,15 @@ Test utils.
 Author(s): Artem Bezborodko
 """
 
+import asyncio
+import contextlib
+from collections.abc import Generator
 from enum import Enum
+from typing import Any
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 class NotSet(Enum):
@@ -19,3 +27,79 @@ class NotSet(Enum):
 
 # Not set sentinel value.
 NOT_SET = NotSet.token
+
+
+@contextlib.contextmanager
+def capture_statements(db_session: AsyncSession) -> Generator[list[tuple[str, Any]], None, None]:
+    """Record SQL statements and their parameters executed by the database session engine."""
+    statements: list[tuple[str, Any]] = []
+
+    def _before_cursor_execute(*args: Any):
+        statements.append((args[2], args[3]))
+
+    engine = db_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+async def explain_query_plan(db_session: AsyncSession, statement: str, parameters: Any) -> str:
+    """Return query plan of recorded SQL statement."""
+    connection = await db_session.connection()
+    result = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return "\n".join(row.detail for row in result)
+
+
+class PushServerStub:
+    """
+    Push server stub.
+
+    Records received requests, replies with 204, or with status set for the push session id.
+    """
+
+    def __init__(self):
+        self.requests: list[tuple[str, dict[str, str], dict]] = []
+        self.statuses: dict[str, int] = {}
+        self.delay: float = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Set on every received request.
+        self.received = asyncio.Event()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Handle push server request."""
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            body = await request.json()
+            self.requests.append((request.path, dict(request.headers), body))
+            self.received.set()
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            return web.Response(status=self.statuses.get(request.headers.get("x-session-id"), 204))
+        finally:
+            self.in_flight -= 1
+
+    async def handle_bulk(self, request: web.Request) -> web.Response:
+        """Handle push server bulk push request."""
+        body = await request.json()
+        self.requests.append((request.path, dict(request.headers), body))
+        self.received.set()
+        return web.json_response(
+            {
+                "results": [
+                    {
+                        "push_session_id": item["push_session_id"],
+                        "status": self.statuses.get(item["push_session_id"], 204),
+                    }
+                    for item in body["items"]
+                ],
+            },
+            status=207,
+        )
+
+    def pushed_sessions(self, path: str) -> list[str]:
+        """Return push session ids of the requests received on the path."""
+        return [headers["x-session-id"] for path_, headers, _ in self.requests if path_ == path]